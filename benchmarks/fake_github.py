@@ -0,0 +1,267 @@
+import argparse
+import asyncio
+import functools
+import hashlib
+import json
+import time
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+import numpy as np
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+# Owner of the benchmarked repositories, the repository of a scenario is named after it
+BENCH_OWNER = "bench"
+# GitHub doesn't paginate stargazers beyond 400 pages
+MAX_STARGAZER_PAGES = 400
+MAX_PER_PAGE = 100
+STAR_MEDIA_TYPE = "application/vnd.github.star+json"
+# Date of the first generated star, stars are then a minute apart
+EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+
+@dataclass
+class Scenario:
+    """
+    Shape of a synthetic star graph.
+
+    The numbers of repositories starred by the stargazers follow a Pareto distribution starting at `min_starred`,
+    and the popularity of the repositories a Zipf distribution of exponent `popularity_exponent`, so a few
+    repositories are starred by most stargazers, like on GitHub.
+
+    Attributes:
+        name (str): The name of the scenario and of the benchmarked repository.
+        stargazers (int): The number of stargazers of the benchmarked repository.
+        repos (int): The number of other repositories.
+        min_starred (int): The minimum number of repositories starred by a stargazer.
+        max_starred (int): The maximum number of repositories starred by a stargazer.
+        starred_alpha (float): The shape of the Pareto distribution, lower values give heavier starrers.
+        popularity_exponent (float): The exponent of the Zipf distribution of the repositories.
+        seed (int): The seed of the generator, the same seed always gives the same graph.
+    """
+    name: str
+    stargazers: int
+    repos: int = 20000
+    min_starred: int = 5
+    max_starred: int = 1000
+    starred_alpha: float = 1.5
+    popularity_exponent: float = 1.1
+    seed: int = 0
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    scenario.name: scenario for scenario in (
+        Scenario("small", stargazers=200),
+        Scenario("large", stargazers=10000, starred_alpha=2.0),
+        Scenario("heavy-starrers", stargazers=300, min_starred=1000, max_starred=5000, starred_alpha=1.2),
+    )
+}
+
+
+class StarGraph:
+    """
+    A synthetic star graph generated from a scenario.
+
+    The benchmarked repository is `bench/<scenario>`, the other repositories are `owner<i>/repo<i>`. Stars of the
+    benchmarked repository are the oldest of every stargazer, so its stargazers are listed in a stable order.
+    """
+
+    def __init__(self, scenario: Scenario):
+        self.scenario = scenario
+        self.repository = f"{BENCH_OWNER}/{scenario.name}"
+        rng = np.random.default_rng(scenario.seed)
+
+        self.logins = [f"user{user_id}" for user_id in range(scenario.stargazers)]
+        self._user_ids = {login: user_id for user_id, login in enumerate(self.logins)}
+        popularity = 1 / np.arange(1, scenario.repos + 1) ** scenario.popularity_exponent
+        popularity /= popularity.sum()
+        counts = np.minimum(scenario.min_starred * (1 + rng.pareto(scenario.starred_alpha, scenario.stargazers)),
+                            scenario.max_starred).astype(np.int64)
+        self.starred: List[np.ndarray] = []
+        for count in counts:
+            # Drawing with replacement then dropping duplicates is much faster than drawing without replacement
+            repo_ids = np.unique(rng.choice(scenario.repos, size=min(count, scenario.repos), p=popularity))
+            self.starred.append(rng.permutation(repo_ids))
+        stars = np.bincount(np.concatenate(self.starred), minlength=scenario.repos) if self.starred else \
+            np.zeros(scenario.repos, dtype=np.int64)
+        # Repositories are also starred by users outside of the graph
+        self.stargazers_counts = stars * 10 + rng.integers(0, 10, scenario.repos)
+
+    def get_repository(self, full_name: str) -> Dict:
+        if full_name == self.repository:
+            return {"full_name": full_name, "stargazers_count": len(self.logins)}
+        return {"full_name": full_name, "stargazers_count": int(self.stargazers_counts[_repo_id(full_name)])}
+
+    def get_stargazers(self, start: int, stop: int, star_media_type: bool) -> List[Dict]:
+        stargazers = []
+        for user_id in range(start, min(stop, len(self.logins))):
+            user = {"login": self.logins[user_id]}
+            stargazers.append({"starred_at": _date(user_id), "user": user} if star_media_type else user)
+        return stargazers
+
+    def get_starred(self, login: str, start: int, stop: int, star_media_type: bool) -> List[Dict]:
+        user_id = self._user_ids[login]
+        starred = self.starred[user_id]
+        repos = []
+        # Most recent first, the benchmarked repository being the oldest star
+        for index in range(start, min(stop, len(starred) + 1)):
+            if index == len(starred):
+                repo, starred_at = self.get_repository(self.repository), _date(user_id)
+            else:
+                repo_id = int(starred[index])
+                repo = {"full_name": _full_name(repo_id), "stargazers_count": int(self.stargazers_counts[repo_id])}
+                starred_at = _date(len(self.logins) + user_id * self.scenario.max_starred + len(starred) - index)
+            repos.append({"starred_at": starred_at, "repo": repo} if star_media_type else repo)
+        return repos
+
+    def count_starred(self, login: str) -> int:
+        return len(self.starred[self._user_ids[login]]) + 1
+
+
+def create_app(graph: StarGraph, latency: float = 0.0, rate_limit: int = 1_000_000) -> Starlette:
+    """
+    Create a server simulating the endpoints of the GitHub REST API used by the service.
+
+    Responses are paginated with Link headers, carry ETags and rate limit headers, and are delayed by `latency`
+    seconds. Conditional requests are answered with 304 Not Modified. The number of requests and of bytes served
+    are exposed on /_stats and reset with a POST on the same path.
+
+    Args:
+        graph (StarGraph): The star graph to serve.
+        latency (float): The delay added to every response, in seconds.
+        rate_limit (int): The number of requests allowed per hour, requests beyond it are rejected with 403.
+
+    Returns:
+        Starlette: The application.
+    """
+    stats = {"requests": 0, "bytes": 0, "notModified": 0}
+    window = {"reset": int(time.time()) + 3600, "used": 0}
+
+    def rate_limit_headers() -> Dict[str, str]:
+        now = int(time.time())
+        if now >= window["reset"]:
+            window["reset"], window["used"] = now + 3600, 0
+        return {
+            "X-RateLimit-Limit": str(rate_limit),
+            "X-RateLimit-Remaining": str(max(rate_limit - window["used"], 0)),
+            "X-RateLimit-Reset": str(window["reset"]),
+            "X-RateLimit-Used": str(window["used"]),
+            "X-RateLimit-Resource": "core",
+        }
+
+    @functools.lru_cache(maxsize=100_000)
+    def render(content_key: tuple) -> tuple:
+        # Pages are rendered once, so serving them again costs the simulator little CPU
+        kind, *args = content_key
+        content = getattr(graph, f"get_{kind}")(*args)
+        body = json.dumps(content, separators=(",", ":")).encode()
+        return body, f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+    async def respond(request: Request, content_key: tuple, total: int = None) -> Response:
+        if latency:
+            await asyncio.sleep(latency)
+        stats["requests"] += 1
+        window["used"] += 1
+        headers = rate_limit_headers()
+        if window["used"] > rate_limit:
+            body = json.dumps({"message": "API rate limit exceeded"}).encode()
+            stats["bytes"] += len(body)
+            return Response(body, status_code=403, headers=headers, media_type="application/json")
+
+        if total is not None:
+            headers.update(_link_headers(request, total))
+        body, etag = render(content_key)
+        headers["ETag"] = etag
+        if request.headers.get("if-none-match") == etag:
+            stats["notModified"] += 1
+            return Response(status_code=304, headers=headers)
+        stats["bytes"] += len(body)
+        return Response(body, headers=headers, media_type="application/json")
+
+    async def get_repository(request: Request) -> Response:
+        owner, repo = request.path_params["owner"], request.path_params["repo"]
+        return await respond(request, ("repository", f"{owner}/{repo}"))
+
+    async def get_stargazers(request: Request) -> Response:
+        if f"{request.path_params['owner']}/{request.path_params['repo']}" != graph.repository:
+            return await respond(request, ("stargazers", 0, 0, False), total=0)
+        page, per_page = _get_page(request)
+        total = min(len(graph.logins), MAX_STARGAZER_PAGES * per_page)
+        start = (page - 1) * per_page if page <= MAX_STARGAZER_PAGES else total
+        content_key = ("stargazers", start, min(start + per_page, total), _is_star_media_type(request))
+        return await respond(request, content_key, total=total)
+
+    async def get_starred(request: Request) -> Response:
+        login = request.path_params["login"]
+        page, per_page = _get_page(request)
+        start = (page - 1) * per_page
+        content_key = ("starred", login, start, start + per_page, _is_star_media_type(request))
+        return await respond(request, content_key, total=graph.count_starred(login))
+
+    async def get_stats(_: Request) -> Response:
+        return JSONResponse({**stats, "scenario": asdict(graph.scenario)})
+
+    async def reset_stats(_: Request) -> Response:
+        stats.update(requests=0, bytes=0, notModified=0)
+        return JSONResponse(stats)
+
+    return Starlette(routes=[
+        Route("/repos/{owner}/{repo}", get_repository),
+        Route("/repos/{owner}/{repo}/stargazers", get_stargazers),
+        Route("/users/{login}/starred", get_starred),
+        Route("/_stats", get_stats, methods=["GET"]),
+        Route("/_stats", reset_stats, methods=["POST"]),
+    ])
+
+
+def _get_page(request: Request) -> tuple:
+    page = max(int(request.query_params.get("page", 1)), 1)
+    per_page = min(max(int(request.query_params.get("per_page", 30)), 1), MAX_PER_PAGE)
+    return page, per_page
+
+
+def _is_star_media_type(request: Request) -> bool:
+    return STAR_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def _link_headers(request: Request, total: int) -> Dict[str, str]:
+    page, per_page = _get_page(request)
+    last_page = max(-(-total // per_page), 1)
+    links = []
+    if page < last_page:
+        links.append(f'<{request.url.include_query_params(page=page + 1)}>; rel="next"')
+    if last_page > 1:
+        links.append(f'<{request.url.include_query_params(page=last_page)}>; rel="last"')
+    return {"Link": ", ".join(links)} if links else {}
+
+
+def _full_name(repo_id: int) -> str:
+    return f"owner{repo_id}/repo{repo_id}"
+
+
+def _repo_id(full_name: str) -> int:
+    return int(full_name.rsplit("/repo", 1)[1])
+
+
+def _date(minutes: int) -> str:
+    return (EPOCH + timedelta(minutes=minutes)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a synthetic star graph through a fake GitHub REST API.")
+    parser.add_argument("--scenario", choices=SCENARIOS, default="small")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.0, help="Delay of every response, in seconds")
+    parser.add_argument("--rate-limit", type=int, default=1_000_000, help="Requests allowed per hour")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    scenario = SCENARIOS[args.scenario]
+    scenario.seed = args.seed
+    # Idle connections are kept open long enough for the pooled connections of the service not to be dropped
+    uvicorn.run(create_app(StarGraph(scenario), args.latency, args.rate_limit), host="127.0.0.1", port=args.port,
+                log_level="warning", timeout_keep_alive=120)
@@ -0,0 +1,193 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import httpx
+import numpy as np
+
+from benchmarks.fake_github import SCENARIOS, BENCH_OWNER
+
+TARGETS = ("function", "route")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _git_revision() -> Dict:
+    def git(*args: str) -> str:
+        return subprocess.run(["git", *args], capture_output=True, text=True).stdout.strip()
+
+    return {"commit": git("rev-parse", "HEAD") or None, "dirty": bool(git("status", "--porcelain", "--", "src"))}
+
+
+def _configure_environment(api_url: str, requests_per_second: float) -> None:
+    """
+    Point the service at the simulator. The services read their configuration when they are imported, so this must
+    run before importing them, and persistent stores are disabled so every run starts from the same state.
+    """
+    state_dir = tempfile.mkdtemp(prefix="stargazer-bench-")
+    os.environ.update({
+        "GITHUB_API_URL": api_url,
+        "GITHUB_BACKEND": "rest",
+        "GITHUB_TOKEN": "bench",
+        "GITHUB_TOKENS": "",
+        "GITHUB_REQUESTS_PER_SECOND": str(requests_per_second),
+        "GITHUB_REQUESTS_BURST": str(max(int(requests_per_second), 1)),
+        "ACCESS_TOKEN_SECRET": os.getenv("ACCESS_TOKEN_SECRET") or "bench-access",
+        "REFRESH_TOKEN_SECRET": os.getenv("REFRESH_TOKEN_SECRET") or "bench-refresh",
+        "LOG_LEVEL": "WARNING",
+        "STARRED_CACHE_DB": "",
+        "NEIGHBOURS_CACHE_DB": "",
+        "STARGAZERS_DB": "",
+        "STAR_GRAPH_DIR": "",
+        "MINHASH_INDEX_PATH": os.path.join(state_dir, "minhash.idx"),
+        "JOBS_DB": os.path.join(state_dir, "jobs.db"),
+        "LOCKS_DIR": os.path.join(state_dir, "locks"),
+    })
+
+
+def _start_simulator(scenario: str, port: int, latency: float, rate_limit: int, seed: int) -> subprocess.Popen:
+    """
+    Start the fake GitHub server in its own process, so its memory and CPU aren't measured, and wait until it serves.
+    """
+    process = subprocess.Popen([sys.executable, "-m", "benchmarks.fake_github", "--scenario", scenario,
+                                "--port", str(port), "--latency", str(latency), "--rate-limit", str(rate_limit),
+                                "--seed", str(seed)])
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The GitHub simulator exited with code {process.returncode}")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/_stats", timeout=1).raise_for_status()
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("The GitHub simulator didn't start")
+
+
+async def _run_target(target: str, scenario: str, api_url: str, iterations: int, warm: bool) -> Dict:
+    # Imported late, once the environment points at the simulator
+    from src.config.urls import API_VERSION, ROUTE_STARNEIGHBOURS
+    from src.main import app
+    from src.services import github_async, starneighbours
+    from src.utils.jwt_handler import JWTHandler
+
+    token = JWTHandler.generate_authentication_tokens({"userName": "bench"})["accessToken"]
+    route = API_VERSION + ROUTE_STARNEIGHBOURS.format(user=BENCH_OWNER, repo=scenario)
+
+    async with httpx.AsyncClient(base_url=api_url) as simulator, \
+            httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://stargazer",
+                              headers={"Authorization": f"Bearer {token}"}, timeout=None) as service:
+        latencies, requests, transferred = [], [], []
+        for _ in range(iterations):
+            if not warm:
+                github_async.starred_repos_cache.clear()
+                starneighbours.neighbours_cache.clear()
+            await simulator.post("/_stats")
+            start = time.perf_counter()
+            if target == "function":
+                await starneighbours.get_repository_neighbours(BENCH_OWNER, scenario)
+            else:
+                (await service.get(route)).raise_for_status()
+            latencies.append(time.perf_counter() - start)
+            stats = (await simulator.get("/_stats")).json()
+            requests.append(stats["requests"])
+            transferred.append(stats["bytes"])
+
+    p50, p99 = np.percentile(latencies, [50, 99])
+    return {
+        "scenario": scenario,
+        "target": target,
+        "iterations": iterations,
+        "warm": warm,
+        "p50": round(float(p50), 4),
+        "p99": round(float(p99), 4),
+        "mean": round(float(np.mean(latencies)), 4),
+        "apiCalls": int(np.median(requests)),
+        "bytes": int(np.median(transferred)),
+        # High-water mark of the whole benchmark process, in KiB on Linux
+        "peakRssKb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def _print_results(results: List[Dict], baseline: Optional[Dict]) -> None:
+    previous = {(result["scenario"], result["target"]): result for result in (baseline or {}).get("results", [])}
+    print(f"{'scenario':<16}{'target':<10}{'p50 (s)':>10}{'p99 (s)':>10}{'API calls':>11}{'bytes':>13}"
+          f"{'peak RSS (KiB)':>16}")
+    for result in results:
+        print(f"{result['scenario']:<16}{result['target']:<10}{result['p50']:>10.3f}{result['p99']:>10.3f}"
+              f"{result['apiCalls']:>11}{result['bytes']:>13}{result['peakRssKb']:>16}")
+        before = previous.get((result["scenario"], result["target"]))
+        if before:
+            deltas = [f"{key} {_delta(before[key], result[key])}" for key in ("p50", "p99", "apiCalls", "bytes")]
+            print(f"{'':<26}vs baseline: {', '.join(deltas)}")
+
+
+def _delta(before: float, after: float) -> str:
+    return f"{(after - before) / before:+.1%}" if before else "n/a"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the neighbours endpoint against a fake GitHub API.")
+    parser.add_argument("--scenario", choices=SCENARIOS, action="append",
+                        help="Scenario to run, can be repeated (default: all)")
+    parser.add_argument("--target", choices=TARGETS, action="append",
+                        help="Run get_repository_neighbours (function) or the HTTP route (route), default: both")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--warm", action="store_true", help="Keep the caches between iterations")
+    parser.add_argument("--latency", type=float, default=0.02, help="Latency of the simulator, in seconds")
+    parser.add_argument("--rate-limit", type=int, default=1_000_000, help="Requests allowed per hour")
+    parser.add_argument("--requests-per-second", type=float, default=1000,
+                        help="Pace of the GitHub requests of the service (GITHUB_REQUESTS_PER_SECOND)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file of a previous run to compare with")
+    args = parser.parse_args()
+
+    port = _free_port()
+    api_url = f"http://127.0.0.1:{port}"
+    _configure_environment(api_url, args.requests_per_second)
+
+    results = []
+    for scenario in args.scenario or list(SCENARIOS):
+        simulator = _start_simulator(scenario, port, args.latency, args.rate_limit, args.seed)
+        try:
+            for target in args.target or TARGETS:
+                results.append(asyncio.run(_run_target(target, scenario, api_url, args.iterations, args.warm)))
+        finally:
+            simulator.terminate()
+            simulator.wait()
+
+    report = {
+        **_git_revision(),
+        "python": platform.python_version(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "settings": {"latency": args.latency, "rateLimit": args.rate_limit, "seed": args.seed,
+                     "requestsPerSecond": args.requests_per_second},
+        "results": results,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    _print_results(results, baseline)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
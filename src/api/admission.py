@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from src.services.github_async import get_repository
+from src.services.scoring import Metric
+from src.services.starneighbours import Sampling, peek_repository_neighbours_entry
+from src.utils.metrics import Counter
+
+load_dotenv()
+
+# Neighbours computations running at the same time, the others wait for a slot in a bounded queue and are rejected
+# once it is full or after the timeout. Results served from the cache don't take a slot
+ADMISSION_MAX_COMPUTATIONS = int(os.getenv("ADMISSION_MAX_COMPUTATIONS", 8))
+ADMISSION_MAX_QUEUED = int(os.getenv("ADMISSION_MAX_QUEUED", 32))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 10))  # in seconds
+# Computations a client can run or queue at the same time
+ADMISSION_CLIENT_CONCURRENCY = int(os.getenv("ADMISSION_CLIENT_CONCURRENCY", 2))
+# Stargazers the computations of a client can process per hour, the budget being refilled continuously
+ADMISSION_CLIENT_BUDGET = int(os.getenv("ADMISSION_CLIENT_BUDGET", 200000))
+
+# Window of the budgets of the clients
+BUDGET_WINDOW = 3600  # in seconds
+
+logger = logging.getLogger('uvicorn.error')
+
+ADMISSION_REJECTED_TOTAL = Counter("admission_rejected_total", "Neighbours computations rejected by the admission "
+                                                               "control", ("reason",))
+
+
+class AdmissionRejected(Exception):
+    """Exception raised when a computation isn't admitted, the client should retry later."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Admission control of the neighbours computations, so a client asking for a huge repository can't take the rate
+    limit and the event loop from everyone else.
+
+    Computations run in a fixed number of slots and wait for one in a bounded queue, so the cheap requests, like the
+    ones served from the cache, keep a low latency under load. A client, identified by the userName of its access
+    token, can run or queue a few computations at the same time, and has an hourly budget of stargazers: the cost of
+    a computation is the number of stargazers it processes, estimated before the fan-out starts. Computations that
+    aren't admitted are rejected, the route answering 429 with a Retry-After, rather than piling up.
+    """
+
+    def __init__(self, max_computations: int = ADMISSION_MAX_COMPUTATIONS, max_queued: int = ADMISSION_MAX_QUEUED,
+                 queue_timeout: float = ADMISSION_QUEUE_TIMEOUT, client_concurrency: int = ADMISSION_CLIENT_CONCURRENCY,
+                 client_budget: int = ADMISSION_CLIENT_BUDGET):
+        self.max_computations = max_computations
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.client_concurrency = client_concurrency
+        self.client_budget = client_budget
+        self.queued = 0
+        self._in_flight: Dict[str, int] = {}
+        # Stargazers left in the budget of each client, and when it was last refilled
+        self._budgets: Dict[str, Tuple[float, float]] = {}
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @asynccontextmanager
+    async def admit(self, client: str, cost: int) -> AsyncIterator[None]:
+        """
+        Context manager running a computation in a slot, once admitted.
+
+        Args:
+            client (str): The client asking for the computation.
+            cost (int): The estimated number of stargazers processed by the computation.
+
+        Raises:
+            AdmissionRejected: If the client has too many computations in progress, its budget is spent, or the
+                queue is full or didn't move before the timeout.
+        """
+        if self._in_flight.get(client, 0) >= self.client_concurrency:
+            raise _rejected("client_concurrency", f"Too many computations in progress, at most "
+                                                  f"{self.client_concurrency} per client.", self.queue_timeout)
+        # A computation costing more than the whole budget is admitted once the budget is full
+        cost = min(cost, self.client_budget)
+        self._spend(client, cost)
+        slots = self._get_slots()
+        if slots.locked() and self.queued >= self.max_queued:
+            self._spend(client, -cost)
+            raise _rejected("queue_full", "Too many computations in progress.", self.queue_timeout)
+
+        self._in_flight[client] = self._in_flight.get(client, 0) + 1
+        try:
+            self.queued += 1
+            try:
+                async with asyncio.timeout(self.queue_timeout):
+                    await slots.acquire()
+            except TimeoutError:
+                self._spend(client, -cost)
+                raise _rejected("queue_timeout", "Too many computations in progress.", self.queue_timeout)
+            finally:
+                self.queued -= 1
+            try:
+                yield
+            finally:
+                slots.release()
+        finally:
+            self._in_flight[client] -= 1
+            if not self._in_flight[client]:
+                del self._in_flight[client]
+
+    def charge(self, client: str, cost: int) -> None:
+        """
+        Charge work that doesn't run in a slot, like a background job, to the budget of a client.
+
+        Raises:
+            AdmissionRejected: If the budget of the client is spent.
+        """
+        self._spend(client, min(cost, self.client_budget))
+
+    def get_remaining_budget(self, client: str) -> float:
+        """
+        Return the number of stargazers the computations of a client can still process.
+        """
+        return self._refill(client, time.time())
+
+    def _spend(self, client: str, cost: int) -> None:
+        now = time.time()
+        left = self._refill(client, now)
+        if cost > left:
+            retry_after = (cost - left) * BUDGET_WINDOW / self.client_budget
+            raise _rejected("client_budget", f"Budget of {self.client_budget} stargazers per hour exceeded.",
+                            retry_after)
+        self._budgets[client] = (left - cost, now)
+
+    def _refill(self, client: str, now: float) -> float:
+        left, refilled_at = self._budgets.get(client, (self.client_budget, now))
+        return min(self.client_budget, left + (now - refilled_at) * self.client_budget / BUDGET_WINDOW)
+
+    def _get_slots(self) -> asyncio.Semaphore:
+        # The semaphore belongs to the event loop it was created in (tests run several loops)
+        loop = asyncio.get_running_loop()
+        if self._slots is None or self._loop is not loop:
+            self._slots, self._loop = asyncio.Semaphore(self.max_computations), loop
+        return self._slots
+
+
+def _rejected(reason: str, message: str, retry_after: float) -> AdmissionRejected:
+    ADMISSION_REJECTED_TOTAL.inc(reason=reason)
+    logger.info(f"Neighbours computation rejected ({reason}): {message}")
+    return AdmissionRejected(message, retry_after)
+
+
+def get_client(request: Request) -> str:
+    """
+    Identify the client of a request by the userName of its access token.
+
+    Raises:
+        HTTPException: If the token has no userName, its requests can't be charged to anyone.
+    """
+    user = getattr(request.state, "user", None) or {}
+    client = user.get("userName")
+    if not isinstance(client, str) or not client:
+        raise HTTPException(status_code=401, detail="Invalid token, the userName claim is missing.")
+    return client
+
+
+async def estimate_cost(owner: str, repo: str, sampling: Optional[Sampling] = None) -> int:
+    """
+    Estimate the number of stargazers a computation processes, from the number of stargazers of the repository.
+
+    Raises:
+        GitHubAPIException: If the repository can't be fetched.
+    """
+    stargazers_count = (await get_repository(owner, repo))["stargazers_count"]
+    return min(stargazers_count, sampling.size) if sampling is not None else stargazers_count
+
+
+async def estimate_batch_cost(repositories: List[str], limit: int, min_shared: int, metric: Metric) -> int:
+    """
+    Estimate the number of stargazers a batch of computations processes, the repositories whose result is fresh in
+    the cache costing nothing. Repositories that can't be fetched cost nothing either, the batch reports their error.
+    """
+    uncached = []
+    for repository in repositories:
+        owner, repo = repository.split("/", 1)
+        entry = peek_repository_neighbours_entry(owner, repo, limit, min_shared, metric)
+        if entry is None or not entry.fresh:
+            uncached.append((owner, repo))
+    costs = await asyncio.gather(*(estimate_cost(owner, repo) for owner, repo in uncached), return_exceptions=True)
+    return sum(cost for cost in costs if isinstance(cost, int))
+
+
+@asynccontextmanager
+async def admit_computation(client: str, owner: str, repo: str, limit: int, min_shared: int, metric: Metric,
+                            sampling: Optional[Sampling] = None) -> AsyncIterator[None]:
+    """
+    Context manager admitting the neighbours computation of a repository, unless the result is cached.
+
+    Raises:
+        AdmissionRejected: If the computation isn't admitted.
+        GitHubAPIException: If the repository can't be fetched.
+    """
+    if peek_repository_neighbours_entry(owner, repo, limit, min_shared, metric, sampling) is not None:
+        yield
+        return
+    async with admission_controller.admit(client, await estimate_cost(owner, repo, sampling)):
+        yield
+
+
+admission_controller = AdmissionController()
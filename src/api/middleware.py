@@ -0,0 +1,132 @@
+import gzip
+import os
+from typing import Optional
+
+from dotenv import load_dotenv
+from starlette.datastructures import MutableHeaders
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.config.urls import API_VERSION
+from src.utils.jwt_handler import JWTHandler, AuthenticationError
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional, responses are then compressed with gzip only
+    brotli = None
+
+load_dotenv()
+
+# Minimum size of the responses compressed, smaller ones don't benefit from it
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", 1000))  # in bytes
+
+
+class JWTValidationMiddleware:
+    """
+    Middleware validating the access token of the requests to the API.
+
+    It is a plain ASGI middleware rather than an `@app.middleware("http")` function, which would wrap every request
+    and response in `BaseHTTPMiddleware`. The payload of the token is stored in the request state as `user`.
+    """
+
+    def __init__(self, app: ASGIApp, prefix: str = API_VERSION):
+        self.app = app
+        self.prefix = prefix
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefix):  # Need to be adapted
+            await self.app(scope, receive, send)
+            return
+
+        authorization = _get_header(scope, b"authorization")
+        if not authorization:
+            response = JSONResponse({"error": "Missing token"}, status_code=401)
+        else:
+            scheme, _, token = authorization.partition(" ")
+            try:
+                if scheme.lower() != "bearer" or not token.strip():
+                    raise AuthenticationError("Invalid token.")
+                user = JWTHandler.authenticate(token.strip(), JWTHandler.access_secret)
+            except AuthenticationError as ex:
+                response = JSONResponse({"error": str(ex)}, status_code=401)
+            else:
+                scope.setdefault("state", {})["user"] = user
+                await self.app(scope, receive, send)
+                return
+        await response(scope, receive, send)
+
+
+class CompressionMiddleware:
+    """
+    Middleware compressing responses with brotli, when the brotli package is installed and the client accepts it,
+    or with gzip.
+
+    Only responses sent in a single body message are compressed: streamed responses, like the NDJSON frames of the
+    neighbours, are sent as they are so the frames aren't held back.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESSION_MINIMUM_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        encoding = None
+        if scope["type"] == "http":
+            encoding = _negotiate_encoding(_get_header(scope, b"accept-encoding") or "")
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Optional[Message] = None
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            start, start_message = start_message, None
+            body = message.get("body", b"")
+            headers = MutableHeaders(raw=start["headers"])
+            if message.get("more_body") or len(body) < self.minimum_size or "content-encoding" in headers:
+                await send(start)
+                await send(message)
+                return
+            body = brotli.compress(body, quality=4) if encoding == "br" else gzip.compress(body, compresslevel=6)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start)
+            await send({**message, "body": body})
+
+        await self.app(scope, receive, send_compressed)
+
+
+def _negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Choose the encoding of a response from the Accept-Encoding header of the request, brotli being preferred.
+    """
+    weights = {}
+    for coding in accept_encoding.split(","):
+        name, _, parameters = coding.partition(";")
+        weight = 1.0
+        if parameters.strip().startswith("q="):
+            try:
+                weight = float(parameters.strip()[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name.strip().lower()] = weight
+    for encoding in ("br", "gzip") if brotli is not None else ("gzip",):
+        if weights.get(encoding, weights.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+def _get_header(scope: Scope, name: bytes) -> Optional[str]:
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
@@ -0,0 +1,119 @@
+import base64
+import binascii
+import hashlib
+import json
+from dataclasses import dataclass
+from typing import Dict, List, Literal, Optional, Tuple
+
+from fastapi import HTTPException
+
+from src.services.starneighbours import NEIGHBOURS_CACHE_MAX_STALE, NEIGHBOURS_STARGAZERS_SAMPLE
+
+# How the shared stargazers of a neighbour are included: "true" lists them, "false" leaves them out, "count" replaces
+# them by their number and "sample" lists the first NEIGHBOURS_STARGAZERS_SAMPLE of them
+IncludeStargazers = Literal["true", "false", "count", "sample"]
+
+
+@dataclass
+class ResultView:
+    """
+    The part of a neighbours result a client asked for.
+
+    Attributes:
+        page (int): The number of the page, starting at 1, ignored when a cursor is given.
+        per_page (int): The number of neighbours per page, None for every neighbour.
+        cursor (str): An opaque cursor returned with the previous page.
+        include_stargazers (IncludeStargazers): How the shared stargazers are included.
+        fields (str): The comma separated fields of the neighbours to return, None for every field.
+    """
+    page: int = 1
+    per_page: Optional[int] = None
+    cursor: Optional[str] = None
+    include_stargazers: IncludeStargazers = "true"
+    fields: Optional[str] = None
+
+    @property
+    def offset(self) -> int:
+        if self.cursor is not None:
+            return decode_cursor(self.cursor)
+        return (self.page - 1) * (self.per_page or 0)
+
+    def paginate(self, neighbours: List[Dict]) -> Tuple[List[Dict], Optional[int]]:
+        """
+        Select the requested page of the neighbours.
+
+        Returns:
+            Tuple[List[Dict], Optional[int]]: The neighbours of the page, and the offset of the next page if there
+            are more neighbours.
+        """
+        if self.per_page is None and self.cursor is None:
+            return neighbours, None
+        start = self.offset
+        stop = start + self.per_page if self.per_page is not None else len(neighbours)
+        return neighbours[start:stop], stop if stop < len(neighbours) else None
+
+    def shape(self, neighbour: Dict) -> Dict:
+        """
+        Keep only the requested fields of a neighbour, without modifying it since results are cached.
+        """
+        shaped = dict(neighbour)
+        if "stargazers" in shaped and self.include_stargazers != "true":
+            stargazers = shaped.pop("stargazers")
+            if self.include_stargazers == "count":
+                shaped["stargazersCount"] = len(stargazers)
+            elif self.include_stargazers == "sample":
+                shaped["stargazers"] = stargazers[:NEIGHBOURS_STARGAZERS_SAMPLE]
+        if self.fields:
+            fields = {field.strip() for field in self.fields.split(",")}
+            shaped = {key: value for key, value in shaped.items() if key in fields}
+        return shaped
+
+    def etag(self, result_etag: str) -> str:
+        """
+        The ETag of the requested part of a result, weak since the responses may be compressed.
+        """
+        view = json.dumps([result_etag, self.page, self.per_page, self.cursor, self.include_stargazers, self.fields])
+        return f'W/"{hashlib.blake2b(view.encode(), digest_size=16).hexdigest()}"'
+
+
+def cache_control(max_age: int, stale_while_revalidate: int = NEIGHBOURS_CACHE_MAX_STALE) -> str:
+    """
+    The Cache-Control header of a result, which doesn't depend on the user so shared caches can store it.
+    """
+    return f"public, max-age={max_age}, stale-while-revalidate={stale_while_revalidate}"
+
+
+def is_not_modified(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Check whether the If-None-Match header of a request matches an ETag, with the weak comparison of RFC 9110.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(_opaque_tag(tag) == _opaque_tag(etag) for tag in if_none_match.split(","))
+
+
+def _opaque_tag(etag: str) -> str:
+    etag = etag.strip()
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+def encode_cursor(offset: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"offset": offset}).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    """
+    Decode a cursor returned by `encode_cursor`.
+
+    Raises:
+        HTTPException: If the cursor is invalid.
+    """
+    try:
+        offset = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))["offset"]
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    if not isinstance(offset, int) or offset < 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    return offset
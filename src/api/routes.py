@@ -1,30 +1,258 @@
+import json
 import logging
+import math
 import time
+from contextlib import AsyncExitStack
+from typing import Annotated, AsyncIterator, Dict, List, Literal, Optional
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, Field, StringConstraints
+from starlette.background import BackgroundTask
+from starlette.responses import Response, StreamingResponse
 
-from src.config.urls import ROUTE_STARNEIGHBOURS
+from src.api.admission import (AdmissionRejected, admission_controller, admit_computation, estimate_batch_cost,
+                               estimate_cost, get_client)
+from src.api.results import IncludeStargazers, ResultView, cache_control, encode_cursor, is_not_modified
+
+from src.config.urls import (ROUTE_STARNEIGHBOURS, ROUTE_STARNEIGHBOURS_BATCH, ROUTE_STARNEIGHBOURS_JOBS,
+                             ROUTE_STARNEIGHBOURS_JOB)
 from src.services.github import GitHubAPIException
-from src.services.starneighbours import get_repository_neighbours
+from src.services.jobs import job_manager
+from src.services.minhash import minhash_index
+from src.services.resilience import track_request_stats
+from src.services.scoring import Metric
+from src.services.starneighbours import (get_repository_neighbours_entry, iter_batch_neighbours,
+                                         iter_repository_neighbours, Sampling, NEIGHBOURS_BATCH_MAX_REPOSITORIES,
+                                         NEIGHBOURS_DEFAULT_LIMIT, NEIGHBOURS_PROGRESS_FRAMES,
+                                         NEIGHBOURS_SAMPLE_SIZE, NEIGHBOURS_PHASE_DURATION)
 
 router = APIRouter()
 logger = logging.getLogger('uvicorn.error')
 
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+class BatchNeighboursRequest(BaseModel):
+    """
+    Body of a batch of neighbours computations, the options apply to every repository.
+    """
+    repositories: List[Annotated[str, StringConstraints(pattern=r"^[\w.-]+/[\w.-]+$")]] = Field(
+        min_length=1, max_length=NEIGHBOURS_BATCH_MAX_REPOSITORIES)
+    limit: int = Field(NEIGHBOURS_DEFAULT_LIMIT, ge=1, le=1000)
+    min_shared: int = Field(1, ge=1)
+    metric: Metric = "overlap"
+
 
 @router.get(ROUTE_STARNEIGHBOURS)
-def get_star_neighbours(user: str, repo: str):
+async def get_star_neighbours(request: Request, user: str, repo: str,
+                              limit: int = Query(NEIGHBOURS_DEFAULT_LIMIT, ge=1, le=1000),
+                              min_shared: int = Query(1, ge=1),
+                              metric: Metric = "overlap",
+                              stream: bool = False,
+                              mode: Literal["exact", "approximate", "lookup"] = "exact",
+                              sample_size: int = Query(NEIGHBOURS_SAMPLE_SIZE, ge=1),
+                              sampling: Literal["uniform", "recent"] = "uniform",
+                              max_starred_per_user: Optional[int] = Query(None, ge=1),
+                              page: int = Query(1, ge=1),
+                              per_page: Optional[int] = Query(None, ge=1, le=1000),
+                              cursor: Optional[str] = None,
+                              include_stargazers: IncludeStargazers = "true",
+                              fields: Optional[str] = None):
+    view = ResultView(page, per_page, cursor, include_stargazers, fields)
+    if mode == "lookup":
+        return _lookup_star_neighbours(request, user, repo, limit, min_shared, view)
+
+    sampling_options = Sampling(sample_size, sampling, max_starred_per_user) if mode == "approximate" else None
+    client = get_client(request)
+    if stream or NDJSON_MEDIA_TYPE in request.headers.get("Accept", ""):
+        return await _stream_star_neighbours(client, user, repo, limit, min_shared, metric, sampling_options)
+
     start_time = time.time()
     try:
-        starneighbours: list[dict] = get_repository_neighbours(user, repo)
+        with track_request_stats() as github_stats:
+            async with admit_computation(client, user, repo, limit, min_shared, metric, sampling_options):
+                entry = await get_repository_neighbours_entry(user, repo, limit=limit, min_shared=min_shared,
+                                                              metric=metric, sampling=sampling_options)
     except GitHubAPIException as e:
         raise HTTPException(status_code=e.code, detail=e.message)
+    except AdmissionRejected as e:
+        raise _too_many_requests(e)
 
+    result = entry.value
+    starneighbours = result["neighbours"]
     if not starneighbours:
-        raise HTTPException(status_code=404, detail=f"Repository {repo} by {user} has no neighbours.")
+        raise HTTPException(status_code=404, detail=f"Repository {repo} by {user} has no neighbours.",
+                            headers={"Cache-Control": cache_control(entry.max_age, stale_while_revalidate=0)})
+    # Clients revalidating a result they already have get it without the body being rendered
+    headers = {"ETag": view.etag(entry.etag), "Cache-Control": cache_control(entry.max_age)}
+    if is_not_modified(request.headers.get("If-None-Match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    # The body stays a list of neighbours, how it was computed is described by the headers
+    headers.update({"X-Neighbours-Mode": result["mode"], "X-Stargazers-Sampled": str(result["total"]),
+                    "X-Stargazers-Count": str(result["stargazersCount"]),
+                    "X-GitHub-Requests": str(github_stats.requests), "X-GitHub-Retries": str(github_stats.retries),
+                    "X-GitHub-Hedges": str(github_stats.hedges)})
+    if result.get("starredLists"):
+        headers["X-Starred-Lists"] = ", ".join(f"{treatment}={len(stargazers)}"
+                                               for treatment, stargazers in sorted(result["starredLists"].items()))
 
     end_time = time.time()
     elapsed_time = end_time - start_time
     # I've chosen to let this log to better test the performances of the endpoint
-    logger.info(f"Request took {elapsed_time:.2f} seconds.")
+    logger.info(f"Request took {elapsed_time:.2f} seconds, {github_stats.requests} GitHub requests "
+                f"({github_stats.retries} retries, {github_stats.hedges} hedges).")
+
+    with NEIGHBOURS_PHASE_DURATION.time(phase="serialization"):
+        return _render_neighbours(request, starneighbours, view, headers)
+
+
+def _lookup_star_neighbours(request: Request, user: str, repo: str, limit: int, min_shared: int,
+                            view: ResultView) -> Response:
+    """
+    Answer from the MinHash index only, without calling GitHub. Neighbours come with their estimated Jaccard
+    similarity as score, and the repository must have been crawled before.
+    """
+    starneighbours = minhash_index.neighbours(f"{user}/{repo}", limit, min_shared=min_shared)
+    if starneighbours is None:
+        raise HTTPException(status_code=404, detail=f"Repository {repo} by {user} isn't indexed.")
+    if not starneighbours:
+        raise HTTPException(status_code=404, detail=f"Repository {repo} by {user} has no neighbours.")
+    return _render_neighbours(request, starneighbours, view, {"X-Neighbours-Mode": "lookup"})
+
+
+def _render_neighbours(request: Request, starneighbours: List[Dict], view: ResultView,
+                       headers: Dict[str, str]) -> Response:
+    """
+    Render a page of the neighbours, shaped as requested. The total number of neighbours is sent in the
+    X-Total-Count header and, when there are more, the next page is linked with a cursor like GitHub does.
+    """
+    neighbours, next_offset = view.paginate(starneighbours)
+    headers = {**headers, "X-Total-Count": str(len(starneighbours))}
+    if next_offset is not None:
+        next_cursor = encode_cursor(next_offset)
+        next_url = request.url.remove_query_params("page").include_query_params(cursor=next_cursor)
+        headers.update({"X-Next-Cursor": next_cursor, "Link": f'<{next_url}>; rel="next"'})
+    return ORJSONResponse([view.shape(neighbour) for neighbour in neighbours], headers=headers)
+
+
+async def _stream_star_neighbours(client: str, user: str, repo: str, limit: int, min_shared: int, metric: Metric,
+                                  sampling: Optional[Sampling] = None) -> StreamingResponse:
+    """
+    Stream the neighbours of a repository as NDJSON, one frame per line.
+
+    The computation is admitted and the stargazers are fetched before the response starts, so errors like an unknown
+    repository or a rejected computation still get a proper status code. Errors happening afterward are sent as an
+    {"type": "error"} frame. The computation keeps its slot until the stream ends.
+    """
+    admission = AsyncExitStack()
+    try:
+        cost = await estimate_cost(user, repo, sampling)
+        await admission.enter_async_context(admission_controller.admit(client, cost))
+        frames = iter_repository_neighbours(user, repo, limit=limit, min_shared=min_shared, metric=metric,
+                                            progress_frames=NEIGHBOURS_PROGRESS_FRAMES, sampling=sampling)
+        try:
+            first_frame = await anext(frames)
+        except BaseException:
+            await admission.aclose()
+            raise
+    except GitHubAPIException as e:
+        raise HTTPException(status_code=e.code, detail=e.message)
+    except AdmissionRejected as e:
+        raise _too_many_requests(e)
+
+    if first_frame["total"] == 0:
+        await frames.aclose()
+        await admission.aclose()
+        raise HTTPException(status_code=404, detail=f"Repository {repo} by {user} has no neighbours.")
+
+    async def body() -> AsyncIterator[str]:
+        start_time = time.time()
+        try:
+            yield json.dumps(first_frame) + "\n"
+            async for frame in frames:
+                yield json.dumps(frame) + "\n"
+        except GitHubAPIException as e:
+            yield json.dumps({"type": "error", "status": e.code, "detail": e.message}) + "\n"
+        finally:
+            await admission.aclose()
+        logger.info(f"Streamed request took {time.time() - start_time:.2f} seconds.")
+
+    # The slot is also released when the client disconnects before the body starts
+    return StreamingResponse(body(), media_type=NDJSON_MEDIA_TYPE, background=BackgroundTask(admission.aclose))
+
+
+def _too_many_requests(rejected: AdmissionRejected) -> HTTPException:
+    return HTTPException(status_code=429, detail=rejected.message,
+                         headers={"Retry-After": str(max(math.ceil(rejected.retry_after), 1))})
+
+
+@router.post(ROUTE_STARNEIGHBOURS_BATCH)
+async def get_batch_star_neighbours(request: Request, batch: BatchNeighboursRequest, stream: bool = False):
+    """
+    Find the neighbours of several repositories, sharing the starred lists of their common stargazers.
+
+    The results are keyed by repository, a repository whose stargazers couldn't be fetched gets an error instead.
+    When streamed, each result is sent as an NDJSON frame as soon as its repository is complete.
+    """
+    admission = AsyncExitStack()
+    try:
+        cost = await estimate_batch_cost(batch.repositories, batch.limit, batch.min_shared, batch.metric)
+        # Batches served from the cache aren't admitted
+        if cost:
+            await admission.enter_async_context(admission_controller.admit(get_client(request), cost))
+    except AdmissionRejected as e:
+        raise _too_many_requests(e)
+
+    frames = iter_batch_neighbours(batch.repositories, limit=batch.limit, min_shared=batch.min_shared,
+                                   metric=batch.metric)
+    if stream or NDJSON_MEDIA_TYPE in request.headers.get("Accept", ""):
+        async def body() -> AsyncIterator[str]:
+            start_time = time.time()
+            try:
+                async for frame in frames:
+                    yield json.dumps(frame) + "\n"
+            except GitHubAPIException as e:
+                yield json.dumps({"type": "error", "status": e.code, "detail": e.message}) + "\n"
+            finally:
+                await admission.aclose()
+            logger.info(f"Streamed batch of {len(batch.repositories)} repositories took "
+                        f"{time.time() - start_time:.2f} seconds.")
+
+        return StreamingResponse(body(), media_type=NDJSON_MEDIA_TYPE, background=BackgroundTask(admission.aclose))
+
+    start_time = time.time()
+    try:
+        async with admission:
+            results = {frame.pop("repository"): frame async for frame in frames}
+    except GitHubAPIException as e:
+        raise HTTPException(status_code=e.code, detail=e.message)
+    logger.info(f"Batch of {len(batch.repositories)} repositories took {time.time() - start_time:.2f} seconds.")
+    return ORJSONResponse({"results": {repository: results[repository] for repository in batch.repositories
+                                       if repository in results}})
+
+
+@router.post(ROUTE_STARNEIGHBOURS_JOBS, status_code=202)
+async def create_star_neighbours_job(request: Request, user: str, repo: str,
+                                     limit: int = Query(NEIGHBOURS_DEFAULT_LIMIT, ge=1, le=1000),
+                                     min_shared: int = Query(1, ge=1),
+                                     metric: Metric = "overlap"):
+    options = {"limit": limit, "min_shared": min_shared, "metric": metric}
+    # Jobs run in the background, they are charged to the budget of the client but don't take a computation slot.
+    # Submitting a job that is already queued or running costs nothing
+    if job_manager.find_active(user, repo, options) is None:
+        try:
+            admission_controller.charge(get_client(request), await estimate_cost(user, repo))
+        except GitHubAPIException as e:
+            raise HTTPException(status_code=e.code, detail=e.message)
+        except AdmissionRejected as e:
+            raise _too_many_requests(e)
+    return job_manager.submit(user, repo, options)
+
 
-    return starneighbours
+@router.get(ROUTE_STARNEIGHBOURS_JOB)
+async def get_star_neighbours_job(user: str, repo: str, job_id: str):
+    job = job_manager.get(job_id)
+    if job is None or job["repository"] != f"{user}/{repo}":
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found.")
+    return job
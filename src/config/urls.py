@@ -4,6 +4,10 @@ API_VERSION = "/v1"
 # Resources
 RESOURCE_REPOS = "/repos"
 RESOURCE_STARNEIGHBOURS = "/starneighbours"
+RESOURCE_JOBS = "/jobs"
 
 # Complete endpoints
 ROUTE_STARNEIGHBOURS = f"{RESOURCE_REPOS}/{{user}}/{{repo}}{RESOURCE_STARNEIGHBOURS}"
+ROUTE_STARNEIGHBOURS_JOBS = f"{ROUTE_STARNEIGHBOURS}{RESOURCE_JOBS}"
+ROUTE_STARNEIGHBOURS_JOB = f"{ROUTE_STARNEIGHBOURS_JOBS}/{{job_id}}"
+ROUTE_STARNEIGHBOURS_BATCH = f"{RESOURCE_STARNEIGHBOURS}:batch"
@@ -1,16 +1,26 @@
+import asyncio
 import logging
 import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
 
 import uvicorn
 from dotenv import load_dotenv
-from fastapi import FastAPI, Request
+from fastapi import FastAPI
 from fastapi.openapi.utils import get_openapi
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, PlainTextResponse
 
+from src.api.middleware import JWTValidationMiddleware, CompressionMiddleware
 from src.api.routes import router
 from src.config.urls import API_VERSION
 from src.services.github import check_github_connection, GitHubAPIException
+from src.services.github_async import async_github
+from src.services.jobs import job_manager
+from src.services.minhash import save_index
+from src.services.warmup import warmup_scheduler
+from src.services.workers import elect_leader, resign_leader, WORKERS
 from src.utils.jwt_handler import JWTHandler, AuthenticationError
+from src.utils.metrics import REGISTRY
 
 load_dotenv()
 
@@ -24,40 +34,74 @@ logging.basicConfig(
 logger = logging.getLogger('uvicorn.error')
 logger.info("Log level : " + log_level)
 
-# Start the application
-app = FastAPI()
-
-# Check if the GitHub connection is valid
-try:
-    check_github_connection()
-except GitHubAPIException as e:
-    logger.critical(f"GitHub API error: {e}")
-# Check if JWT secrets are present
-try:
-    JWTHandler.check_secrets()
-except AuthenticationError as e:
-    logger.critical(f"Configuration error: {e}")
-
-
-# Middleware for JWT validation
-@app.middleware("http")
-async def jwt_validation_middleware(request: Request, call_next):
+# Time between two connection checks while GitHub can't be reached
+READINESS_RETRY_INTERVAL = float(os.getenv("READINESS_RETRY_INTERVAL", 30))  # in seconds
+
+
+async def check_github_readiness():
     """
-    Middleware to validate JWT for specific routes.
+    Check the GitHub connection in the background until it works, the worker being reported ready by /ready once it
+    does. Every worker checks it, the rate limit endpoint doesn't use the rate limit.
     """
-    if request.url.path.startswith(API_VERSION):  # Need to be adapted
-        token = request.headers.get("Authorization")
-        if not token:
-            return JSONResponse({"error": "Missing token"}, status_code=401)
+    while True:
         try:
-            token = token.split("Bearer ")[1]
-            JWTHandler.verify_token(token, JWTHandler.access_secret)
-        except AuthenticationError as ex:
-            return JSONResponse({"error": str(ex)}, status_code=401)
+            await asyncio.to_thread(check_github_connection)
+        except GitHubAPIException as e:
+            app.state.github = "unreachable"
+            logger.critical(f"GitHub API error: {e}")
+            await asyncio.sleep(READINESS_RETRY_INTERVAL)
+        except Exception as e:  # The check must go on whatever happens, or the worker would never be ready
+            app.state.github = "unreachable"
+            logger.exception(f"GitHub connection check failed: {e}")
+            await asyncio.sleep(READINESS_RETRY_INTERVAL)
+        else:
+            app.state.github = "ready"
+            return
+
+
+async def run_startup_checks():
+    """
+    Check the configuration, resume the background jobs and start warming the cache up, once per host: only the
+    leader worker does it.
+    """
+    if not elect_leader():
+        return
+    # Check if JWT secrets are present
+    try:
+        JWTHandler.check_secrets()
+    except AuthenticationError as e:
+        logger.critical(f"Configuration error: {e}")
+    await job_manager.start()
+    await warmup_scheduler.start()
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    """
+    Start and stop the application. Startup makes no network call, so the workers serve requests right away: GitHub
+    is checked and the cache warmed up in the background.
+    """
+    print_openapi_schema()
+    JWTHandler.prepare_keys()
+    readiness = asyncio.create_task(check_github_readiness())
+    await run_startup_checks()
+    yield
+    readiness.cancel()
+    await asyncio.gather(readiness, return_exceptions=True)
+    await warmup_scheduler.stop()
+    await job_manager.stop()
+    await async_github.aclose()
+    save_index()
+    resign_leader()
 
-    response = await call_next(request)
-    return response
 
+# Start the application
+app = FastAPI(lifespan=lifespan)
+app.state.github = "pending"
+
+# Middleware for JWT validation, and for the compression of the responses
+app.add_middleware(JWTValidationMiddleware)
+app.add_middleware(CompressionMiddleware)
 
 # Add and display routes
 app.include_router(router, prefix=API_VERSION)
@@ -70,15 +114,26 @@ def print_openapi_schema():
             print(f"{method.upper()} {path} -> {operation.get('summary', 'No summary')}")
 
 
-app.add_event_handler("startup", print_openapi_schema)
-
-
 @app.get("/")
 def read_root():
     return {"Stagazer": "An API that provides information related to the Stargazers feature of GitHub"}
 
 
+@app.get("/ready", include_in_schema=False)
+def read_readiness():
+    # Readiness probe: the worker serves neighbours once GitHub answered, "pending" while it is checked
+    ready = app.state.github == "ready"
+    return JSONResponse({"ready": ready, "github": app.state.github}, status_code=200 if ready else 503)
+
+
+@app.get("/metrics", include_in_schema=False)
+def read_metrics():
+    # Metrics are per process, with several workers each scrape reaches one of them
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
     host = os.getenv("HOST", "127.0.0.1")
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host=host, port=port, log_level=log_level)
+    # Workers are separate processes importing the application, so it is passed by name
+    uvicorn.run("src.main:app", host=host, port=port, log_level=log_level, workers=WORKERS)
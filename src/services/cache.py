@@ -0,0 +1,260 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, List, Optional
+
+from src.utils import sqlite
+from src.utils.metrics import Counter
+
+logger = logging.getLogger('uvicorn.error')
+
+# Lookups of the caches, the result being "hit", "stale" (served while or after being revalidated) or "miss"
+CACHE_REQUESTS = Counter("cache_requests_total", "Cache lookups, by cache and result", ("cache", "result"))
+
+
+@dataclass
+class CachedPage:
+    """A single page of a paginated GitHub response along with the ETag GitHub returned for it."""
+    etag: Optional[str]
+    items: list
+
+
+@dataclass
+class CacheEntry:
+    """
+    The cached pages of a paginated GitHub endpoint.
+
+    The watermark is the most recent `starred_at` of the items, when they were fetched with the star+json media type,
+    so the entry can be refreshed incrementally.
+    """
+    pages: List[CachedPage]
+    fetched_at: float = field(default_factory=time.time)
+    watermark: Optional[str] = None
+
+    @property
+    def items(self) -> list:
+        return [item for page in self.pages for item in page.items]
+
+
+class PagedResponseCache:
+    """
+    Two-tier cache for paginated GitHub responses.
+
+    The first tier is an in-process LRU bounded by a number of entries. The second, optional, tier is a SQLite
+    database that survives restarts. Entries older than the TTL are still returned so they can be revalidated with
+    conditional requests, callers should check them with `is_fresh`.
+    """
+
+    def __init__(self, max_entries: int, ttl: int, db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if db_path:
+            self._db = sqlite.connect(db_path)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS paged_responses (key TEXT PRIMARY KEY, fetched_at REAL, pages TEXT,"
+                " watermark TEXT)"
+            )
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(paged_responses)")]
+            if "watermark" not in columns:  # Databases created before watermarks were stored
+                self._db.execute("ALTER TABLE paged_responses ADD COLUMN watermark TEXT")
+            self._db.commit()
+
+    @property
+    def shared(self) -> bool:
+        return self._db is not None
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        """
+        Check if an entry can be served without revalidation.
+
+        Args:
+            entry (CacheEntry): The entry to check.
+
+        Returns:
+            bool: True if the entry is younger than the TTL.
+        """
+        return time.time() - entry.fetched_at < self.ttl
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """
+        Get an entry from the cache, looking in memory first then on disk, where a stale entry of the memory may have
+        been refreshed by another process.
+
+        Args:
+            key (str): The key of the entry.
+
+        Returns:
+            CacheEntry | None: The entry, fresh or stale, or None if it isn't cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                if self._db is None or self.is_fresh(entry):
+                    return entry
+
+            # Another process sharing the database may have refreshed the entry
+            stored = self._load(key)
+            if stored is not None and (entry is None or stored.fetched_at > entry.fetched_at):
+                entry = stored
+                self._remember(key, entry)
+            return entry
+
+    def set(self, key: str, entry: CacheEntry) -> None:
+        """
+        Store an entry in both tiers of the cache.
+
+        Args:
+            key (str): The key of the entry.
+            entry (CacheEntry): The entry to store.
+        """
+        with self._lock:
+            self._remember(key, entry)
+            if self._db is not None:
+                pages = json.dumps([[page.etag, page.items] for page in entry.pages])
+                self._db.execute("INSERT OR REPLACE INTO paged_responses (key, fetched_at, pages, watermark)"
+                                 " VALUES (?, ?, ?, ?)", (key, entry.fetched_at, pages, entry.watermark))
+                self._db.commit()
+
+    def clear(self) -> None:
+        """
+        Remove every entry from both tiers of the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM paged_responses")
+                self._db.commit()
+
+    def _remember(self, key: str, entry: CacheEntry) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _load(self, key: str) -> Optional[CacheEntry]:
+        if self._db is None:
+            return None
+        row = self._db.execute("SELECT fetched_at, pages, watermark FROM paged_responses WHERE key = ?",
+                               (key,)).fetchone()
+        if row is None:
+            return None
+        fetched_at, pages, watermark = row
+        return CacheEntry(pages=[CachedPage(etag, items) for etag, items in json.loads(pages)], fetched_at=fetched_at,
+                          watermark=watermark)
+
+
+@dataclass
+class CachedResult:
+    """
+    A cached result along with its ETag, a hash of its JSON serialization, and when it expires.
+    """
+    value: Any
+    etag: str
+    expires_at: float
+
+    @property
+    def fresh(self) -> bool:
+        return self.expires_at > time.time()
+
+    @property
+    def max_age(self) -> int:
+        return max(int(self.expires_at - time.time()), 0)
+
+
+class ResultCache:
+    """
+    Cache of JSON-serializable results expiring after a TTL.
+
+    Like `PagedResponseCache`, entries are kept in an in-process LRU and, optionally, in a SQLite database that
+    several worker processes can share. Expired results are kept `max_stale` more seconds, `lookup` returns them so
+    they can be served while they are refreshed.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, db_path: Optional[str] = None, max_stale: float = 0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self._entries: OrderedDict[str, CachedResult] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if db_path:
+            self._db = sqlite.connect(db_path)
+            self._db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, expires_at REAL, value TEXT)")
+            self._db.commit()
+
+    @property
+    def shared(self) -> bool:
+        return self._db is not None
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Get a result, None if it isn't cached or expired.
+        """
+        entry = self.lookup(key)
+        return entry.value if entry is not None and entry.fresh else None
+
+    def lookup(self, key: str) -> Optional[CachedResult]:
+        """
+        Get a result, fresh or expired less than `max_stale` seconds ago, None if it isn't cached. Like
+        `PagedResponseCache.get`, a result of the memory that expired is looked up on disk, where another process may
+        have refreshed it.
+        """
+        with self._lock:
+            oldest = time.time() - self.max_stale
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                if self._db is None or entry.fresh:
+                    return entry if entry.expires_at > oldest else None
+            if self._db is not None:
+                row = self._db.execute("SELECT expires_at, value FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None and (entry is None or row[0] > entry.expires_at):
+                    entry = CachedResult(json.loads(row[1]), _etag(row[1]), row[0])
+                    self._remember(key, entry)
+            return entry if entry is not None and entry.expires_at > oldest else None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> CachedResult:
+        """
+        Store a result for the TTL of the cache, or the given one.
+
+        Returns:
+            CachedResult: The entry, also returned when the cache is disabled so the result still gets an ETag.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        serialized = json.dumps(value)
+        entry = CachedResult(value, _etag(serialized), time.time() + ttl)
+        if self.ttl <= 0 or ttl <= 0:
+            return entry
+        with self._lock:
+            self._remember(key, entry)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)", (key, entry.expires_at, serialized))
+                self._db.execute("DELETE FROM results WHERE expires_at <= ?", (time.time() - self.max_stale,))
+                self._db.commit()
+        return entry
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM results")
+                self._db.commit()
+
+    def _remember(self, key: str, entry: CachedResult) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+def _etag(serialized: str) -> str:
+    return hashlib.blake2b(serialized.encode(), digest_size=16).hexdigest()
@@ -0,0 +1,107 @@
+import argparse
+import gzip
+import logging
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Optional, Tuple
+
+import orjson
+
+from src.services.stargraph import StarGraph, STAR_GRAPH_DIR, star_graph
+
+logger = logging.getLogger('uvicorn.error')
+
+# Stars are WatchEvents in the GitHub events, the check on the raw line avoids parsing the other events
+WATCH_EVENT = b'"WatchEvent"'
+
+# Star events of an archive: the login of the user and the full name of the repository
+Events = List[Tuple[str, str]]
+
+
+def parse_archive(path: str) -> Tuple[Events, Optional[str]]:
+    """
+    Read the star events of a GH Archive dump, an hour of public GitHub events as gzipped NDJSON.
+
+    The file is streamed line by line, so memory doesn't depend on its size. Events before 2015 have a different
+    schema, both are read. Malformed lines are skipped.
+
+    Args:
+        path (str): The path of the .json.gz file.
+
+    Returns:
+        Tuple[Events, Optional[str]]: The star events, and the date of the latest one.
+    """
+    events, archived_until = [], None
+    with gzip.open(path, "rb") as archive:
+        for line in archive:
+            if WATCH_EVENT not in line:
+                continue
+            try:
+                event = orjson.loads(line)
+                if event["type"] != "WatchEvent":
+                    continue
+                star, created_at = _parse_watch_event(event), event["created_at"]
+            except (orjson.JSONDecodeError, KeyError, TypeError):
+                continue
+            events.append(star)
+            if archived_until is None or created_at > archived_until:
+                archived_until = created_at
+    return events, archived_until
+
+
+def _parse_watch_event(event: dict) -> Tuple[str, str]:
+    actor = event["actor"]
+    login = actor if isinstance(actor, str) else actor["login"]
+    if "repo" in event:
+        return login, event["repo"]["name"]
+    return login, f"{event['repository']['owner']}/{event['repository']['name']}"
+
+
+def ingest_archives(graph: StarGraph, paths: List[str], workers: Optional[int] = None) -> int:
+    """
+    Ingest GH Archive dumps into the star graph.
+
+    The dumps are parsed in parallel by a pool of processes, and their events are appended to the store as they are
+    parsed, by the calling process only. Every append takes the writer lock of the store, so the service can keep
+    writing to it meanwhile. The store is compacted at the end, so the service refreshing it memory-maps every edge.
+    Unreadable dumps are logged and skipped.
+
+    Args:
+        graph (StarGraph): The star graph.
+        paths (List[str]): The paths of the .json.gz files.
+        workers (int): The number of processes parsing the dumps, defaults to the number of CPUs.
+
+    Returns:
+        int: The number of edges appended.
+    """
+    appended = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(parse_archive, path): path for path in paths}
+        for future in as_completed(futures):
+            try:
+                events, archived_until = future.result()
+            except (OSError, EOFError, zlib.error) as e:
+                logger.warning(f"Skipping the archive {futures[future]}: {e}")
+                continue
+            appended += graph.ingest_events(events, archived_until)
+    graph.compact()
+    return appended
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest the star events of GH Archive dumps into the star graph.")
+    parser.add_argument("paths", nargs="+", help="The .json.gz dumps, for example 2024-01-01-{0..23}.json.gz")
+    parser.add_argument("--dir", default=STAR_GRAPH_DIR, help="Directory of the star graph store")
+    parser.add_argument("--workers", type=int, default=None, help="Processes parsing the dumps")
+    args = parser.parse_args()
+    if not args.dir:
+        parser.error("The directory of the star graph is required, set --dir or STAR_GRAPH_DIR")
+    logging.basicConfig(level=logging.INFO)
+
+    started = time.perf_counter()
+    graph = star_graph if star_graph is not None and args.dir == STAR_GRAPH_DIR else StarGraph(args.dir)
+    edges = ingest_archives(graph, args.paths, args.workers)
+    print(f"{edges} edges appended from {len(args.paths)} archives in {time.perf_counter() - started:.1f}s, "
+          f"{graph.users_count} users, {graph.repos_count} repositories, {graph.edges_count} edges, "
+          f"stars up to {graph.archived_until}.")
@@ -1,47 +1,133 @@
 import logging
-import os
+import time
 from typing import List
 
+import requests
 from dotenv import load_dotenv
 from github import Github, Repository, Stargazer, RateLimit, NamedUser, GithubException
 from github.PaginatedList import PaginatedList
 
+from src.services.ratelimit import RateLimitExceeded, GITHUB_RATE_LIMIT_RETRIES
+from src.services.resilience import (CircuitOpen, backoff_delay, circuit_breaker, GITHUB_RETRIES,
+                                     GITHUB_RETRIES_TOTAL, RETRY_STATUSES, record as record_request_stats)
+from src.services.token_pool import token_pool, PooledToken, NoTokenAvailable
+from src.utils.metrics import Counter, Histogram
+
 load_dotenv()
 
-# Authenticate using the GitHub token
-GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
-# The per_page setting should ideally be customizable at least using a EV.
+# The clients are created by the token pool, one per token, with per_page set to 100.
 # Maybe initializing multiple clients for different use cases could be an approach.
 # For example with per_page 10, 30 and 100, but it could also have other different settings.
-# 100 is the maximum allowed for the parameter per_page : https://docs.github.com/en/rest/using-the-rest-api/using-pagination-in-the-rest-api
-g = Github(GITHUB_TOKEN, per_page=100)
+# g is the client of the first token of the pool, requests that should be spread across tokens use the pool.
+g: Github = token_pool.primary.github
 
 logger = logging.getLogger('uvicorn.error')
 
+# Metrics of the GitHub call layer, shared by the synchronous and the asynchronous clients
+GITHUB_REQUESTS = Counter("github_requests_total", "GitHub API requests, by client, endpoint and status code",
+                          ("client", "endpoint", "status"))
+GITHUB_REQUEST_DURATION = Histogram("github_request_duration_seconds", "Duration of the GitHub API requests",
+                                    ("client", "endpoint"))
+
 
-def _safe_github_call(func, *args, **kwargs):
+def _safe_github_call(func, *args, pooled_token: PooledToken = None, **kwargs):
     """
     Wraps GitHub API calls to handle exceptions specific to the GitHub API. Logs the error and raises a custom
     GitHubAPIException with additional context for further handling.
+    Calls are scheduled by the rate limit scheduler of the token used, and calls rejected because of a rate limit are
+    retried once the limit is lifted. Calls failing with a 5xx status code or without a response are retried with a
+    jittered exponential backoff, they must be idempotent (the calls we make only read data), and fail fast while the
+    circuit breaker of the GitHub API is open.
 
     Args:
         func (callable): The GitHub API function to execute.
         *args: Positional arguments for the GitHub API function.
+        pooled_token (PooledToken): The token of the client `func` belongs to, defaults to the client g.
         **kwargs: Keyword arguments for the GitHub API function.
 
     Returns:
         The result of the API function call if successful.
     """
+    pooled_token = pooled_token or token_pool.primary
+    scheduler = pooled_token.scheduler
+    rate_limit_retries = upstream_retries = 0
+    while True:
+        try:
+            probe = circuit_breaker.check()
+        except CircuitOpen as e:
+            raise GitHubAPIException(str(e), code=503)
+        try:
+            try:
+                scheduler.acquire_sync()
+            except RateLimitExceeded as e:
+                raise GitHubAPIException(str(e), code=429)
+
+            start = time.perf_counter()
+            record_request_stats(requests=1)
+            try:
+                result = func(*args, **kwargs)
+            except GithubException as e:  # Catch only GitHub-related exceptions
+                _observe(func, e.status, start)
+                token_pool.report(pooled_token, e.status)
+                if e.status not in RETRY_STATUSES:
+                    circuit_breaker.record_success()
+                else:
+                    circuit_breaker.record_failure()
+                    if upstream_retries < GITHUB_RETRIES:
+                        GITHUB_RETRIES_TOTAL.inc(client="pygithub", endpoint=getattr(func, "__name__", "unknown"))
+                        record_request_stats(retries=1)
+                        time.sleep(backoff_delay(upstream_retries))
+                        upstream_retries += 1
+                        continue
+                rate_limited = scheduler.backoff(e.status, e.headers or {}) is not None
+                if rate_limited and rate_limit_retries < GITHUB_RATE_LIMIT_RETRIES:
+                    rate_limit_retries += 1
+                    continue
+                logger.error(f"GitHub API error ({e.__class__.__name__}) in function {func.__name__}: {e}")
+                raise GitHubAPIException(f"Error calling GitHub API: {e}", code=e.status, github_exception=e)
+            except requests.RequestException as e:  # GitHub couldn't be reached, there is no response
+                _observe(func, "error", start)
+                circuit_breaker.record_failure()
+                if upstream_retries < GITHUB_RETRIES:
+                    GITHUB_RETRIES_TOTAL.inc(client="pygithub", endpoint=getattr(func, "__name__", "unknown"))
+                    record_request_stats(retries=1)
+                    time.sleep(backoff_delay(upstream_retries))
+                    upstream_retries += 1
+                    continue
+                logger.error(f"GitHub API request ({e.__class__.__name__}) in function {func.__name__} failed: {e}")
+                raise GitHubAPIException(f"Error calling GitHub API: {e}", code=502)
+
+            circuit_breaker.record_success()
+            _observe(func, 200, start)
+            requester = pooled_token.github.requester
+            remaining, limit = requester.rate_limiting
+            if limit >= 0:
+                scheduler.record(remaining, limit, requester.rate_limiting_resettime)
+            return result
+        finally:
+            # The probe raised before a success or a failure was recorded, or was never sent
+            if probe:
+                circuit_breaker.release_probe()
+
+
+def _acquire_token() -> PooledToken:
     try:
-        return func(*args, **kwargs)
-    except GithubException as e:  # Catch only GitHub-related exceptions
-        logger.error(f"GitHub API error ({e.__class__.__name__}) in function {func.__name__}: {e}")
-        raise GitHubAPIException(f"Error calling GitHub API: {e}", code=e.status, github_exception=e)
+        return token_pool.acquire()
+    except NoTokenAvailable as e:
+        raise GitHubAPIException(str(e), code=503)
+
+
+def _observe(func, status: int, start: float) -> None:
+    # PyGithub calls are labelled with the name of the method, as their URLs aren't known here
+    endpoint = getattr(func, "__name__", "unknown")
+    GITHUB_REQUESTS.inc(client="pygithub", endpoint=endpoint, status=status)
+    GITHUB_REQUEST_DURATION.observe(time.perf_counter() - start, client="pygithub", endpoint=endpoint)
 
 
 def check_github_connection() -> None:
     """
-    Check if GitHub connection is working by checking the token and hitting the rate limit endpoint.
+    Check if GitHub connection is working by checking the tokens and hitting the rate limit endpoint with each of
+    them. Tokens that are rejected are removed from the pool.
 
     Returns:
         None
@@ -50,22 +136,31 @@ def check_github_connection() -> None:
         Exception: If the GitHub API returns a non-200 status code
     """
     # Check if token is present
-    if GITHUB_TOKEN is None:
+    if not token_pool.authenticated:
         logger.critical("No GitHub token provided!")
         raise GitHubAPIException("GitHub token is missing.")
 
     # Check if rate limit is not reached
-    try:
-        rate_limit: RateLimit = _safe_github_call(g.get_rate_limit)
-    except GithubException as e:
-        logger.error(f"Failed to fetch rate limit: {e}")
-        raise GitHubAPIException(f"GitHub API rate limit check failed: {e}")
+    usable = 0
+    for pooled_token in token_pool.tokens:
+        try:
+            rate_limit: RateLimit = _safe_github_call(pooled_token.github.get_rate_limit, pooled_token=pooled_token)
+        except GitHubAPIException as e:
+            logger.error(f"Failed to fetch rate limit for {pooled_token.name}: {e}")
+            continue
+
+        pooled_token.scheduler.record(rate_limit.core.remaining, rate_limit.core.limit,
+                                      rate_limit.core.reset.timestamp())
+        if rate_limit.core.remaining == 0:
+            logger.warning(f"GitHub API rate limit exceeded for {pooled_token.name}.")
+        else:
+            usable += 1
 
-    if rate_limit.core.remaining == 0:
+    if usable == 0:
         logger.error("GitHub API rate limit exceeded.")
         raise GitHubAPIException("Rate limit exceeded")
 
-    logger.info("GitHub connection successful!")
+    logger.info(f"GitHub connection successful with {usable}/{len(token_pool.tokens)} tokens!")
 
 
 def get_stargazers(owner: str, repo: str) -> PaginatedList[NamedUser] | None:
@@ -80,10 +175,11 @@ def get_stargazers(owner: str, repo: str) -> PaginatedList[NamedUser] | None:
         List[Stargazer] | None: A list of stargazer objects or None if the repository isn't found.
     """
     # Here we could make only one call by making a direct request to the GitHub API.
-    repo = _safe_github_call(g.get_repo, f"{owner}/{repo}")
+    pooled_token = _acquire_token()
+    repo = _safe_github_call(pooled_token.github.get_repo, f"{owner}/{repo}", pooled_token=pooled_token)
     if repo is None:
         return None  # Return an empty list if the repository was not found
-    return _safe_github_call(repo.get_stargazers)
+    return _safe_github_call(repo.get_stargazers, pooled_token=pooled_token)
 
 
 def get_starred_repos_for_user(user: NamedUser) -> PaginatedList[Repository]:
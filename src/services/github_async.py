@@ -0,0 +1,781 @@
+import asyncio
+import logging
+import math
+import os
+import random
+import time
+from typing import Any, Callable, Dict, List, Literal, NamedTuple, Optional, Tuple
+
+import httpx
+from dotenv import load_dotenv
+
+from src.services.cache import CacheEntry, CachedPage, PagedResponseCache, CACHE_REQUESTS
+from src.services.github import GitHubAPIException, GITHUB_REQUESTS, GITHUB_REQUEST_DURATION
+from src.services.ratelimit import RateLimitExceeded, GITHUB_RATE_LIMIT_RETRIES, background_priority
+from src.services.resilience import (CircuitBreaker, CircuitOpen, LatencyTracker, backoff_delay, circuit_breaker,
+                                     latency_tracker, GITHUB_HEDGES_TOTAL, GITHUB_RETRIES, GITHUB_RETRIES_TOTAL,
+                                     RETRY_STATUSES, record as record_request_stats)
+from src.services.singleflight import SingleFlight
+from src.services.workers import stampede_lock
+from src.services.token_pool import TokenPool, PooledToken, NoTokenAvailable, token_pool
+from src.utils.metrics import Histogram
+from src.utils.tracing import span
+
+load_dotenv()
+
+# Base URL of the REST API, overridable so the client can target GitHub Enterprise or a local simulator
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
+# Maximum number of GitHub requests in flight at the same time for the whole process
+GITHUB_MAX_CONCURRENCY = int(os.getenv("GITHUB_MAX_CONCURRENCY", 20))
+GITHUB_REQUEST_TIMEOUT = float(os.getenv("GITHUB_REQUEST_TIMEOUT", 30))
+# Starred repositories cache, the database is optional and allows the cache to survive restarts
+STARRED_CACHE_MAX_ENTRIES = int(os.getenv("STARRED_CACHE_MAX_ENTRIES", 10000))
+STARRED_CACHE_TTL = int(os.getenv("STARRED_CACHE_TTL", 3600))  # in seconds
+STARRED_CACHE_DB = os.getenv("STARRED_CACHE_DB") or None
+# 100 is the maximum allowed for the parameter per_page
+PER_PAGE = 100
+# GitHub doesn't paginate stargazers beyond 400 pages (40 000 stargazers)
+GITHUB_MAX_STARGAZER_PAGES = 400
+# Media type adding the date of the star to stargazers and starred repositories
+STAR_MEDIA_TYPE = "application/vnd.github.star+json"
+# Users who starred more repositories than this are heavy starrers, whose lists aren't fetched whole by default
+HEAVY_STARRER_THRESHOLD = int(os.getenv("HEAVY_STARRER_THRESHOLD", 5000))
+# How the lists of heavy starrers are fetched: "full" fetches every page concurrently, "cap" the most recent stars up
+# to the threshold, "sample" as many stars from random pages, "defer" the first page now and the whole list in the
+# background, so the following computations find it in the cache. The GraphQL backend caps them unless it is "full"
+HEAVY_STARRER_STRATEGY = os.getenv("HEAVY_STARRER_STRATEGY", "cap")
+
+logger = logging.getLogger('uvicorn.error')
+
+# For starred lists, this is the number of pages fetched per user
+GITHUB_PAGES_FETCHED = Histogram("github_pages_fetched", "Pages fetched per paginated fetch", ("endpoint",),
+                                 buckets=(1, 2, 3, 5, 10, 20, 50, 100, 400))
+
+
+class StarredRepo(NamedTuple):
+    """A repository starred by a user, with its number of stargazers."""
+    full_name: str
+    stargazers_count: int
+
+
+# How a starred list was fetched: "full", or "capped", "sampled" or "deferred" for the lists of heavy starrers and
+# "capped" when the caller asked for a maximum number of items
+StarredTreatment = Literal["full", "capped", "sampled", "deferred"]
+
+
+class StarredFetch(NamedTuple):
+    """The repositories starred by a user, and how the list was fetched."""
+    repos: List[StarredRepo]
+    treatment: StarredTreatment = "full"
+
+
+class Stargazer(NamedTuple):
+    """A stargazer of a repository, with the date of the star."""
+    login: str
+    starred_at: Optional[str]
+
+
+class AsyncGitHubClient:
+    """
+    Minimal asynchronous client for the GitHub REST API.
+
+    Unlike PyGithub, requests are made directly against the endpoints we need (for example
+    /repos/{owner}/{repo}/stargazers), so fetching stargazers doesn't require fetching the repository first.
+    A single pooled HTTP/2 connection is shared by all the requests and a semaphore bounds the concurrency.
+    Every request is made with a token of the pool and goes through the rate limit scheduler of this token, requests
+    rejected because of a rate limit are retried once the limit is lifted instead of failing, possibly with another
+    token, and requests rejected with 401 are retried with another token.
+
+    Requests failing with a transport error or a 5xx status code are retried with a jittered exponential backoff,
+    and a circuit breaker fails them fast while GitHub keeps failing. GET requests slower than a percentile of the
+    latencies of their endpoint are hedged with a duplicate request (see `src.services.resilience`).
+    """
+
+    def __init__(self, pool: TokenPool = token_pool, base_url: str = GITHUB_API_URL,
+                 max_concurrency: int = GITHUB_MAX_CONCURRENCY, transport: httpx.AsyncBaseTransport = None,
+                 breaker: CircuitBreaker = None, latencies: LatencyTracker = None):
+        self.pool = pool
+        self.breaker = breaker or CircuitBreaker()
+        self.latencies = latencies or LatencyTracker()
+        self.base_url = base_url
+        self.max_concurrency = max_concurrency
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @staticmethod
+    def _headers() -> dict:
+        return {
+            "Accept": "application/vnd.github+json",
+            "X-GitHub-Api-Version": "2022-11-28",
+        }
+
+    @staticmethod
+    async def _authorization(pooled_token: PooledToken) -> dict:
+        # Refreshing the installation token of a GitHub App is a blocking call
+        token = await asyncio.to_thread(lambda: pooled_token.token) if pooled_token.refreshable else pooled_token.token
+        return {"Authorization": f"Bearer {token}"} if token else {}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """
+        Return the pooled HTTP client, creating it for the running event loop if needed.
+
+        Connections and semaphores are bound to an event loop, so they are recreated if the client is used from
+        another loop (this happens in tests, where each TestClient runs its own loop).
+        """
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=self._headers(),
+                http2=self._transport is None,
+                timeout=GITHUB_REQUEST_TIMEOUT,
+                limits=httpx.Limits(max_connections=self.max_concurrency,
+                                    max_keepalive_connections=self.max_concurrency),
+                transport=self._transport,
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+        return self._client
+
+    async def aclose(self) -> None:
+        """
+        Close the underlying HTTP connections.
+        """
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def get(self, path: str, params: dict = None, headers: dict = None) -> httpx.Response:
+        """
+        Perform a GET request against the GitHub API.
+
+        Args:
+            path (str): The path of the endpoint, relative to the API base URL.
+            params (dict): Query parameters of the request.
+            headers (dict): Additional headers of the request, for example If-None-Match.
+
+        Returns:
+            httpx.Response: The response, if its status code is a success or 304 Not Modified.
+
+        Raises:
+            GitHubAPIException: If the request fails or GitHub returns an error status code.
+        """
+        return await self._request("GET", path, params=params, headers=headers)
+
+    async def post(self, path: str, json: dict) -> httpx.Response:
+        """
+        Perform a POST request against the GitHub API, used for GraphQL queries.
+
+        Args:
+            path (str): The path of the endpoint, relative to the API base URL.
+            json (dict): The body of the request.
+
+        Returns:
+            httpx.Response: The response, if its status code is a success.
+
+        Raises:
+            GitHubAPIException: If the request fails or GitHub returns an error status code.
+        """
+        return await self._request("POST", path, json=json)
+
+    async def _request(self, method: str, path: str, headers: dict = None, **kwargs) -> httpx.Response:
+        endpoint = _get_endpoint(path)
+        # GraphQL queries are POST requests but only read data, so they are retried too
+        retries = GITHUB_RETRIES if method in ("GET", "POST") else 0
+        for attempt in range(retries + 1):
+            try:
+                probe = self.breaker.check()
+            except CircuitOpen as e:
+                raise GitHubAPIException(str(e), code=503)
+            try:
+                if method == "GET":
+                    response = await self._send_hedged(method, path, endpoint, headers, **kwargs)
+                else:
+                    response = await self._send(method, path, endpoint, headers, **kwargs)
+            except httpx.HTTPError as e:
+                self.breaker.record_failure()
+                if attempt == retries:
+                    raise GitHubAPIException(f"Error calling GitHub API: {e}", code=502)
+                logger.warning(f"GitHub API request to {path} failed, retrying: {e}")
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    self.breaker.record_success()
+                    break
+                self.breaker.record_failure()
+                if attempt == retries:
+                    break
+                logger.warning(f"GitHub API error {response.status_code} on {path}, retrying")
+            finally:
+                # The probe was cancelled, or never sent for lack of a token or of rate limit
+                if probe:
+                    self.breaker.release_probe()
+            GITHUB_RETRIES_TOTAL.inc(client="httpx", endpoint=endpoint)
+            record_request_stats(retries=1)
+            await asyncio.sleep(backoff_delay(attempt))
+
+        if response.is_error:
+            logger.error(f"GitHub API error {response.status_code} on {path}: {response.text}")
+            raise GitHubAPIException(f"Error calling GitHub API: {response.text}", code=response.status_code)
+        return response
+
+    async def _send_hedged(self, method: str, path: str, endpoint: str, headers: dict = None,
+                           **kwargs) -> httpx.Response:
+        """
+        Send a request, and a duplicate of it if it takes longer than the hedging percentile of its endpoint. The
+        first response wins and the other request is cancelled.
+        """
+        delay = self.latencies.hedge_delay(endpoint)
+        if delay is None:
+            return await self._send(method, path, endpoint, headers, **kwargs)
+
+        first = asyncio.create_task(self._send(method, path, endpoint, headers, **kwargs))
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done or not self.latencies.acquire_hedge():
+            return await first
+        record_request_stats(hedges=1)
+        hedge = asyncio.create_task(self._send(method, path, endpoint, headers, **kwargs))
+        pending = {first, hedge}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    # A request that failed leaves the other one a chance to answer
+                    if task.exception() is None or not pending:
+                        GITHUB_HEDGES_TOTAL.inc(endpoint=endpoint, won=str(task is hedge).lower())
+                        return task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _send(self, method: str, path: str, endpoint: str, headers: dict = None, **kwargs) -> httpx.Response:
+        """
+        Send a request with a token of the pool, retrying it while it is rejected because of a rate limit.
+
+        Raises:
+            httpx.HTTPError: If the request fails without a response.
+        """
+        client = self._get_client()
+        for attempt in range(GITHUB_RATE_LIMIT_RETRIES + 1):
+            try:
+                pooled_token = self.pool.acquire()
+                await pooled_token.scheduler.acquire()
+            except NoTokenAvailable as e:
+                raise GitHubAPIException(str(e), code=503)
+            except RateLimitExceeded as e:
+                raise GitHubAPIException(str(e), code=429)
+
+            request_headers = {**(headers or {}), **await self._authorization(pooled_token)}
+            async with self._semaphore:
+                start = time.perf_counter()
+                record_request_stats(requests=1)
+                try:
+                    with span("github.request", method=method, path=path):
+                        response = await client.request(method, path, headers=request_headers, **kwargs)
+                except httpx.HTTPError as e:
+                    GITHUB_REQUESTS.inc(client="httpx", endpoint=endpoint, status="error")
+                    logger.error(f"GitHub API request to {path} failed: {e}")
+                    raise
+                latency = time.perf_counter() - start
+                GITHUB_REQUEST_DURATION.observe(latency, client="httpx", endpoint=endpoint)
+                GITHUB_REQUESTS.inc(client="httpx", endpoint=endpoint, status=response.status_code)
+                if response.status_code not in RETRY_STATUSES:
+                    self.latencies.observe(endpoint, latency)
+
+            pooled_token.scheduler.update(response.headers)
+            self.pool.report(pooled_token, response.status_code)
+            retry = (response.status_code == 401 and pooled_token.disabled) or \
+                pooled_token.scheduler.backoff(response.status_code, response.headers) is not None
+            if not retry or attempt == GITHUB_RATE_LIMIT_RETRIES:
+                return response
+
+    async def get_all_pages(self, path: str, params: dict = None) -> List[dict]:
+        """
+        Fetch every page of a paginated endpoint.
+
+        Args:
+            path (str): The path of the endpoint, relative to the API base URL.
+            params (dict): Additional query parameters of the request.
+
+        Returns:
+            List[dict]: The items of all the pages, in order.
+        """
+        return (await self.get_pages(path, params)).items
+
+    async def get_pages(self, path: str, params: dict = None, project: Callable[[dict], Any] = None,
+                        cached: Optional[CacheEntry] = None, max_pages: Optional[int] = None,
+                        headers: dict = None, first_page: Optional[httpx.Response] = None) -> CacheEntry:
+        """
+        Fetch every page of a paginated endpoint, keeping the ETag of each page.
+
+        Without cached pages, the first page is fetched alone to discover the number of pages from the Link header
+        and the remaining pages are then fetched concurrently.
+        With cached pages, every page is revalidated concurrently with a conditional request: pages answered with
+        304 Not Modified are reused, and these responses don't count against the rate limit.
+
+        Args:
+            path (str): The path of the endpoint, relative to the API base URL.
+            params (dict): Additional query parameters of the request.
+            project (Callable[[dict], Any]): Applied to every item before it is stored, to keep only what we use.
+            cached (CacheEntry): Previously fetched pages of the endpoint, to revalidate.
+            max_pages (int): The maximum number of pages to fetch when there are no cached pages.
+            headers (dict): Additional headers of the requests, for example another media type.
+            first_page (httpx.Response): The response of the first page when it was already fetched, without cached
+                pages.
+
+        Returns:
+            CacheEntry: The up-to-date pages.
+        """
+        params = {**(params or {}), "per_page": PER_PAGE}
+        project = project or (lambda item: item)
+
+        async def fetch(page: int, etag: Optional[str] = None) -> Tuple[int, httpx.Response]:
+            page_headers = {**(headers or {}), **({"If-None-Match": etag} if etag else {})}
+            return page, await self.get(path, params={**params, "page": page}, headers=page_headers or None)
+
+        if cached is None or not cached.pages:
+            responses = [(1, first_page) if first_page is not None else await fetch(1)]
+            last_page = _get_last_page(responses[0][1], 1)
+            if max_pages is not None:
+                last_page = min(last_page, max_pages)
+            responses += await asyncio.gather(*(fetch(page) for page in range(2, last_page + 1)))
+        else:
+            responses = await asyncio.gather(
+                *(fetch(page, cached_page.etag) for page, cached_page in enumerate(cached.pages, start=1))
+            )
+            last_page = _get_revalidated_last_page(responses, len(cached.pages))
+            if last_page > len(cached.pages):
+                responses += await asyncio.gather(
+                    *(fetch(page) for page in range(len(cached.pages) + 1, last_page + 1))
+                )
+
+        GITHUB_PAGES_FETCHED.observe(len(responses), endpoint=_get_endpoint(path))
+        pages: List[CachedPage] = []
+        for page, response in responses[:last_page]:
+            if response.status_code == 304:
+                pages.append(cached.pages[page - 1])
+            else:
+                pages.append(CachedPage(response.headers.get("ETag"), [project(item) for item in response.json()]))
+
+        if cached is not None:
+            not_modified = sum(response.status_code == 304 for _, response in responses)
+            logger.debug(f"Revalidated {path}: {not_modified}/{len(responses)} pages not modified")
+        return CacheEntry(pages=pages)
+
+
+def _get_endpoint(path: str) -> str:
+    """
+    Replace the owners, repositories and logins of a path by placeholders, so metrics have a bounded number of labels.
+    """
+    parts = path.split("/")
+    if len(parts) > 2 and parts[1] == "users":
+        parts[2] = "{login}"
+    elif len(parts) > 3 and parts[1] == "repos":
+        parts[2:4] = ["{owner}", "{repo}"]
+    return "/".join(parts)
+
+
+def _get_last_page(response: httpx.Response, page: int) -> int:
+    """
+    Extract the number of the last page from the Link header of a paginated response.
+
+    Args:
+        response (httpx.Response): The response of a page.
+        page (int): The number of the page that was requested.
+
+    Returns:
+        int: The number of the last page, the requested page if there is no next page.
+    """
+    last = response.links.get("last")
+    if not last:
+        return page
+    return int(httpx.URL(last["url"]).params.get("page", page))
+
+
+def _get_revalidated_last_page(responses: List[Tuple[int, httpx.Response]], cached_last_page: int) -> int:
+    """
+    Find the number of the last page after revalidating cached pages.
+
+    The Link header of the first modified page is used, unchanged pages keep the cached number of pages.
+    Trailing pages that came back empty are dropped, this happens when the list shrank.
+
+    Args:
+        responses (List[Tuple[int, httpx.Response]]): The requested page numbers and their responses.
+        cached_last_page (int): The number of pages that were cached.
+
+    Returns:
+        int: The number of the last page.
+    """
+    last_page = cached_last_page
+    for page, response in responses:
+        if response.status_code != 304 and response.json():
+            last_page = _get_last_page(response, page)
+            break
+    for page, response in reversed(responses):
+        if page <= last_page and response.status_code != 304 and not response.json():
+            last_page = page - 1
+    return max(last_page, 1)
+
+
+async_github = AsyncGitHubClient(breaker=circuit_breaker, latencies=latency_tracker)
+starred_repos_cache = PagedResponseCache(STARRED_CACHE_MAX_ENTRIES, STARRED_CACHE_TTL, STARRED_CACHE_DB)
+starred_repos_flight = SingleFlight("starred_repos")
+
+
+async def get_repository(owner: str, repo: str) -> dict:
+    """
+    Fetch a repository.
+
+    Args:
+        owner (str): The owner of the repository.
+        repo (str): The name of the repository.
+
+    Returns:
+        dict: The repository, as returned by the GitHub API.
+    """
+    return (await async_github.get(f"/repos/{owner}/{repo}")).json()
+
+
+async def get_stargazer_logins(owner: str, repo: str) -> List[str]:
+    """
+    Fetch the logins of the stargazers of a given repository.
+
+    Args:
+        owner (str): The owner of the repository.
+        repo (str): The name of the repository.
+
+    Returns:
+        List[str]: The logins of the stargazers.
+    """
+    stargazers = await async_github.get_all_pages(f"/repos/{owner}/{repo}/stargazers")
+    return [stargazer["login"] for stargazer in stargazers]
+
+
+async def get_stargazer_logins_page(owner: str, repo: str, page: int) -> List[str]:
+    """
+    Fetch a single page of the stargazers of a given repository, stargazers being ordered from the oldest star.
+
+    Args:
+        owner (str): The owner of the repository.
+        repo (str): The name of the repository.
+        page (int): The number of the page, starting at 1.
+
+    Returns:
+        List[str]: The logins of the stargazers of the page.
+    """
+    response = await async_github.get(f"/repos/{owner}/{repo}/stargazers",
+                                      params={"per_page": PER_PAGE, "page": page})
+    return [stargazer["login"] for stargazer in response.json()]
+
+
+async def get_stargazers(owner: str, repo: str) -> List[Stargazer]:
+    """
+    Fetch the stargazers of a given repository with the dates of their stars, oldest first.
+
+    Args:
+        owner (str): The owner of the repository.
+        repo (str): The name of the repository.
+
+    Returns:
+        List[Stargazer]: The stargazers.
+    """
+    entry = await async_github.get_pages(f"/repos/{owner}/{repo}/stargazers", project=_project_stargazer,
+                                         headers={"Accept": STAR_MEDIA_TYPE})
+    return [Stargazer(*stargazer) for stargazer in entry.items]
+
+
+async def get_stargazers_since(owner: str, repo: str, watermark: str, stargazers_count: int) -> List[Stargazer]:
+    """
+    Fetch the stargazers who starred a repository after a given date.
+
+    Stargazers are ordered from the oldest star, so pages are fetched from the last one backwards until a star
+    older than the watermark is found, usually a single page.
+
+    Args:
+        owner (str): The owner of the repository.
+        repo (str): The name of the repository.
+        watermark (str): The `starred_at` of the latest known star.
+        stargazers_count (int): The current number of stargazers of the repository, to find the last page.
+
+    Returns:
+        List[Stargazer]: The stargazers who starred the repository after the watermark, oldest first.
+    """
+    last_page = min(max(math.ceil(stargazers_count / PER_PAGE), 1), GITHUB_MAX_STARGAZER_PAGES)
+    newer: List[Stargazer] = []
+    for page in range(last_page, 0, -1):
+        response = await async_github.get(f"/repos/{owner}/{repo}/stargazers",
+                                          params={"per_page": PER_PAGE, "page": page},
+                                          headers={"Accept": STAR_MEDIA_TYPE})
+        stargazers = [Stargazer(*_project_stargazer(stargazer)) for stargazer in response.json()]
+        # Stargazers without the date of their star (the media type wasn't honoured) can't be told apart, they
+        # aren't counted as newer
+        fresh = [stargazer for stargazer in stargazers
+                 if stargazer.starred_at is not None and stargazer.starred_at > watermark]
+        newer = fresh + newer
+        if len(fresh) < len(stargazers):
+            break
+    return newer
+
+
+def starred_cache_key(login: str) -> str:
+    return f"starred:{login}"
+
+
+async def get_starred_repos(login: str, max_items: Optional[int] = None) -> List[StarredRepo]:
+    """
+    Fetch the repositories starred by a given user.
+
+    See `fetch_starred_repos`, which also tells how the list was fetched.
+
+    Args:
+        login (str): The login of the user.
+        max_items (int): The maximum number of repositories to return, the most recently starred first.
+
+    Returns:
+        List[StarredRepo]: The full names ("owner/repo") and numbers of stargazers of the starred repositories.
+    """
+    return (await fetch_starred_repos(login, max_items)).repos
+
+
+async def get_cached_starred_repos(key: str) -> Optional[CacheEntry]:
+    """
+    Get a starred list from the cache, reading the shared database in a thread so a slow read doesn't block the
+    event loop.
+    """
+    if starred_repos_cache.shared:
+        return await asyncio.to_thread(starred_repos_cache.get, key)
+    return starred_repos_cache.get(key)
+
+
+async def cache_starred_repos(key: str, entry: CacheEntry) -> None:
+    """
+    Store a starred list in the cache, writing the shared database in a thread.
+    """
+    if starred_repos_cache.shared:
+        await asyncio.to_thread(starred_repos_cache.set, key, entry)
+    else:
+        starred_repos_cache.set(key, entry)
+
+
+async def fetch_starred_repos(login: str, max_items: Optional[int] = None) -> StarredFetch:
+    """
+    Fetch the repositories starred by a given user.
+
+    Results are cached by login: fresh entries are served without any request and stale entries are refreshed,
+    incrementally when possible (see `_sync_starred_repos`). Concurrent calls for the same user share one fetch.
+    Uncached lists longer than HEAVY_STARRER_THRESHOLD are handled by HEAVY_STARRER_STRATEGY, their length being
+    known from the Link header of the first page.
+
+    Args:
+        login (str): The login of the user.
+        max_items (int): The maximum number of repositories to return, the most recently starred first. Only the
+            pages needed are fetched, and partial lists aren't cached.
+
+    Returns:
+        StarredFetch: The full names ("owner/repo") and numbers of stargazers of the starred repositories, and how
+        the list was fetched.
+    """
+    # Logins are case-insensitive
+    return await starred_repos_flight.do((login.lower(), max_items), lambda: _fetch_starred_repos(login, max_items))
+
+
+async def _fetch_starred_repos(login: str, max_items: Optional[int], guarded: bool = True) -> StarredFetch:
+    key = starred_cache_key(login)
+    cached = await get_cached_starred_repos(key)
+    stale = cached is None or not starred_repos_cache.is_fresh(cached)
+    # A span per user, so slow computations can be broken down to the starred lists that took the longest
+    with span("github.starred_repos", login=login):
+        if max_items is None and stale and starred_repos_cache.shared:
+            # The cache is shared by the worker processes, only one of them fetches the list
+            async with stampede_lock(key):
+                return await _fetch_starred_repos_unlocked(login, max_items, guarded)
+        return await _fetch_starred_repos_unlocked(login, max_items, guarded)
+
+
+async def _fetch_starred_repos_unlocked(login: str, max_items: Optional[int], guarded: bool) -> StarredFetch:
+    key = starred_cache_key(login)
+    path = f"/users/{login}/starred"
+    cached = await get_cached_starred_repos(key)
+    fresh = cached is not None and starred_repos_cache.is_fresh(cached)
+    CACHE_REQUESTS.inc(cache="starred_repos", result="hit" if fresh else "stale" if cached else "miss")
+    if max_items is not None and not fresh:
+        partial = await async_github.get_pages(path, project=_project_starred_repo,
+                                               max_pages=math.ceil(max_items / PER_PAGE),
+                                               headers={"Accept": STAR_MEDIA_TYPE})
+        return StarredFetch(_to_starred_repos(partial.items[:max_items]),
+                            "capped" if len(partial.items) >= max_items else "full")
+    if cached is None:
+        first_page = await async_github.get(path, params={"per_page": PER_PAGE, "page": 1},
+                                            headers={"Accept": STAR_MEDIA_TYPE})
+        last_page = _get_last_page(first_page, 1)
+        if guarded and HEAVY_STARRER_STRATEGY != "full" and (last_page - 1) * PER_PAGE >= HEAVY_STARRER_THRESHOLD:
+            return await _fetch_heavy_starrer_repos(login, first_page, last_page)
+        cached = await async_github.get_pages(path, project=_project_starred_repo, headers={"Accept": STAR_MEDIA_TYPE},
+                                              first_page=first_page)
+        cached.watermark = _get_watermark(cached.items)
+        await cache_starred_repos(key, cached)
+    elif not fresh:
+        cached = await _sync_starred_repos(login, cached)
+        await cache_starred_repos(key, cached)
+    items = cached.items
+    return StarredFetch(_to_starred_repos(items[:max_items]),
+                        "capped" if max_items is not None and len(items) > max_items else "full")
+
+
+async def _fetch_heavy_starrer_repos(login: str, first_page: httpx.Response, last_page: int) -> StarredFetch:
+    """
+    Fetch part of the list of a user who starred more than HEAVY_STARRER_THRESHOLD repositories, according to
+    HEAVY_STARRER_STRATEGY. Partial lists aren't cached.
+
+    Args:
+        login (str): The login of the user.
+        first_page (httpx.Response): The first page of the list, already fetched.
+        last_page (int): The number of pages of the list.
+
+    Returns:
+        StarredFetch: The part of the list that was fetched.
+    """
+    path = f"/users/{login}/starred"
+    pages = math.ceil(HEAVY_STARRER_THRESHOLD / PER_PAGE)
+    logger.info(f"{login} starred about {last_page * PER_PAGE} repositories, {HEAVY_STARRER_STRATEGY} their list")
+    if HEAVY_STARRER_STRATEGY == "defer":
+        _defer_starred_repos(login)
+        page_numbers, treatment = [], "deferred"
+    elif HEAVY_STARRER_STRATEGY == "sample":
+        page_numbers, treatment = sorted(random.sample(range(2, last_page + 1), pages - 1)), "sampled"
+    else:
+        page_numbers, treatment = list(range(2, pages + 1)), "capped"
+
+    responses = [first_page] + list(await asyncio.gather(
+        *(async_github.get(path, params={"per_page": PER_PAGE, "page": page}, headers={"Accept": STAR_MEDIA_TYPE})
+          for page in page_numbers)
+    ))
+    GITHUB_PAGES_FETCHED.observe(len(responses), endpoint=_get_endpoint(path))
+    return StarredFetch(_to_starred_repos([_project_starred_repo(item) for response in responses
+                                           for item in response.json()]), treatment)
+
+
+# Whole lists of heavy starrers being fetched in the background, by login
+_deferred: Dict[str, asyncio.Task] = {}
+
+
+def _defer_starred_repos(login: str) -> None:
+    """
+    Fetch the whole list of a heavy starrer in the background, with the background priority, so it is cached for the
+    following computations.
+    """
+    key = login.lower()
+    task = _deferred.get(key)
+    # Tasks of a closed event loop never finish (this happens in tests)
+    if task is not None and not task.done() and task.get_loop() is asyncio.get_running_loop():
+        return
+
+    async def fetch() -> None:
+        try:
+            with background_priority():
+                await _fetch_starred_repos(login, None, guarded=False)
+        except GitHubAPIException as e:
+            logger.warning(f"Deferred fetch of the starred repositories of {login} failed: {e}")
+        finally:
+            if _deferred.get(key) is asyncio.current_task():
+                del _deferred[key]
+
+    _deferred[key] = asyncio.create_task(fetch())
+
+
+async def prefetch_starred_repos(login: str) -> StarredFetch:
+    """
+    Fetch the whole list of repositories starred by a user, even a heavy starrer, so it is cached for the following
+    computations.
+
+    Args:
+        login (str): The login of the user.
+
+    Returns:
+        StarredFetch: The starred repositories, fetched whole.
+    """
+    return await starred_repos_flight.do((login.lower(), None, "prefetch"),
+                                         lambda: _fetch_starred_repos(login, None, guarded=False))
+
+
+def _to_starred_repos(items: list) -> List[StarredRepo]:
+    return [StarredRepo(*starred_repo[:2]) for starred_repo in items]
+
+
+async def _sync_starred_repos(login: str, cached: CacheEntry) -> CacheEntry:
+    """
+    Refresh a cached list of starred repositories.
+
+    Starred repositories are ordered from the most recent star, so pages are fetched from the first one until a star
+    older than the watermark of the entry is found, and the new stars are put in front of the cached ones. The
+    number of pages announced by GitHub is compared with the number of stars we know of: if they don't match, some
+    repositories were unstarred and every page is revalidated with conditional requests instead. Unstars that don't
+    change the number of pages are only noticed once the entry is fetched again from scratch.
+
+    Args:
+        login (str): The login of the user.
+        cached (CacheEntry): The stale entry.
+
+    Returns:
+        CacheEntry: The up-to-date entry.
+    """
+    path = f"/users/{login}/starred"
+    if cached.watermark is None:
+        entry = await async_github.get_pages(path, project=_project_starred_repo, cached=cached,
+                                             headers={"Accept": STAR_MEDIA_TYPE})
+        entry.watermark = _get_watermark(entry.items)
+        return entry
+
+    newer = []
+    page = last_page = 1
+    while page <= last_page:
+        response = await async_github.get(path, params={"per_page": PER_PAGE, "page": page},
+                                          headers={"Accept": STAR_MEDIA_TYPE})
+        last_page = _get_last_page(response, page)
+        starred_repos = [_project_starred_repo(starred_repo) for starred_repo in response.json()]
+        fresh = [starred_repo for starred_repo in starred_repos if starred_repo[2] > cached.watermark]
+        newer.extend(fresh)
+        if last_page == 1:
+            # The whole list fits in the first page, no need to merge it
+            GITHUB_PAGES_FETCHED.observe(1, endpoint=_get_endpoint(path))
+            return CacheEntry(pages=[CachedPage(response.headers.get("ETag"), starred_repos)],
+                              watermark=_get_watermark(starred_repos) or cached.watermark)
+        if len(fresh) < len(starred_repos):
+            break
+        page += 1
+    GITHUB_PAGES_FETCHED.observe(min(page, last_page), endpoint=_get_endpoint(path))
+
+    # A repository starred again moves to the front
+    starred_again = {starred_repo[0] for starred_repo in newer}
+    items = newer + [starred_repo for starred_repo in cached.items if starred_repo[0] not in starred_again]
+    if math.ceil(len(items) / PER_PAGE) != last_page:
+        logger.debug(f"Starred repositories of {login} shrank, revalidating every page")
+        entry = await async_github.get_pages(path, project=_project_starred_repo, cached=cached,
+                                             headers={"Accept": STAR_MEDIA_TYPE})
+        entry.watermark = _get_watermark(entry.items)
+        return entry
+
+    logger.debug(f"Starred repositories of {login} synced: {len(newer)} new in {page} pages")
+    # The pages moved, so their ETags can't be used anymore
+    pages = [CachedPage(None, items[start:start + PER_PAGE]) for start in range(0, len(items), PER_PAGE)]
+    return CacheEntry(pages=pages, watermark=_get_watermark(items) or cached.watermark)
+
+
+def _get_watermark(items: list) -> Optional[str]:
+    dates = [item[2] for item in items if len(item) > 2 and item[2]]
+    return max(dates) if dates else None
+
+
+def _project_stargazer(stargazer: dict) -> list:
+    # With the star+json media type, the user is nested in the item along with the date of the star
+    if "user" in stargazer:
+        return [stargazer["user"]["login"], stargazer.get("starred_at")]
+    return [stargazer["login"], None]
+
+
+def _project_starred_repo(starred_repo: dict) -> list:
+    # Only what the neighbours computation uses is cached, as a list so it survives a JSON round trip
+    starred_at = starred_repo.get("starred_at")
+    starred_repo = starred_repo.get("repo", starred_repo)
+    return [starred_repo["full_name"], starred_repo["stargazers_count"], starred_at]
@@ -0,0 +1,257 @@
+import asyncio
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+
+from src.services.cache import CacheEntry, CachedPage
+from src.services.github import GitHubAPIException
+from src.services.github_async import (async_github, cache_starred_repos, get_cached_starred_repos, starred_cache_key,
+                                       starred_repos_cache, starred_repos_flight, StarredFetch, StarredRepo,
+                                       HEAVY_STARRER_STRATEGY, HEAVY_STARRER_THRESHOLD, PER_PAGE)
+
+load_dotenv()
+
+# Path of the GraphQL endpoint, relative to GITHUB_API_URL
+GITHUB_GRAPHQL_PATH = os.getenv("GITHUB_GRAPHQL_PATH", "/graphql")
+# Number of users aliased in a single query, GitHub limits the cost of a query so this can't be too high
+GRAPHQL_BATCH_SIZE = int(os.getenv("GRAPHQL_BATCH_SIZE", 25))
+
+logger = logging.getLogger('uvicorn.error')
+
+# Starred lists being fetched in batches, awaited by the calls coalesced with them
+_batches: Set[asyncio.Task] = set()
+
+STARGAZERS_QUERY = """
+query($owner: String!, $name: String!, $cursor: String) {
+  repository(owner: $owner, name: $name) {
+    stargazers(first: %d, after: $cursor) {
+      pageInfo { hasNextPage endCursor }
+      nodes { login }
+    }
+  }
+}
+""" % PER_PAGE
+
+STARRED_REPOSITORIES_FRAGMENT = """
+  u%(index)d: user(login: $l%(index)d) {
+    starredRepositories(first: %(per_page)d, after: $c%(index)d, orderBy: {field: STARRED_AT, direction: DESC}) {
+      totalCount
+      pageInfo { hasNextPage endCursor }
+      nodes { nameWithOwner stargazerCount }
+    }
+  }"""
+
+
+async def _query(query: str, variables: dict) -> dict:
+    """
+    Execute a GraphQL query.
+
+    Args:
+        query (str): The GraphQL query.
+        variables (dict): The variables of the query.
+
+    Returns:
+        dict: The data of the response. Fields for which GitHub returned a NOT_FOUND error are set to None.
+
+    Raises:
+        GitHubAPIException: If GitHub returned any other error.
+    """
+    response = await async_github.post(GITHUB_GRAPHQL_PATH, json={"query": query, "variables": variables})
+    body = response.json()
+    errors = [error for error in body.get("errors", []) if error.get("type") != "NOT_FOUND"]
+    if errors:
+        logger.error(f"GitHub GraphQL errors: {errors}")
+        raise GitHubAPIException(f"Error calling GitHub GraphQL API: {errors[0].get('message')}", code=502)
+    return body.get("data") or {}
+
+
+def build_starred_repositories_query(count: int) -> str:
+    """
+    Build a query fetching a page of starred repositories for `count` users, each aliased as u0, u1, ...
+
+    The login and the cursor of each user are passed as the variables l0, c0, l1, c1, ...
+
+    Args:
+        count (int): The number of users in the query.
+
+    Returns:
+        str: The GraphQL query.
+    """
+    variables = ", ".join(f"$l{index}: String!, $c{index}: String" for index in range(count))
+    fragments = "".join(STARRED_REPOSITORIES_FRAGMENT % {"index": index, "per_page": PER_PAGE}
+                        for index in range(count))
+    return f"query({variables}) {{{fragments}\n}}"
+
+
+async def get_stargazer_logins(owner: str, repo: str) -> List[str]:
+    """
+    Fetch the logins of the stargazers of a given repository using the GraphQL API.
+
+    Args:
+        owner (str): The owner of the repository.
+        repo (str): The name of the repository.
+
+    Returns:
+        List[str]: The logins of the stargazers.
+
+    Raises:
+        GitHubAPIException: If the repository isn't found or the query fails.
+    """
+    logins: List[str] = []
+    cursor: Optional[str] = None
+    while True:
+        data = await _query(STARGAZERS_QUERY, {"owner": owner, "name": repo, "cursor": cursor})
+        if data.get("repository") is None:
+            raise GitHubAPIException(f"Repository {owner}/{repo} not found.", code=404)
+        stargazers = data["repository"]["stargazers"]
+        logins.extend(node["login"] for node in stargazers["nodes"])
+        if not stargazers["pageInfo"]["hasNextPage"]:
+            return logins
+        cursor = stargazers["pageInfo"]["endCursor"]
+
+
+@dataclass
+class StarredList:
+    """A starred list being fetched page by page, and the future of the flight fetching it."""
+    login: str
+    future: asyncio.Future
+    limit: Optional[int] = None
+    cursor: Optional[str] = None
+    items: list = field(default_factory=list)
+
+
+async def iter_starred_repos(logins: List[str], max_items: Optional[int] = None
+                             ) -> AsyncIterator[Tuple[str, StarredFetch]]:
+    """
+    Fetch the repositories starred by many users, batching users in the same queries, and yield every list as soon as
+    its last page arrives, in no particular order.
+
+    Lists go through the single-flight of `fetch_starred_repos`: lists already in flight are awaited, the others are
+    fetched by `_fetch_starred_lists`. Lists of users who starred more than HEAVY_STARRER_THRESHOLD repositories are
+    capped at the threshold, unless HEAVY_STARRER_STRATEGY is "full". Cursors can't jump to random pages, so the
+    "sample" and "defer" strategies cap them too.
+
+    Args:
+        logins (List[str]): The logins of the users.
+        max_items (int): The maximum number of repositories per user, the most recently starred first. Only the
+            pages needed are fetched.
+
+    Yields:
+        Tuple[str, StarredFetch]: The login of a user and the repositories they starred, an empty list if the user
+        doesn't exist.
+    """
+    led: Dict[str, StarredList] = {}
+
+    def lead(login: str) -> Callable[[], asyncio.Future]:
+        def fetch() -> asyncio.Future:
+            led[login] = StarredList(login, asyncio.get_running_loop().create_future(), max_items)
+            return led[login].future
+        return fetch
+
+    # Logins are case-insensitive
+    flights = {login: starred_repos_flight.join((login.lower(), max_items), lead(login))
+               for login in dict.fromkeys(logins)}
+    if led:
+        # Coalesced calls await the lists too, the batches go on if this caller gives up
+        batch = asyncio.create_task(_fetch_starred_lists(list(led.values())))
+        _batches.add(batch)
+        batch.add_done_callback(_batches.discard)
+
+    async def wait(login: str) -> Tuple[str, StarredFetch]:
+        return login, await asyncio.shield(flights[login])
+
+    for next_list in asyncio.as_completed([wait(login) for login in flights]):
+        yield await next_list
+
+
+async def _fetch_starred_lists(starred_lists: List[StarredList]) -> None:
+    """
+    Fetch starred lists, completing their futures.
+
+    Every round sends one query per batch of GRAPHQL_BATCH_SIZE users, only users that have more pages are kept for
+    the next round, with their own cursor. Fresh entries of the starred repositories cache are used directly and
+    whole lists are stored in it.
+    """
+    try:
+        cached = await asyncio.gather(*(get_cached_starred_repos(starred_cache_key(starred_list.login))
+                                        for starred_list in starred_lists))
+        pending = []
+        for starred_list, entry in zip(starred_lists, cached):
+            if entry is not None and starred_repos_cache.is_fresh(entry):
+                starred_list.items = entry.items
+                _complete(starred_list, whole=True)
+            else:
+                pending.append(starred_list)
+
+        rounds = 0
+        while pending:
+            rounds += 1
+            batches = [pending[i:i + GRAPHQL_BATCH_SIZE] for i in range(0, len(pending), GRAPHQL_BATCH_SIZE)]
+            results = await asyncio.gather(*(_fetch_starred_batch(batch) for batch in batches))
+            pending = [starred_list for continuing in results for starred_list in continuing]
+        logger.debug(f"Fetched starred repositories of {len(starred_lists)} users in {rounds} GraphQL rounds")
+    except Exception as e:
+        for starred_list in starred_lists:
+            if not starred_list.future.done():
+                starred_list.future.set_exception(e)
+    finally:
+        for starred_list in starred_lists:
+            starred_list.future.cancel()
+
+
+async def _fetch_starred_batch(batch: List[StarredList]) -> List[StarredList]:
+    """
+    Fetch the next page of a batch of starred lists, completing the lists that are done.
+
+    Returns:
+        List[StarredList]: The lists that have more pages to fetch.
+    """
+    variables = {}
+    for index, starred_list in enumerate(batch):
+        variables[f"l{index}"] = starred_list.login
+        variables[f"c{index}"] = starred_list.cursor
+    try:
+        data = await _query(build_starred_repositories_query(len(batch)), variables)
+    except GitHubAPIException as e:
+        for starred_list in batch:
+            starred_list.future.set_exception(e)
+        return []
+
+    continuing, whole = [], []
+    for index, starred_list in enumerate(batch):
+        user = data.get(f"u{index}")
+        if user is None:
+            _complete(starred_list, whole=True)
+            whole.append(starred_list)
+            continue
+        starred_repositories = user["starredRepositories"]
+        if starred_list.cursor is None and HEAVY_STARRER_STRATEGY != "full" \
+                and starred_repositories["totalCount"] > HEAVY_STARRER_THRESHOLD:
+            logger.info(f"{starred_list.login} starred {starred_repositories['totalCount']} repositories, capping "
+                        f"their list")
+            starred_list.limit = min(starred_list.limit or HEAVY_STARRER_THRESHOLD, HEAVY_STARRER_THRESHOLD)
+        starred_list.items.extend([node["nameWithOwner"], node["stargazerCount"]]
+                                  for node in starred_repositories["nodes"])
+        has_next_page = starred_repositories["pageInfo"]["hasNextPage"]
+        if has_next_page and (starred_list.limit is None or len(starred_list.items) < starred_list.limit):
+            starred_list.cursor = starred_repositories["pageInfo"]["endCursor"]
+            continuing.append(starred_list)
+        else:
+            _complete(starred_list, whole=not has_next_page)
+            if not has_next_page:
+                whole.append(starred_list)
+
+    await asyncio.gather(*(cache_starred_repos(starred_cache_key(starred_list.login),
+                                               CacheEntry(pages=[CachedPage(None, starred_list.items)]))
+                           for starred_list in whole))
+    return continuing
+
+
+def _complete(starred_list: StarredList, whole: bool) -> None:
+    items, limit = starred_list.items, starred_list.limit
+    capped = not whole or (limit is not None and len(items) > limit)
+    starred_list.future.set_result(StarredFetch([StarredRepo(*item[:2]) for item in items[:limit]],
+                                                "capped" if capped else "full"))
@@ -0,0 +1,260 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+import zlib
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from src.services.github import GitHubAPIException
+from src.services.ratelimit import background_priority
+from src.services.scoring import NeighbourScorer
+from src.services.starneighbours import get_stargazers, iter_starred_repos
+from src.services.workers import ProcessLock
+from src.utils import sqlite
+
+load_dotenv()
+
+# Database storing the jobs, their checkpoints and results
+JOBS_DB = os.getenv("JOBS_DB", "jobs.db")
+# Number of jobs computed at the same time
+JOBS_MAX_WORKERS = int(os.getenv("JOBS_MAX_WORKERS", 2))
+# Number of stargazers processed between two checkpoints
+JOBS_CHECKPOINT_INTERVAL = int(os.getenv("JOBS_CHECKPOINT_INTERVAL", 500))
+
+# Statuses of a job
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+logger = logging.getLogger('uvicorn.error')
+
+
+class JobStore:
+    """
+    SQLite storage of the neighbour jobs.
+
+    Checkpoints hold the state of the scorer, compressed, so an interrupted job resumes where it stopped.
+    """
+
+    def __init__(self, db_path: str):
+        self._db = sqlite.connect(db_path)
+        self._lock = threading.Lock()
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, owner TEXT, repo TEXT, options TEXT, status TEXT,"
+            " processed INTEGER, total INTEGER, result TEXT, error TEXT, checkpoint BLOB, created_at REAL,"
+            " updated_at REAL)"
+        )
+        self._db.commit()
+
+    def create(self, owner: str, repo: str, options: Dict) -> Dict:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, owner, repo, options, status, processed, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, 0, ?, ?)",
+                (job_id, owner, repo, json.dumps(options, sort_keys=True), QUEUED, now, now)
+            )
+            self._db.commit()
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, owner, repo, options, status, processed, total, result, error FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job_id, owner, repo, options, status, processed, total, result, error = row
+        return {
+            "id": job_id,
+            "repository": f"{owner}/{repo}",
+            "options": json.loads(options),
+            "status": status,
+            "progress": {"processed": processed, "total": total},
+            "result": json.loads(result) if result is not None else None,
+            "error": error,
+        }
+
+    def find_active(self, owner: str, repo: str, options: Dict) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id FROM jobs WHERE owner = ? AND repo = ? AND options = ? AND status IN (?, ?)",
+                (owner, repo, json.dumps(options, sort_keys=True), QUEUED, RUNNING)
+            ).fetchone()
+        return row[0] if row else None
+
+    def list_unfinished(self) -> List[str]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id FROM jobs WHERE status IN (?, ?) ORDER BY created_at", (QUEUED, RUNNING)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def get_checkpoint(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._db.execute("SELECT checkpoint FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return json.loads(zlib.decompress(row[0]))
+
+    def update(self, job_id: str, **fields) -> None:
+        if "checkpoint" in fields and fields["checkpoint"] is not None:
+            fields["checkpoint"] = zlib.compress(json.dumps(fields["checkpoint"]).encode())
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"])
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._db.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+            self._db.commit()
+
+
+class JobManager:
+    """
+    Runs neighbour computations in the background as asyncio tasks.
+
+    At most JOBS_MAX_WORKERS jobs are computed at the same time, the others wait in the queue. Jobs make background
+    priority requests, so interactive requests keep a share of the rate limit. Unfinished jobs are resumed from their
+    last checkpoint when the manager starts. With several worker processes, a job is computed by the worker it was
+    submitted to, the process computing a job holding its lock so the leader doesn't resume it a second time.
+    """
+
+    def __init__(self, store: Optional[JobStore] = None, max_workers: int = JOBS_MAX_WORKERS,
+                 checkpoint_interval: int = JOBS_CHECKPOINT_INTERVAL, db_path: str = JOBS_DB):
+        self._store = store
+        self.db_path = db_path
+        self.max_workers = max_workers
+        self.checkpoint_interval = checkpoint_interval
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._workers: Optional[asyncio.Semaphore] = None
+
+    @property
+    def store(self) -> JobStore:
+        # The database is opened on first use, importing the module doesn't create it
+        if self._store is None:
+            self._store = JobStore(self.db_path)
+        return self._store
+
+    async def start(self) -> None:
+        """
+        Resume the jobs that were queued or running when the application stopped.
+        """
+        for job_id in self.store.list_unfinished():
+            logger.info(f"Resuming neighbours job {job_id}")
+            self._schedule(job_id)
+
+    async def stop(self) -> None:
+        """
+        Cancel the running jobs, their progress is checkpointed so they are resumed on the next start.
+        """
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        self._tasks.clear()
+
+    def submit(self, owner: str, repo: str, options: Dict) -> Dict:
+        """
+        Queue a neighbour computation, or return the identical job already queued or running.
+
+        Args:
+            owner (str): The owner of the repository.
+            repo (str): The name of the repository.
+            options (Dict): The options of the computation: limit, min_shared and metric.
+
+        Returns:
+            Dict: The job.
+        """
+        job_id = self.store.find_active(owner, repo, options)
+        if job_id is None:
+            job_id = self.store.create(owner, repo, options)["id"]
+        if job_id not in self._tasks:
+            self._schedule(job_id)
+        return self.store.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        return self.store.get(job_id)
+
+    def find_active(self, owner: str, repo: str, options: Dict) -> Optional[str]:
+        """
+        Return the id of the identical job queued or running, None if there is none.
+        """
+        return self.store.find_active(owner, repo, options)
+
+    async def wait(self, job_id: str) -> None:
+        """
+        Wait until a job is finished.
+        """
+        task = self._tasks.get(job_id)
+        if task is not None:
+            await asyncio.gather(task, return_exceptions=True)
+
+    def _schedule(self, job_id: str) -> None:
+        if self._workers is None:
+            self._workers = asyncio.Semaphore(self.max_workers)
+        task = asyncio.create_task(self._run(job_id))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+
+    async def _run(self, job_id: str) -> None:
+        async with self._workers:
+            lock = ProcessLock(f"job-{job_id}")
+            if not lock.try_acquire():
+                logger.info(f"Neighbours job {job_id} is computed by another worker")
+                return
+            with background_priority():
+                try:
+                    await self._compute(job_id)
+                except GitHubAPIException as e:
+                    logger.error(f"Neighbours job {job_id} failed: {e}")
+                    self.store.update(job_id, status=FAILED, error=e.message, checkpoint=None)
+                except Exception as e:  # Whatever happens, pollers must see the job finish
+                    logger.exception(f"Neighbours job {job_id} failed: {e}")
+                    self.store.update(job_id, status=FAILED, error="Internal error.", checkpoint=None)
+                finally:
+                    lock.release()
+
+    async def _compute(self, job_id: str) -> None:
+        job = self.store.get(job_id)
+        owner, repo = job["repository"].split("/", 1)
+        options = job["options"]
+        self.store.update(job_id, status=RUNNING)
+
+        # Checkpoints are compressed scorer states, they are read and written off the event loop
+        state = await asyncio.to_thread(self.store.get_checkpoint, job_id)
+        if state is not None:
+            scorer = NeighbourScorer.from_state(state)
+        else:
+            scorer = NeighbourScorer(job["repository"], await get_stargazers(owner, repo))
+        remaining = [login for login in scorer.logins if not scorer.is_processed(login)]
+        self.store.update(job_id, processed=len(scorer.processed), total=scorer.stargazers_count)
+
+        since_checkpoint = 0
+        try:
+            async for stargazer, starred_repos in iter_starred_repos(remaining):
+                scorer.add_starred(stargazer, starred_repos)
+                since_checkpoint += 1
+                if since_checkpoint >= self.checkpoint_interval:
+                    await asyncio.to_thread(self._checkpoint, job_id, scorer)
+                    since_checkpoint = 0
+        except asyncio.CancelledError:
+            self._checkpoint(job_id, scorer, status=QUEUED)
+            raise
+
+        result = scorer.top_k(options["limit"], min_shared=options["min_shared"], metric=options["metric"])
+        await asyncio.to_thread(self.store.update, job_id, status=DONE, processed=len(scorer.processed),
+                                result=result, checkpoint=None)
+        logger.info(f"Neighbours job {job_id} for {job['repository']} is done")
+
+    def _checkpoint(self, job_id: str, scorer: NeighbourScorer, **fields) -> None:
+        self.store.update(job_id, processed=len(scorer.processed), checkpoint=scorer.to_state(), **fields)
+
+
+job_manager = JobManager()
@@ -0,0 +1,278 @@
+import hashlib
+import json
+import logging
+import os
+import struct
+import threading
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+from src.services.workers import ProcessLock
+
+load_dotenv()
+
+# Number of hash functions of a signature, the error of the estimated similarity is about 1 / sqrt(MINHASH_NUM_PERM)
+MINHASH_NUM_PERM = int(os.getenv("MINHASH_NUM_PERM", 128))
+# Number of LSH bands, more bands find neighbours with a lower similarity but return more candidates
+MINHASH_BANDS = int(os.getenv("MINHASH_BANDS", 64))
+# File storing the index across restarts, empty to keep it in memory only
+MINHASH_INDEX_PATH = os.getenv("MINHASH_INDEX_PATH", "")
+MINHASH_SEED = 1
+
+# Mersenne prime used by the universal hash functions
+_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+# Header of the index file: magic, number of hash functions, number of bands, number of repositories, size of names
+_HEADER = struct.Struct("<8sIIQQ")
+_MAGIC = b"MINHASH1"
+
+logger = logging.getLogger('uvicorn.error')
+
+
+def hash_logins(logins: Iterable[str]) -> np.ndarray:
+    """
+    Hash logins into 32-bit integers, stable across processes unlike `hash`.
+    """
+    return np.fromiter((int.from_bytes(hashlib.blake2b(login.encode(), digest_size=4).digest(), "little")
+                        for login in logins), dtype=np.uint64)
+
+
+class MinHashIndex:
+    """
+    Index of repositories by MinHash signatures of their stargazers, answering neighbour lookups without GitHub.
+
+    The signature of a repository keeps, for every hash function, the minimum hash of its stargazers, the proportion
+    of equal values between two signatures estimating the Jaccard similarity of both sets of stargazers. Signatures
+    are split into bands and repositories sharing a band are candidates, so a lookup only compares a few signatures.
+    As the signature of a union is the minimum of the signatures, new stargazers are merged without the old ones.
+
+    The file stores a header, the signatures, the number of stargazers of every repository then their names as JSON.
+    Signatures are memory-mapped when the index is loaded, and copied in memory on the first update.
+    """
+
+    def __init__(self, num_perm: int = MINHASH_NUM_PERM, bands: int = MINHASH_BANDS, seed: int = MINHASH_SEED):
+        if num_perm % bands:
+            raise ValueError("The number of hash functions must be a multiple of the number of bands.")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        generator = np.random.default_rng(seed)
+        self._a = generator.integers(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = generator.integers(0, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._names: List[str] = []
+        self._ids: Dict[str, int] = {}
+        self._signatures = np.empty((0, num_perm), dtype=np.uint32)
+        self._counts = np.empty(0, dtype=np.uint64)
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(bands)]
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __contains__(self, repository: str) -> bool:
+        return repository in self._ids
+
+    def signature(self, logins: Iterable[str]) -> np.ndarray:
+        """
+        Compute the MinHash signature of a set of logins, every hash function being applied to every login at once.
+
+        Args:
+            logins (Iterable[str]): The logins.
+
+        Returns:
+            np.ndarray: The signature, the maximum hash for an empty set.
+        """
+        hashes = hash_logins(logins)
+        if not hashes.size:
+            return np.full(self.num_perm, _MAX_HASH, dtype=np.uint32)
+        # (a * x + b) fits in 64 bits as a, b and x are 32-bit integers
+        permuted = (np.outer(hashes, self._a) + self._b) % _PRIME & _MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def update(self, repository: str, stargazers: Iterable[str], count: Optional[int] = None) -> None:
+        """
+        Add the stargazers of a repository to the index.
+
+        Args:
+            repository (str): The full name of the repository.
+            stargazers (Iterable[str]): Stargazers of the repository, new ones are merged with the indexed ones.
+            count (int): The number of stargazers of the repository, when `stargazers` are only the new ones.
+                Defaults to the number of `stargazers`, or the indexed number if it is larger.
+        """
+        stargazers = list(stargazers)
+        signature = self.signature(stargazers)
+        with self._lock:
+            repo_id = self._ids.get(repository)
+            if count is None:
+                count = len(stargazers) if repo_id is None else max(int(self._counts[repo_id]), len(stargazers))
+            self._add(repository, signature, count)
+
+    def merge(self, other: "MinHashIndex") -> None:
+        """
+        Merge the repositories of another index, with the same hash functions, into this one.
+        """
+        with self._lock, other._lock:
+            for repo_id, repository in enumerate(other._names):
+                count = int(other._counts[repo_id])
+                if repository in self._ids:
+                    count = max(count, int(self._counts[self._ids[repository]]))
+                self._add(repository, other._signatures[repo_id], count)
+
+    def neighbours(self, repository: str, limit: int, min_shared: int = 1) -> Optional[List[Dict]]:
+        """
+        Find the neighbours of an indexed repository.
+
+        Args:
+            repository (str): The full name of the repository.
+            limit (int): The maximum number of neighbours to return.
+            min_shared (int): The minimum estimated number of shared stargazers of a neighbour.
+
+        Returns:
+            List[Dict] | None: The neighbours, most similar first, with their estimated Jaccard similarity as score
+            and their estimated number of shared stargazers. None if the repository isn't indexed.
+        """
+        with self._lock:
+            repo_id = self._ids.get(repository)
+            if repo_id is None:
+                return None
+            candidates = set()
+            for band, key in enumerate(self._band_keys(repo_id)):
+                candidates.update(self._buckets[band].get(key, ()))
+            candidates.discard(repo_id)
+            if not candidates:
+                return []
+
+            candidate_ids = np.fromiter(candidates, dtype=np.int64)
+            similarities = (self._signatures[candidate_ids] == self._signatures[repo_id]).mean(axis=1)
+            # |A ∩ B| = J (|A| + |B|) / (1 + J)
+            shared = similarities * (self._counts[candidate_ids] + self._counts[repo_id]) / (1 + similarities)
+            order = np.lexsort((candidate_ids, -similarities))
+            neighbours = []
+            for index in order:
+                if shared[index] < min_shared or similarities[index] == 0:
+                    continue
+                neighbours.append({
+                    "repo": self._names[candidate_ids[index]],
+                    "score": round(float(similarities[index]), 4),
+                    "estimatedShared": round(float(shared[index]), 1),
+                })
+                if len(neighbours) == limit:
+                    break
+            return neighbours
+
+    def save(self, path: str) -> None:
+        """
+        Write the index to a file, atomically so a memory-mapped previous version stays valid.
+        """
+        with self._lock:
+            count = len(self._names)
+            names = json.dumps(self._names).encode()
+            # The temporary file is per process, so processes saving at the same time don't write to the same one
+            temporary_path = f"{path}.{os.getpid()}.tmp"
+            with open(temporary_path, "wb") as index_file:
+                index_file.write(_HEADER.pack(_MAGIC, self.num_perm, self.bands, count, len(names)))
+                index_file.write(np.ascontiguousarray(self._signatures[:count], dtype="<u4").tobytes())
+                index_file.write(np.ascontiguousarray(self._counts[:count], dtype="<u8").tobytes())
+                index_file.write(names)
+            os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path: str, seed: int = MINHASH_SEED) -> "MinHashIndex":
+        """
+        Load an index written by `save`, its signatures are memory-mapped.
+
+        Raises:
+            ValueError: If the file isn't a MinHash index.
+        """
+        with open(path, "rb") as index_file:
+            magic, num_perm, bands, count, names_size = _HEADER.unpack(index_file.read(_HEADER.size))
+            if magic != _MAGIC:
+                raise ValueError(f"{path} isn't a MinHash index.")
+            index = cls(num_perm, bands, seed)
+            signatures_size = count * num_perm * 4
+            index_file.seek(_HEADER.size + signatures_size + count * 8)
+            index._names = json.loads(index_file.read(names_size))
+        if count:
+            index._signatures = np.memmap(path, dtype="<u4", mode="r", offset=_HEADER.size, shape=(count, num_perm))
+            index._counts = np.memmap(path, dtype="<u8", mode="r", offset=_HEADER.size + signatures_size,
+                                      shape=(count,))
+        index._ids = {name: repo_id for repo_id, name in enumerate(index._names)}
+        for repo_id in range(count):
+            index._bucket(repo_id)
+        return index
+
+    def _add(self, repository: str, signature: np.ndarray, count: int) -> None:
+        repo_id = self._ids.get(repository)
+        if repo_id is None:
+            repo_id = len(self._names)
+            self._reserve(repo_id + 1)
+            self._ids[repository] = repo_id
+            self._names.append(repository)
+            self._signatures[repo_id] = signature
+        else:
+            self._unbucket(repo_id)
+            self._reserve(len(self._names))
+            np.minimum(self._signatures[repo_id], signature, out=self._signatures[repo_id])
+        self._counts[repo_id] = count
+        self._bucket(repo_id)
+
+    def _reserve(self, size: int) -> None:
+        # The arrays grow geometrically, so adding repositories one by one stays linear, and the memory-mapped ones
+        # are copied in memory before their first update
+        capacity = len(self._counts)
+        if size <= capacity and self._signatures.flags.writeable:
+            return
+        if size > capacity:
+            capacity = max(size, 2 * capacity)
+        signatures = np.empty((capacity, self.num_perm), dtype=np.uint32)
+        counts = np.zeros(capacity, dtype=np.uint64)
+        signatures[:len(self._names)] = self._signatures[:len(self._names)]
+        counts[:len(self._names)] = self._counts[:len(self._names)]
+        self._signatures, self._counts = signatures, counts
+
+    def _band_keys(self, repo_id: int) -> List[bytes]:
+        signature = np.ascontiguousarray(self._signatures[repo_id])
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    def _bucket(self, repo_id: int) -> None:
+        for band, key in enumerate(self._band_keys(repo_id)):
+            self._buckets[band].setdefault(key, []).append(repo_id)
+
+    def _unbucket(self, repo_id: int) -> None:
+        for band, key in enumerate(self._band_keys(repo_id)):
+            self._buckets[band][key].remove(repo_id)
+
+
+def _load_index() -> MinHashIndex:
+    if MINHASH_INDEX_PATH and os.path.exists(MINHASH_INDEX_PATH):
+        try:
+            return MinHashIndex.load(MINHASH_INDEX_PATH)
+        except (OSError, ValueError) as e:
+            logger.error(f"MinHash index {MINHASH_INDEX_PATH} couldn't be loaded: {e}")
+    return MinHashIndex()
+
+
+def save_index(path: str = MINHASH_INDEX_PATH) -> None:
+    """
+    Persist the index to MINHASH_INDEX_PATH, if set.
+
+    Every worker process holds its own updates, so the index is merged into the saved one, one worker at a time.
+    """
+    if not path:
+        return
+    with ProcessLock("minhash-index"):
+        index = minhash_index
+        if os.path.exists(path):
+            try:
+                index = MinHashIndex.load(path)
+                index.merge(minhash_index)
+            except (OSError, ValueError) as e:
+                logger.error(f"MinHash index {path} couldn't be loaded, it is overwritten: {e}")
+                index = minhash_index
+        index.save(path)
+    logger.info(f"MinHash index of {len(index)} repositories saved to {path}")
+
+
+minhash_index = _load_index()
@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Mapping, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Pace of outgoing requests, GitHub's secondary rate limits forbid bursts even when the hourly budget isn't spent
+GITHUB_REQUESTS_PER_SECOND = float(os.getenv("GITHUB_REQUESTS_PER_SECOND", 15))
+GITHUB_REQUESTS_BURST = int(os.getenv("GITHUB_REQUESTS_BURST", 100))
+# Share of the hourly budget that background work can't use, so interactive requests are still served
+GITHUB_BACKGROUND_RESERVE = float(os.getenv("GITHUB_BACKGROUND_RESERVE", 0.2))
+# Longest time an interactive request waits for the budget before failing, in seconds
+GITHUB_RATE_LIMIT_MAX_WAIT = float(os.getenv("GITHUB_RATE_LIMIT_MAX_WAIT", 60))
+# Number of times a request rejected because of a rate limit is retried once the limit is lifted
+GITHUB_RATE_LIMIT_RETRIES = int(os.getenv("GITHUB_RATE_LIMIT_RETRIES", 3))
+
+# Priorities of the requests
+INTERACTIVE = 0
+BACKGROUND = 1
+
+request_priority: ContextVar[int] = ContextVar("request_priority", default=INTERACTIVE)
+
+logger = logging.getLogger('uvicorn.error')
+
+
+@contextmanager
+def background_priority():
+    """
+    Context manager marking the GitHub requests made inside it, including in tasks it creates, as background work.
+    """
+    token = request_priority.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        request_priority.reset(token)
+
+
+class RateLimitExceeded(Exception):
+    """Exception raised when a request would have to wait too long for the rate limit to be lifted."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limit exceeded, retry in {retry_after:.0f} seconds.")
+        self.retry_after = retry_after
+
+
+class RateLimitScheduler:
+    """
+    Schedules outgoing GitHub requests according to the rate limits.
+
+    Requests are paced with a token bucket. The hourly budget reported by GitHub in the X-RateLimit-* headers is
+    tracked: once it is spent, requests wait for the reset, and background requests already wait once only the
+    reserved share of the budget is left. Secondary rate limits (Retry-After) block every request until lifted.
+    The scheduler doesn't make any request, callers reserve a slot, wait for the returned delay, then report the
+    response headers with `update`.
+    """
+
+    def __init__(self, rate: float = GITHUB_REQUESTS_PER_SECOND, burst: int = GITHUB_REQUESTS_BURST,
+                 background_reserve: float = GITHUB_BACKGROUND_RESERVE, max_wait: float = GITHUB_RATE_LIMIT_MAX_WAIT):
+        self.rate = rate
+        self.burst = burst
+        self.background_reserve = background_reserve
+        self.max_wait = max_wait
+        self.limit: Optional[int] = None
+        self.remaining: Optional[int] = None
+        self.reset_at: float = 0
+        self.blocked_until: float = 0
+        self._tokens: float = burst
+        self._refilled_at: float = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, priority: Optional[int] = None) -> float:
+        """
+        Reserve a slot for a request.
+
+        Args:
+            priority (int): INTERACTIVE or BACKGROUND, defaults to the priority of the current context.
+
+        Returns:
+            float: The number of seconds to wait before sending the request.
+
+        Raises:
+            RateLimitExceeded: If an interactive request would have to wait longer than `max_wait`.
+        """
+        priority = request_priority.get() if priority is None else priority
+        with self._lock:
+            now = time.time()
+            delay = max(self.blocked_until - now, 0)
+
+            if self.remaining is not None and self.reset_at > now:
+                floor = math.ceil(self.limit * self.background_reserve) if priority == BACKGROUND else 0
+                if self.remaining <= floor:
+                    delay = max(delay, self.reset_at - now)
+
+            if priority == INTERACTIVE and delay > self.max_wait:
+                raise RateLimitExceeded(delay)
+
+            monotonic_now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (monotonic_now - self._refilled_at) * self.rate)
+            self._refilled_at = monotonic_now
+            self._tokens -= 1
+            if self._tokens < 0:
+                delay = max(delay, -self._tokens / self.rate)
+
+            if self.remaining is not None and self.remaining > 0:
+                self.remaining -= 1
+            return delay
+
+    async def acquire(self, priority: Optional[int] = None) -> None:
+        """
+        Wait until a request can be sent, without blocking the event loop.
+        """
+        delay = self.reserve(priority)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def acquire_sync(self, priority: Optional[int] = None) -> None:
+        """
+        Wait until a request can be sent, blocking the current thread.
+        """
+        delay = self.reserve(priority)
+        if delay > 0:
+            time.sleep(delay)
+
+    def update(self, headers: Mapping[str, str]) -> None:
+        """
+        Update the tracked budget from the headers of a GitHub response.
+
+        Args:
+            headers (Mapping[str, str]): The headers of the response.
+        """
+        headers = _lowercase(headers)
+        remaining = headers.get("x-ratelimit-remaining")
+        reset = headers.get("x-ratelimit-reset")
+        if remaining is None or reset is None:
+            return
+        self.record(int(remaining), int(headers.get("x-ratelimit-limit", self.limit or 5000)), float(reset))
+
+    def record(self, remaining: int, limit: int, reset_at: float) -> None:
+        """
+        Update the tracked budget.
+
+        Responses can come back out of order, so within the same window the lowest remaining value wins.
+
+        Args:
+            remaining (int): The number of requests left in the window.
+            limit (int): The number of requests allowed in a window.
+            reset_at (float): The timestamp at which the window is reset.
+        """
+        with self._lock:
+            if reset_at == self.reset_at and self.remaining is not None:
+                self.remaining = min(self.remaining, remaining)
+            else:
+                self.remaining = remaining
+            self.reset_at = reset_at
+            self.limit = limit
+
+    def backoff(self, status: int, headers: Mapping[str, str]) -> Optional[float]:
+        """
+        Check if a response was rejected because of a rate limit, and block requests until it is lifted if so.
+
+        Args:
+            status (int): The status code of the response.
+            headers (Mapping[str, str]): The headers of the response.
+
+        Returns:
+            float | None: The number of seconds until the limit is lifted, None if the response isn't rate limited.
+        """
+        if status not in (403, 429):
+            return None
+        headers = _lowercase(headers)
+        now = time.time()
+        if headers.get("retry-after") is not None:
+            delay = float(headers["retry-after"])
+        elif headers.get("x-ratelimit-remaining") == "0" and headers.get("x-ratelimit-reset") is not None:
+            delay = max(float(headers["x-ratelimit-reset"]) - now, 0)
+        else:
+            return None
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, now + delay)
+        logger.warning(f"GitHub rate limit hit, requests are paused for {delay:.0f} seconds")
+        return delay
+
+    def get_remaining_budget(self) -> Optional[int]:
+        """
+        Return the number of requests left in the current window, so callers can degrade instead of failing.
+
+        Returns:
+            int | None: The remaining number of requests, None if no response has been seen yet.
+        """
+        with self._lock:
+            if self.remaining is not None and self.reset_at <= time.time():
+                return self.limit
+            return self.remaining
+
+
+def _lowercase(headers: Mapping[str, str]) -> dict:
+    # PyGithub exposes headers with lowercase names, httpx with their original case
+    return {name.lower(): value for name, value in headers.items()}
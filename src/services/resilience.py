@@ -0,0 +1,212 @@
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Deque, Dict, Iterator, Optional
+
+from dotenv import load_dotenv
+
+from src.utils.metrics import Counter
+
+load_dotenv()
+
+# Number of times an idempotent request failing with a transport error or a 5xx status code is retried
+GITHUB_RETRIES = int(os.getenv("GITHUB_RETRIES", 3))
+# Base and maximum of the exponential backoff between retries, the delays are drawn uniformly below it (full jitter)
+GITHUB_RETRY_BACKOFF = float(os.getenv("GITHUB_RETRY_BACKOFF", 0.5))  # in seconds
+GITHUB_RETRY_MAX_BACKOFF = float(os.getenv("GITHUB_RETRY_MAX_BACKOFF", 8))  # in seconds
+# Consecutive failed requests that open the circuit, and how long it stays open before a request probes GitHub again
+GITHUB_BREAKER_FAILURES = int(os.getenv("GITHUB_BREAKER_FAILURES", 20))
+GITHUB_BREAKER_COOLDOWN = float(os.getenv("GITHUB_BREAKER_COOLDOWN", 30))  # in seconds
+# A duplicate of a GET request is sent when it takes longer than this percentile of the latencies of its endpoint,
+# 0 to disable hedging
+GITHUB_HEDGE_PERCENTILE = float(os.getenv("GITHUB_HEDGE_PERCENTILE", 0.95))
+# Maximum share of the requests that are hedged, as hedges use the rate limit
+GITHUB_HEDGE_BUDGET = float(os.getenv("GITHUB_HEDGE_BUDGET", 0.05))
+
+# Status codes of the upstream errors worth retrying
+RETRY_STATUSES = frozenset({500, 502, 503, 504})
+# Latencies kept per endpoint, and needed before hedging its requests
+LATENCY_WINDOW = 1000
+LATENCY_MIN_SAMPLES = 50
+
+logger = logging.getLogger('uvicorn.error')
+
+GITHUB_RETRIES_TOTAL = Counter("github_retries_total", "GitHub API requests retried after an upstream error",
+                               ("client", "endpoint"))
+GITHUB_HEDGES_TOTAL = Counter("github_hedges_total", "Duplicate GitHub API requests sent for slow requests, by "
+                                                     "whether the duplicate answered first", ("endpoint", "won"))
+
+
+def backoff_delay(attempt: int, base: float = GITHUB_RETRY_BACKOFF, cap: float = GITHUB_RETRY_MAX_BACKOFF) -> float:
+    """
+    The delay before the retry following the given attempt, starting at 0, with full jitter so the retries of
+    concurrent requests are spread.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitOpen(Exception):
+    """Exception raised when requests aren't sent because the circuit breaker is open."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"GitHub API is failing, requests are suspended for {retry_after:.0f} seconds.")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to an upstream that keeps failing, so they fail fast instead of piling up.
+
+    The circuit opens after `failures` consecutive failures. Once the cooldown is over, it is half-open: a single
+    request probes the upstream, closing the circuit if it succeeds or opening it again if it fails. A probe that ends
+    without either, because it was cancelled or never sent, must be released so another request can probe.
+    """
+
+    def __init__(self, failures: int = GITHUB_BREAKER_FAILURES, cooldown: float = GITHUB_BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.opened_at: Optional[float] = None
+        self._consecutive_failures = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "open" if time.monotonic() - self.opened_at < self.cooldown else "half-open"
+
+    def check(self) -> bool:
+        """
+        Check that a request can be sent.
+
+        Returns:
+            bool: Whether the request is the probe of the half-open circuit, it must then be released with
+            `release_probe` once done.
+
+        Raises:
+            CircuitOpen: If the circuit is open, or half-open with a probe already in flight.
+        """
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return False
+            if state == "half-open" and not self._probing:
+                self._probing = True
+                return True
+            raise CircuitOpen(max(self.opened_at + self.cooldown - time.monotonic(), 0))
+
+    def release_probe(self) -> None:
+        """
+        Let another request probe the half-open circuit, the probe having ended without a success or a failure being
+        recorded. Does nothing once one was recorded.
+        """
+        with self._lock:
+            self._probing = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info("GitHub API answered again, closing the circuit")
+            self.opened_at, self._consecutive_failures, self._probing = None, 0, False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._consecutive_failures += 1
+            if self._probing or (self.opened_at is None and self._consecutive_failures >= self.failures):
+                logger.warning(f"GitHub API failed {self._consecutive_failures} times in a row, opening the circuit "
+                               f"for {self.cooldown:.0f} seconds")
+                self.opened_at, self._probing = time.monotonic(), False
+
+
+class LatencyTracker:
+    """
+    Recent latencies of the requests per endpoint, deciding after how long a request is hedged.
+
+    Hedges are limited to a share of the requests, so a slow upstream doesn't make us double our load on it.
+    """
+
+    def __init__(self, percentile: float = GITHUB_HEDGE_PERCENTILE, budget: float = GITHUB_HEDGE_BUDGET):
+        self.percentile = percentile
+        self.budget = budget
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._requests = 0
+        self._hedges = 0
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint: str, latency: float) -> None:
+        with self._lock:
+            self._latencies.setdefault(endpoint, deque(maxlen=LATENCY_WINDOW)).append(latency)
+
+    def hedge_delay(self, endpoint: str) -> Optional[float]:
+        """
+        The time after which a request to the endpoint is hedged, None if it shouldn't be.
+        """
+        with self._lock:
+            self._requests += 1
+            latencies = self._latencies.get(endpoint)
+            if not self.percentile or latencies is None or len(latencies) < LATENCY_MIN_SAMPLES:
+                return None
+            return sorted(latencies)[min(int(len(latencies) * self.percentile), len(latencies) - 1)]
+
+    def acquire_hedge(self) -> bool:
+        """
+        Reserve a hedge in the budget, False if it is spent.
+        """
+        with self._lock:
+            if self._hedges + 1 > self.budget * self._requests:
+                return False
+            self._hedges += 1
+            return True
+
+
+@dataclass
+class RequestStats:
+    """
+    The GitHub requests made on behalf of an API request.
+
+    Attributes:
+        requests (int): The number of requests sent, retries and hedges included.
+        retries (int): The number of requests retried after an upstream error.
+        hedges (int): The number of duplicate requests sent for slow requests.
+    """
+    requests: int = 0
+    retries: int = 0
+    hedges: int = 0
+
+
+request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+@contextmanager
+def track_request_stats() -> Iterator[RequestStats]:
+    """
+    Context manager counting the GitHub requests made inside it, including in tasks it creates.
+    """
+    stats = RequestStats()
+    token = request_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        request_stats.reset(token)
+
+
+def record(requests: int = 0, retries: int = 0, hedges: int = 0) -> None:
+    """
+    Add to the stats of the current API request, if they are tracked.
+    """
+    stats = request_stats.get()
+    if stats is not None:
+        stats.requests += requests
+        stats.retries += retries
+        stats.hedges += hedges
+
+
+circuit_breaker = CircuitBreaker()
+latency_tracker = LatencyTracker()
@@ -0,0 +1,222 @@
+import heapq
+import math
+from array import array
+from typing import Dict, Iterable, List, Literal, Optional, Tuple
+
+from src.services.github_async import StarredRepo
+
+Metric = Literal["overlap", "jaccard"]
+
+# Quantile of the normal distribution for 95% confidence intervals
+CONFIDENCE_Z = 1.96
+
+
+class NeighbourScorer:
+    """
+    Accumulates co-star counts between a repository and the repositories its stargazers starred.
+
+    Logins and repository names are interned into integer IDs once, and an inverted index maps every repository to
+    the IDs of the stargazers who starred it. Starred lists can be added as they arrive, in any order, and the
+    neighbours are ranked with a heap so only the top results are materialized.
+
+    The stargazers can be a sample of a larger population of stargazers, the scores are then estimates scaled to
+    the population and neighbours come with a confidence interval of their number of shared stargazers.
+    """
+
+    def __init__(self, repository: str, stargazers: Iterable[str], population: Optional[int] = None):
+        self.repository = repository
+        self._logins: List[str] = list(dict.fromkeys(stargazers))
+        self.population: int = max(population or 0, len(self._logins))
+        self._user_ids: Dict[str, int] = {login: user_id for user_id, login in enumerate(self._logins)}
+        self._repo_names: List[str] = []
+        self._repo_ids: Dict[str, int] = {}
+        self._repo_users: List[array] = []
+        self._repo_stars: List[int] = []
+        self.processed: set[int] = set()
+
+    @property
+    def logins(self) -> List[str]:
+        return self._logins
+
+    @property
+    def stargazers_count(self) -> int:
+        return len(self._logins)
+
+    @property
+    def approximate(self) -> bool:
+        return self.population > self.stargazers_count
+
+    @classmethod
+    def from_state(cls, state: Dict) -> "NeighbourScorer":
+        """
+        Restore a scorer from a state returned by `to_state`.
+        """
+        scorer = cls(state["repository"], state["logins"], state.get("population"))
+        scorer._repo_names = state["repos"]
+        scorer._repo_ids = {full_name: repo_id for repo_id, full_name in enumerate(scorer._repo_names)}
+        scorer._repo_stars = state["stars"]
+        scorer._repo_users = [array("I", users) for users in state["users"]]
+        scorer.processed = set(state["processed"])
+        return scorer
+
+    def to_state(self) -> Dict:
+        """
+        Export the state of the scorer as JSON-serializable data, so a computation can be resumed.
+        """
+        return {
+            "repository": self.repository,
+            "logins": self._logins,
+            "population": self.population,
+            "repos": self._repo_names,
+            "stars": self._repo_stars,
+            "users": [users.tolist() for users in self._repo_users],
+            "processed": sorted(self.processed),
+        }
+
+    def has_stargazer(self, login: str) -> bool:
+        return login in self._user_ids
+
+    def is_processed(self, login: str) -> bool:
+        return self._user_ids[login] in self.processed
+
+    def add_stargazers(self, logins: Iterable[str]) -> None:
+        """
+        Add new stargazers to the repository, their starred repositories still have to be added.
+        """
+        exact = not self.approximate
+        for login in logins:
+            if login not in self._user_ids:
+                self._user_ids[login] = len(self._logins)
+                self._logins.append(login)
+        if exact:
+            self.population = len(self._logins)
+
+    def remove_stargazers(self, logins: Iterable[str]) -> None:
+        """
+        Remove stargazers who unstarred the repository, along with their contribution to the co-star counts.
+
+        User IDs are renumbered, so this is linear in the size of the index.
+        """
+        removed = {self._user_ids[login] for login in logins if login in self._user_ids}
+        if not removed:
+            return
+        exact = not self.approximate
+        renumbered = {}
+        for user_id, login in enumerate(self._logins):
+            if user_id not in removed:
+                renumbered[user_id] = len(renumbered)
+        self._logins = [login for user_id, login in enumerate(self._logins) if user_id not in removed]
+        self._user_ids = {login: user_id for user_id, login in enumerate(self._logins)}
+        self._repo_users = [array("I", (renumbered[user_id] for user_id in users if user_id not in removed))
+                            for users in self._repo_users]
+        self.processed = {renumbered[user_id] for user_id in self.processed if user_id not in removed}
+        if exact:
+            self.population = len(self._logins)
+
+    def add_starred(self, login: str, starred_repos: Iterable[StarredRepo]) -> None:
+        """
+        Add the starred repositories of a stargazer to the index.
+
+        Args:
+            login (str): The login of the stargazer, it must be one of the stargazers of the repository.
+            starred_repos (Iterable[StarredRepo]): The repositories starred by the stargazer.
+        """
+        user_id = self._user_ids[login]
+        if user_id in self.processed:
+            return
+        self.processed.add(user_id)
+
+        for full_name, stargazers_count in starred_repos:
+            if full_name == self.repository:  # Avoid the same repository
+                continue
+            repo_id = self._repo_ids.get(full_name)
+            if repo_id is None:
+                repo_id = len(self._repo_names)
+                self._repo_ids[full_name] = repo_id
+                self._repo_names.append(full_name)
+                self._repo_users.append(array("I"))
+                self._repo_stars.append(stargazers_count)
+            self._repo_users[repo_id].append(user_id)
+            self._repo_stars[repo_id] = max(self._repo_stars[repo_id], stargazers_count)
+
+    def score(self, repo_id: int, metric: Metric = "overlap") -> float:
+        """
+        Score a candidate repository.
+
+        The overlap is the number of shared stargazers. The Jaccard similarity divides it by the size of the union
+        of both sets of stargazers, the number of stargazers of the candidate being known from the starred lists.
+        When the stargazers are a sample, the number of shared stargazers is scaled to the population.
+
+        Args:
+            repo_id (int): The ID of the candidate repository.
+            metric (Metric): "overlap" or "jaccard".
+
+        Returns:
+            float: The score of the candidate.
+        """
+        shared = len(self._repo_users[repo_id])
+        if self.approximate:
+            shared *= self.population / self.stargazers_count
+        if metric == "overlap":
+            return shared
+        union = self.population + max(self._repo_stars[repo_id], shared) - shared
+        return shared / union if union else 0.0
+
+    def estimate(self, shared: int) -> Tuple[float, Tuple[float, float]]:
+        """
+        Estimate the number of stargazers of the population shared with a neighbour, from the number shared with
+        the sample.
+
+        The confidence interval is a Wilson score interval with a finite population correction, it is exact (of width
+        zero) when the sample is the whole population.
+
+        Args:
+            shared (int): The number of stargazers of the sample shared with the neighbour.
+
+        Returns:
+            Tuple[float, Tuple[float, float]]: The estimate and its 95% confidence interval.
+        """
+        n, population, z = self.stargazers_count, self.population, CONFIDENCE_Z
+        proportion = shared / n
+        correction = (population - n) / (population - 1) if population > 1 else 0
+        denominator = 1 + z ** 2 / n
+        center = (proportion + z ** 2 / (2 * n)) / denominator
+        half_width = z / denominator * math.sqrt(proportion * (1 - proportion) / n + z ** 2 / (4 * n ** 2))
+        half_width *= math.sqrt(correction)
+        if correction == 0:
+            center = proportion
+        low = max(center - half_width, shared / population)
+        high = min(center + half_width, (population - n + shared) / population)
+        return proportion * population, (round(low * population, 1), round(high * population, 1))
+
+    def top_k(self, limit: int, min_shared: int = 1, metric: Metric = "overlap") -> List[Dict]:
+        """
+        Rank the neighbours of the repository.
+
+        Args:
+            limit (int): The maximum number of neighbours to return.
+            min_shared (int): The minimum number of shared stargazers of a neighbour.
+            metric (Metric): The score used to rank the neighbours, "overlap" or "jaccard".
+
+        Returns:
+            List[Dict]: The neighbours, best first, with their shared stargazers and score.
+        """
+        candidates = (repo_id for repo_id, users in enumerate(self._repo_users) if len(users) >= min_shared)
+        # Ties are broken by name so results are stable
+        best = heapq.nsmallest(limit, candidates,
+                               key=lambda repo_id: (-self.score(repo_id, metric), self._repo_names[repo_id]))
+        return [self._neighbour(repo_id, metric) for repo_id in best]
+
+    def _neighbour(self, repo_id: int, metric: Metric) -> Dict:
+        users = self._repo_users[repo_id]
+        neighbour = {
+            "repo": self._repo_names[repo_id],
+            "stargazers": [self._logins[user_id] for user_id in users],
+            "shared": len(users),
+            "score": self.score(repo_id, metric),
+        }
+        if self.approximate:
+            estimated_shared, confidence_interval = self.estimate(len(users))
+            neighbour["estimatedShared"] = round(estimated_shared, 1)
+            neighbour["confidenceInterval"] = confidence_interval
+        return neighbour
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Hashable, List, TypeVar
+
+from src.utils.metrics import CounterCollector, GaugeCollector
+
+T = TypeVar("T")
+
+logger = logging.getLogger('uvicorn.error')
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: while a call is in flight, callers with the same key await its result
+    instead of starting their own.
+
+    The call runs in its own task, so a caller giving up doesn't cancel it for the others. Exceptions are shared like
+    results. Nothing is kept once the call is done, this isn't a cache.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.coalesced = 0
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        _groups.append(self)
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run `func`, or wait for the call in flight with the same key.
+
+        Args:
+            key (Hashable): The key identifying identical calls.
+            func (Callable[[], Awaitable[T]]): The call to make.
+
+        Returns:
+            T: The result of the call.
+        """
+        return await asyncio.shield(self.join(key, func))
+
+    def join(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> asyncio.Future:
+        """
+        Like `do`, but return the call in flight without waiting for it, so a caller can tell which calls it leads.
+        Callers cancelling the returned future cancel the call for everyone, they should wait for it with `shield`.
+
+        Args:
+            key (Hashable): The key identifying identical calls.
+            func (Callable[[], Awaitable[T]]): The call to make, only called when no call is in flight.
+
+        Returns:
+            asyncio.Future: The call in flight.
+        """
+        self.calls += 1
+        task = self._in_flight.get(key)
+        # Tasks are bound to an event loop, a task of another loop can't be awaited (this happens in tests)
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            self.coalesced += 1
+            logger.debug(f"Coalesced {self.name} call for {key}")
+        else:
+            task = asyncio.ensure_future(func())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._forget(key, task))
+        return task
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+    def get_stats(self) -> Dict:
+        return {"name": self.name, "calls": self.calls, "coalesced": self.coalesced, "inFlight": self.in_flight}
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+
+
+_groups: List[SingleFlight] = []
+
+
+def get_singleflight_stats() -> List[Dict]:
+    """
+    Return the number of calls and of coalesced calls of every single-flight group.
+    """
+    return [group.get_stats() for group in _groups]
+
+
+CounterCollector("singleflight_calls_total", "Calls made through a single-flight group",
+                 lambda: [({"group": stats["name"]}, stats["calls"]) for stats in get_singleflight_stats()], ("group",))
+CounterCollector("singleflight_coalesced_total", "Calls that waited for an identical call in flight",
+                 lambda: [({"group": stats["name"]}, stats["coalesced"]) for stats in get_singleflight_stats()],
+                 ("group",))
+GaugeCollector("singleflight_in_flight", "Calls in flight",
+               lambda: [({"group": stats["name"]}, stats["inFlight"]) for stats in get_singleflight_stats()],
+               ("group",))
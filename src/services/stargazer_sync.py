@@ -0,0 +1,154 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from src.services import github_async
+from src.services.github_async import Stargazer
+from src.utils import sqlite
+
+load_dotenv()
+
+# Database storing the stargazers of the repositories and their neighbour aggregates, empty to disable incremental
+# refreshes
+STARGAZERS_DB = os.getenv("STARGAZERS_DB", "")
+# Age after which neighbour aggregates are recomputed from scratch, as the starred lists they were built from drift
+NEIGHBOURS_AGGREGATES_TTL = int(os.getenv("NEIGHBOURS_AGGREGATES_TTL", 86400))  # in seconds
+
+logger = logging.getLogger('uvicorn.error')
+
+
+@dataclass
+class StargazerDelta:
+    """
+    The stargazers of a repository after a refresh, and how they changed since the previous one.
+
+    Attributes:
+        stargazers (List[str]): Every stargazer, oldest star first.
+        added (List[str]): The stargazers who starred the repository since the previous refresh.
+        removed (List[str]): The stargazers who unstarred the repository since the previous refresh.
+        incremental (bool): True if only the new stars were fetched.
+    """
+    stargazers: List[str]
+    added: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    incremental: bool = False
+
+
+class StargazerStore:
+    """
+    SQLite storage of the stargazers of repositories, with the date of the latest star as watermark, and of the
+    state of their neighbour scorers.
+
+    Lists and states are stored compressed, like the checkpoints of the jobs.
+    """
+
+    def __init__(self, db_path: str):
+        self._db = sqlite.connect(db_path)
+        self._lock = threading.Lock()
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS stargazers (repository TEXT PRIMARY KEY, watermark TEXT, logins BLOB,"
+            " synced_at REAL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS neighbour_aggregates (repository TEXT PRIMARY KEY, state BLOB,"
+            " computed_at REAL)"
+        )
+        self._db.commit()
+
+    def get_stargazers(self, repository: str) -> Optional[Tuple[List[str], Optional[str]]]:
+        with self._lock:
+            row = self._db.execute("SELECT logins, watermark FROM stargazers WHERE repository = ?",
+                                   (repository,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(zlib.decompress(row[0])), row[1]
+
+    def set_stargazers(self, repository: str, logins: List[str], watermark: Optional[str]) -> None:
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO stargazers VALUES (?, ?, ?, ?)",
+                             (repository, watermark, zlib.compress(json.dumps(logins).encode()), time.time()))
+            self._db.commit()
+
+    def get_aggregates(self, repository: str, max_age: float = NEIGHBOURS_AGGREGATES_TTL) -> Optional[Dict]:
+        """
+        Return the state of the neighbour scorer of a repository, if it was computed less than `max_age` ago.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT state, computed_at FROM neighbour_aggregates WHERE repository = ?",
+                                   (repository,)).fetchone()
+        if row is None or time.time() - row[1] >= max_age:
+            return None
+        return json.loads(zlib.decompress(row[0]))
+
+    def set_aggregates(self, repository: str, state: Dict, computed_at: Optional[float] = None) -> None:
+        """
+        Store the state of the neighbour scorer of a repository, `computed_at` being when it was built from scratch.
+        """
+        with self._lock:
+            if computed_at is None:
+                row = self._db.execute("SELECT computed_at FROM neighbour_aggregates WHERE repository = ?",
+                                       (repository,)).fetchone()
+                computed_at = row[0] if row else time.time()
+            self._db.execute("INSERT OR REPLACE INTO neighbour_aggregates VALUES (?, ?, ?)",
+                             (repository, zlib.compress(json.dumps(state).encode()), computed_at))
+            self._db.commit()
+
+
+async def sync_stargazers(owner: str, repo: str, store: StargazerStore) -> StargazerDelta:
+    """
+    Refresh the stored stargazers of a repository.
+
+    When the repository was already synced, only the stars newer than the watermark are fetched. Unstars are detected
+    by comparing the number of stargazers of the repository with the number we know of, the whole list is then
+    fetched again and compared with the stored one. An unstar compensated by a new star goes unnoticed until the
+    next full refresh. Stargazers beyond the 400 pages GitHub paginates can't be fetched, so the lists of such
+    repositories never match and are always fetched fully.
+
+    Args:
+        owner (str): The owner of the repository.
+        repo (str): The name of the repository.
+        store (StargazerStore): The store of the stargazers.
+
+    Returns:
+        StargazerDelta: The stargazers and their changes.
+    """
+    repository = f"{owner}/{repo}"
+    # The store is a SQLite database, possibly shared by the workers, it is read and written off the event loop
+    stored = await asyncio.to_thread(store.get_stargazers, repository)
+    if stored is not None and stored[1] is not None:
+        logins, watermark = stored
+        stargazers_count = (await github_async.get_repository(owner, repo))["stargazers_count"]
+        known = set(logins)
+        newer = await github_async.get_stargazers_since(owner, repo, watermark, stargazers_count)
+        added = list(dict.fromkeys(stargazer.login for stargazer in newer if stargazer.login not in known))
+        if len(logins) + len(added) == stargazers_count:
+            logins = logins + added
+            await asyncio.to_thread(store.set_stargazers, repository, logins, _get_watermark(newer) or watermark)
+            logger.debug(f"Stargazers of {repository} synced incrementally: {len(added)} new")
+            return StargazerDelta(logins, added=added, incremental=True)
+        logger.info(f"Stargazers of {repository} don't add up, refreshing the whole list")
+
+    stargazers = await github_async.get_stargazers(owner, repo)
+    logins = list(dict.fromkeys(stargazer.login for stargazer in stargazers))
+    await asyncio.to_thread(store.set_stargazers, repository, logins, _get_watermark(stargazers))
+    if stored is None:
+        return StargazerDelta(logins, added=logins)
+    current, previous = set(logins), set(stored[0])
+    return StargazerDelta(logins, added=[login for login in logins if login not in previous],
+                          removed=[login for login in stored[0] if login not in current])
+
+
+def _get_watermark(stargazers: List[Stargazer]) -> Optional[str]:
+    dates = [stargazer.starred_at for stargazer in stargazers if stargazer.starred_at]
+    return max(dates) if dates else None
+
+
+stargazer_store: Optional[StargazerStore] = StargazerStore(STARGAZERS_DB) if STARGAZERS_DB else None
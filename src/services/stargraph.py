@@ -0,0 +1,355 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from src.services.github_async import StarredRepo
+from src.services.workers import ProcessLock
+
+load_dotenv()
+
+# Directory of the star graph store, empty to disable it
+STAR_GRAPH_DIR = os.getenv("STAR_GRAPH_DIR", "")
+# Number of edges appended since the last compaction that triggers a new one
+STAR_GRAPH_COMPACT_EDGES = int(os.getenv("STAR_GRAPH_COMPACT_EDGES", 1_000_000))
+# Age after which a stored starred list is fetched from GitHub again
+STAR_GRAPH_TTL = int(os.getenv("STAR_GRAPH_TTL", 86400))  # in seconds
+
+USERS_FILE = "users.tsv"
+REPOS_FILE = "repos.tsv"
+EDGES_FILE = "edges.bin"
+META_FILE = "meta.json"
+CSR_ARRAYS = ("user_offsets", "user_repos", "repo_offsets", "repo_users")
+
+logger = logging.getLogger('uvicorn.error')
+
+
+class StarGraph:
+    """
+    Persistent store of the star graph, the edges between users and the repositories they starred.
+
+    Logins and repository names are dictionary-encoded into integer IDs, their files are append-only, the first line
+    of a name giving its ID and the last one its latest values (when the starred list of a user was fetched, the
+    number of stargazers of a repository). Edges are appended to a log of (user ID, repository ID) pairs.
+
+    Compaction turns the log into CSR adjacency arrays in both directions, users to the repositories they starred and
+    repositories to their stargazers. They are saved as .npy files and memory-mapped, so every process reading the
+    store shares the same pages. Edges appended since the last compaction are also kept in memory, by user and by
+    repository. Processes writing to a store take a lock on it and catch up with the other writers first, so names
+    keep a single ID. Readers see what was appended once they `refresh` the store.
+    """
+
+    def __init__(self, directory: str, compact_edges: int = STAR_GRAPH_COMPACT_EDGES):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.compact_edges = compact_edges
+        self._lock = threading.RLock()
+        self._writer_lock = ProcessLock("writer", directory)
+
+        self._users: List[str] = []
+        self._user_ids: Dict[str, int] = {}
+        self.fetched_at: List[float] = []
+        self._repos: List[str] = []
+        self._repo_ids: Dict[str, int] = {}
+        self._repo_stars: List[int] = []
+        self.compacted_edges = 0
+        # Date of the latest star event ingested from GH Archive, None if no archive was ingested
+        self.archived_until: Optional[str] = None
+        # How far the files were read, in bytes for the dictionaries and in edges for the log
+        self._read_offsets = {USERS_FILE: 0, REPOS_FILE: 0}
+        self._read_edges = 0
+        self._load_csr()
+        self._reset_tail()
+        self.refresh()
+
+    @property
+    def users_count(self) -> int:
+        return len(self._users)
+
+    @property
+    def repos_count(self) -> int:
+        return len(self._repos)
+
+    @property
+    def edges_count(self) -> int:
+        return self.compacted_edges + self._tail_edges
+
+    def has_user(self, login: str) -> bool:
+        return login in self._user_ids
+
+    def is_fresh(self, login: str, ttl: float = STAR_GRAPH_TTL) -> bool:
+        """
+        Tell if the stored starred list of a user was fetched whole less than `ttl` seconds ago. Lists only known from
+        GH Archive events hold the stars of the archives only, they are never fresh.
+        """
+        user_id = self._user_ids.get(login)
+        return user_id is not None and time.time() - self.fetched_at[user_id] < ttl
+
+    def refresh(self) -> None:
+        """
+        Read what the writing process appended to the store since it was opened or last refreshed, and map the CSR
+        arrays again if it compacted the store.
+        """
+        with self._lock:
+            # A compaction covers the edges at the start of the log, and the log references names appended before
+            # it, so the files are read in this order for the names of every edge to be known
+            if os.path.exists(self._path(META_FILE)):
+                with open(self._path(META_FILE)) as meta:
+                    meta = json.load(meta)
+                if meta["edges"] != self.compacted_edges:
+                    self.compacted_edges = meta["edges"]
+                    self._load_csr()
+                    # The arrays may come from a compaction newer than the metadata
+                    self.compacted_edges = int(self._user_offsets[-1])
+                    self._reset_tail()
+                    self._read_edges = self.compacted_edges
+                self.archived_until = meta.get("archived_until")
+            edges_count = os.path.getsize(self._path(EDGES_FILE)) // 8 if os.path.exists(self._path(EDGES_FILE)) else 0
+
+            for login, fetched_at in self._read_dictionary(USERS_FILE):
+                user_id = self._intern(login, self._users, self._user_ids)
+                _set_default(self.fetched_at, user_id, 0.0)
+                self.fetched_at[user_id] = float(fetched_at)
+            for full_name, stargazers_count in self._read_dictionary(REPOS_FILE):
+                repo_id = self._intern(full_name, self._repos, self._repo_ids)
+                _set_default(self._repo_stars, repo_id, 0)
+                self._repo_stars[repo_id] = int(stargazers_count)
+
+            if edges_count > self._read_edges:
+                edges = np.fromfile(self._path(EDGES_FILE), dtype="<u4", count=(edges_count - self._read_edges) * 2,
+                                    offset=self._read_edges * 8)
+                self._add_tail(edges.tolist())
+                self._read_edges = edges_count
+
+    def ingest(self, starred_lists: Iterable[Tuple[str, List[StarredRepo]]], fetched_at: Optional[float] = None) -> int:
+        """
+        Append the starred repositories of users to the store, edges already stored are skipped.
+
+        Args:
+            starred_lists (Iterable[Tuple[str, List[StarredRepo]]]): Logins with the repositories they starred.
+            fetched_at (float): When the lists were fetched, defaults to now.
+
+        Returns:
+            int: The number of edges appended.
+        """
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        with self._lock, self._writer_lock:
+            self.refresh()
+            user_lines, repo_lines, edges = [], [], []
+            for login, starred_repos in starred_lists:
+                user_id = self._intern(login, self._users, self._user_ids)
+                _set_default(self.fetched_at, user_id, 0.0)
+                self.fetched_at[user_id] = fetched_at
+                user_lines.append(f"{login}\t{fetched_at}\n")
+
+                known = set(self._starred_ids(user_id).tolist())
+                for full_name, stargazers_count in starred_repos:
+                    repo_id = self._intern(full_name, self._repos, self._repo_ids)
+                    _set_default(self._repo_stars, repo_id, -1)
+                    if self._repo_stars[repo_id] != stargazers_count:
+                        self._repo_stars[repo_id] = stargazers_count
+                        repo_lines.append(f"{full_name}\t{stargazers_count}\n")
+                    if repo_id not in known:
+                        known.add(repo_id)
+                        edges.extend((user_id, repo_id))
+
+            self._append(USERS_FILE, "".join(user_lines))
+            self._append(REPOS_FILE, "".join(repo_lines))
+            self._append_edges(edges)
+
+            if self._tail_edges >= self.compact_edges:
+                self._compact()
+            return len(edges) // 2
+
+    def ingest_events(self, events: Iterable[Tuple[str, str]], archived_until: Optional[str] = None) -> int:
+        """
+        Append star events to the store, edges already stored are skipped.
+
+        Unlike `ingest`, the events don't make up whole starred lists: the users aren't marked as fetched, and the
+        repositories they starred aren't counted, their number of stargazers stays unknown (0) until a starred list
+        containing them is ingested.
+
+        Args:
+            events (Iterable[Tuple[str, str]]): The logins of users with the full name of a repository they starred.
+            archived_until (str): The date of the latest event, the store answers for the stars up to this date.
+
+        Returns:
+            int: The number of edges appended.
+        """
+        with self._lock, self._writer_lock:
+            self.refresh()
+            starred_by_user: Dict[str, List[str]] = defaultdict(list)
+            for login, full_name in events:
+                starred_by_user[login].append(full_name)
+
+            user_lines, repo_lines, edges = [], [], []
+            for login, full_names in starred_by_user.items():
+                if login not in self._user_ids:
+                    user_lines.append(f"{login}\t0.0\n")
+                user_id = self._intern(login, self._users, self._user_ids)
+                _set_default(self.fetched_at, user_id, 0.0)
+
+                known = set(self._starred_ids(user_id).tolist())
+                for full_name in full_names:
+                    if full_name not in self._repo_ids:
+                        repo_lines.append(f"{full_name}\t0\n")
+                    repo_id = self._intern(full_name, self._repos, self._repo_ids)
+                    _set_default(self._repo_stars, repo_id, 0)
+                    if repo_id not in known:
+                        known.add(repo_id)
+                        edges.extend((user_id, repo_id))
+
+            self._append(USERS_FILE, "".join(user_lines))
+            self._append(REPOS_FILE, "".join(repo_lines))
+            self._append_edges(edges)
+            if archived_until is not None and (self.archived_until is None or archived_until > self.archived_until):
+                self.archived_until = archived_until
+                self._write_meta()
+
+            if self._tail_edges >= self.compact_edges:
+                self._compact()
+            return len(edges) // 2
+
+    def compact(self) -> None:
+        """
+        Rebuild the CSR arrays from every edge, and memory-map them.
+        """
+        with self._lock, self._writer_lock:
+            self.refresh()
+            self._compact()
+
+    def _compact(self) -> None:
+        with self._lock:
+            tail_users = [user_id for user_id, repo_ids in self._tail_starred.items() for _ in repo_ids]
+            tail_repos = [repo_id for repo_ids in self._tail_starred.values() for repo_id in repo_ids]
+            degrees = np.diff(self._user_offsets).astype(np.int64)
+            users = np.concatenate([
+                np.repeat(np.arange(len(degrees), dtype=np.uint32), degrees),
+                np.array(tail_users, dtype=np.uint32),
+            ])
+            repos = np.concatenate([np.asarray(self._user_repos), np.array(tail_repos, dtype=np.uint32)])
+            arrays = dict(zip(CSR_ARRAYS, (*_csr(users, repos, self.users_count),
+                                           *_csr(repos, users, self.repos_count))))
+            for name, values in arrays.items():
+                # The arrays are replaced, not overwritten, as they may be mapped by other processes
+                with open(self._path(f"{name}.npy.tmp"), "wb") as array_file:
+                    np.save(array_file, values)
+                os.replace(self._path(f"{name}.npy.tmp"), self._path(f"{name}.npy"))
+            self.compacted_edges = len(users)
+            self._write_meta()
+
+            self._load_csr()
+            self._reset_tail()
+            logger.info(f"Star graph compacted: {self.users_count} users, {self.repos_count} repositories, "
+                        f"{self.compacted_edges} edges")
+
+    def get_starred(self, login: str) -> List[StarredRepo]:
+        """
+        Return the repositories starred by a user, an empty list if the user isn't stored.
+        """
+        with self._lock:
+            user_id = self._user_ids.get(login)
+            if user_id is None:
+                return []
+            return [StarredRepo(self._repos[repo_id], self._repo_stars[repo_id])
+                    for repo_id in self._starred_ids(user_id).tolist()]
+
+    def get_stargazers(self, repository: str) -> List[str]:
+        """
+        Return the stored stargazers of a repository, only users whose starred list was ingested are known.
+        """
+        with self._lock:
+            repo_id = self._repo_ids.get(repository)
+            if repo_id is None:
+                return []
+            return [self._users[user_id] for user_id in self._stargazer_ids(repo_id).tolist()]
+
+    def _starred_ids(self, user_id: int) -> np.ndarray:
+        compacted = self._user_repos[self._user_offsets[user_id]:self._user_offsets[user_id + 1]] \
+            if user_id < len(self._user_offsets) - 1 else np.empty(0, dtype=np.uint32)
+        return np.concatenate([compacted, np.array(self._tail_starred.get(user_id, []), dtype=np.uint32)])
+
+    def _stargazer_ids(self, repo_id: int) -> np.ndarray:
+        compacted = self._repo_users[self._repo_offsets[repo_id]:self._repo_offsets[repo_id + 1]] \
+            if repo_id < len(self._repo_offsets) - 1 else np.empty(0, dtype=np.uint32)
+        tail = np.array(self._tail_stargazers.get(repo_id, []), dtype=np.uint32)
+        return np.unique(np.concatenate([compacted, tail]))
+
+    def _reset_tail(self) -> None:
+        self._tail_starred: Dict[int, List[int]] = defaultdict(list)
+        self._tail_stargazers: Dict[int, List[int]] = defaultdict(list)
+        self._tail_edges = 0
+
+    def _add_tail(self, edges: List[int]) -> None:
+        for user_id, repo_id in zip(edges[0::2], edges[1::2]):
+            self._tail_starred[user_id].append(repo_id)
+            self._tail_stargazers[repo_id].append(user_id)
+        self._tail_edges += len(edges) // 2
+
+    def _load_csr(self) -> None:
+        if self.compacted_edges:
+            arrays = [np.load(self._path(f"{name}.npy"), mmap_mode="r") for name in CSR_ARRAYS]
+        else:
+            arrays = [np.zeros(1, dtype=np.uint64), np.empty(0, dtype=np.uint32)] * 2
+        self._user_offsets, self._user_repos, self._repo_offsets, self._repo_users = arrays
+
+    def _write_meta(self) -> None:
+        with open(self._path(f"{META_FILE}.tmp"), "w") as meta:
+            json.dump({"edges": self.compacted_edges, "archived_until": self.archived_until}, meta)
+        os.replace(self._path(f"{META_FILE}.tmp"), self._path(META_FILE))
+
+    def _read_dictionary(self, file_name: str) -> List[List[str]]:
+        # Lines appended since the last read, a line being written is read once complete
+        if not os.path.exists(self._path(file_name)):
+            return []
+        with open(self._path(file_name), "rb") as dictionary:
+            dictionary.seek(self._read_offsets[file_name])
+            content = dictionary.read()
+        content = content[:content.rfind(b"\n") + 1]
+        self._read_offsets[file_name] += len(content)
+        return [line.rsplit("\t", 1) for line in content.decode("utf-8").split("\n") if line.strip()]
+
+    def _append(self, file_name: str, content: str) -> None:
+        if content:
+            with open(self._path(file_name), "ab") as dictionary:
+                dictionary.write(content.encode("utf-8"))
+                self._read_offsets[file_name] = dictionary.tell()
+
+    def _append_edges(self, edges: List[int]) -> None:
+        with open(self._path(EDGES_FILE), "ab") as edges_file:
+            edges_file.write(np.array(edges, dtype="<u4").tobytes())
+            self._read_edges = edges_file.tell() // 8
+        self._add_tail(edges)
+
+    def _path(self, file_name: str) -> str:
+        return os.path.join(self.directory, file_name)
+
+    @staticmethod
+    def _intern(name: str, names: List[str], ids: Dict[str, int]) -> int:
+        name_id = ids.get(name)
+        if name_id is None:
+            name_id = len(names)
+            ids[name] = name_id
+            names.append(name)
+        return name_id
+
+
+def _set_default(values: list, index: int, default) -> None:
+    if index == len(values):
+        values.append(default)
+
+
+def _csr(sources: np.ndarray, targets: np.ndarray, size: int) -> Tuple[np.ndarray, np.ndarray]:
+    order = np.argsort(sources, kind="stable")
+    offsets = np.zeros(size + 1, dtype=np.uint64)
+    np.cumsum(np.bincount(sources, minlength=size), out=offsets[1:])
+    return offsets, targets[order].astype(np.uint32)
+
+
+star_graph: Optional[StarGraph] = StarGraph(STAR_GRAPH_DIR) if STAR_GRAPH_DIR else None
@@ -1,52 +1,666 @@
+import asyncio
+import json
 import logging
-from collections import defaultdict
-from typing import List, Dict
+import math
+import os
+import random
+import time
+from dataclasses import asdict, dataclass
+from typing import AsyncIterator, List, Dict, Literal, Optional, Tuple
 
-from github import Repository
-from github.NamedUser import NamedUser
-from github.PaginatedList import PaginatedList
+from dotenv import load_dotenv
 
-from src.services.github import get_stargazers, get_starred_repos_for_user
+from src.services import github_async, github_graphql
+from src.services.cache import CachedResult, ResultCache, CACHE_REQUESTS
+from src.services.github import GitHubAPIException
+from src.services.github_async import StarredRepo, StarredFetch, PER_PAGE, GITHUB_MAX_STARGAZER_PAGES
+from src.services.minhash import minhash_index
+from src.services.ratelimit import background_priority
+from src.services.stargraph import star_graph
+from src.services.stargazer_sync import stargazer_store, sync_stargazers
+from src.services.scoring import NeighbourScorer, Metric
+from src.services.singleflight import SingleFlight
+from src.services.workers import is_leader, stampede_lock
+from src.utils.metrics import Histogram
+from src.utils.tracing import span
+
+load_dotenv()
+
+# Backend used to fetch stargazers and starred repositories : "rest" or "graphql"
+GITHUB_BACKEND = os.getenv("GITHUB_BACKEND", "rest")
+# Number of neighbours returned when the client doesn't specify a limit
+NEIGHBOURS_DEFAULT_LIMIT = int(os.getenv("NEIGHBOURS_DEFAULT_LIMIT", 100))
+# Maximum number of progress frames sent by the streaming mode
+NEIGHBOURS_PROGRESS_FRAMES = int(os.getenv("NEIGHBOURS_PROGRESS_FRAMES", 20))
+# Number of stargazers sampled by the approximate mode when the client doesn't specify it
+NEIGHBOURS_SAMPLE_SIZE = int(os.getenv("NEIGHBOURS_SAMPLE_SIZE", 1000))
+# Number of shared stargazers listed per neighbour when the client asks for a sample of them
+NEIGHBOURS_STARGAZERS_SAMPLE = int(os.getenv("NEIGHBOURS_STARGAZERS_SAMPLE", 10))
+# Maximum number of repositories of a batch of neighbours computations
+NEIGHBOURS_BATCH_MAX_REPOSITORIES = int(os.getenv("NEIGHBOURS_BATCH_MAX_REPOSITORIES", 50))
+# Neighbour results cache, the database is optional and allows the worker processes to share results
+NEIGHBOURS_CACHE_MAX_ENTRIES = int(os.getenv("NEIGHBOURS_CACHE_MAX_ENTRIES", 1000))
+NEIGHBOURS_CACHE_TTL = int(os.getenv("NEIGHBOURS_CACHE_TTL", 300))  # in seconds, 0 to disable the cache
+NEIGHBOURS_CACHE_DB = os.getenv("NEIGHBOURS_CACHE_DB") or None
+# Time an expired result is still served while it is recomputed in the background
+NEIGHBOURS_CACHE_MAX_STALE = int(os.getenv("NEIGHBOURS_CACHE_MAX_STALE", 3600))  # in seconds
+# TTL of the results without neighbours
+NEIGHBOURS_NEGATIVE_CACHE_TTL = int(os.getenv("NEIGHBOURS_NEGATIVE_CACHE_TTL", 60))  # in seconds
 
 logger = logging.getLogger('uvicorn.error')
 
+# Phases of a neighbours computation: "stargazers" (fetching them), "fanout" (waiting for the starred lists),
+# "aggregation" (counting and ranking), "storage" (persisting the graph and aggregates), "serialization" (in the route)
+NEIGHBOURS_PHASE_DURATION = Histogram("neighbours_phase_duration_seconds",
+                                      "Duration of the phases of the neighbours computations", ("phase",))
+
+neighbours_flight = SingleFlight("neighbours")
+neighbours_cache = ResultCache(NEIGHBOURS_CACHE_MAX_ENTRIES, NEIGHBOURS_CACHE_TTL, NEIGHBOURS_CACHE_DB,
+                               max_stale=NEIGHBOURS_CACHE_MAX_STALE)
 
-def get_repository_neighbours(owner: str, repo: str) -> List[Dict]:
+
+@dataclass(frozen=True)
+class Sampling:
     """
-    Find the neighbouring repositories based on shared stargazers.
+    Options of the approximate mode.
+
+    Attributes:
+        size (int): The number of stargazers sampled.
+        strategy (str): "uniform" samples stargazers from random pages, "recent" takes the latest stargazers.
+        max_starred_per_user (int): The maximum number of starred repositories read per stargazer, the most recently
+            starred first. None to read them all.
+    """
+    size: int = NEIGHBOURS_SAMPLE_SIZE
+    strategy: Literal["uniform", "recent"] = "uniform"
+    max_starred_per_user: Optional[int] = None
+
+
+async def get_stargazers(owner: str, repo: str) -> List[str]:
+    """
+    Fetch the logins of the stargazers of a repository using the configured backend, and index them in the MinHash
+    index.
+
+    Args:
+        owner (str): The owner of the repository.
+        repo (str): The name of the repository.
+
+    Returns:
+        List[str]: The logins of the stargazers.
+    """
+    if GITHUB_BACKEND == "graphql":
+        stargazers = await github_graphql.get_stargazer_logins(owner, repo)
+    else:
+        stargazers = await github_async.get_stargazer_logins(owner, repo)
+    if stargazers:
+        minhash_index.update(f"{owner}/{repo}", stargazers)
+    return stargazers
+
+
+async def sample_stargazers(owner: str, repo: str, sampling: Sampling) -> Tuple[List[str], int]:
+    """
+    Sample the stargazers of a repository, only the pages of stargazers needed are fetched.
+
+    The uniform strategy fetches twice as many random pages as needed then samples stargazers among them, so the
+    sample doesn't only contain stargazers who starred at the same time. The recent strategy fetches the last pages,
+    stargazers being ordered from the oldest star.
+
+    Args:
+        owner (str): The owner of the repository.
+        repo (str): The name of the repository.
+        sampling (Sampling): The options of the sampling.
+
+    Returns:
+        Tuple[List[str], int]: The logins of the sampled stargazers and the total number of stargazers. Every
+        stargazer is returned if there are fewer than the size of the sample.
+    """
+    population: int = (await github_async.get_repository(owner, repo))["stargazers_count"]
+    if population <= sampling.size:
+        return await get_stargazers(owner, repo), population
+
+    # Stargazers beyond the pagination limit can't be reached through the REST API
+    pages = min(math.ceil(population / PER_PAGE), GITHUB_MAX_STARGAZER_PAGES)
+    needed_pages = math.ceil(sampling.size / PER_PAGE)
+    if sampling.strategy == "recent":
+        page_numbers = list(range(max(pages - needed_pages + 1, 1), pages + 1))
+    else:
+        page_numbers = sorted(random.sample(range(1, pages + 1), min(needed_pages * 2, pages)))
+
+    fetched = await asyncio.gather(
+        *(github_async.get_stargazer_logins_page(owner, repo, page) for page in page_numbers)
+    )
+    logins = list(dict.fromkeys(login for page in fetched for login in page))
+    if sampling.strategy == "recent":
+        return logins[-sampling.size:], population
+    return random.sample(logins, min(sampling.size, len(logins))), population
+
+
+async def _get_synced_scorer(owner: str, repo: str) -> NeighbourScorer:
+    """
+    Refresh the stargazers of a repository incrementally and apply the changes to its stored aggregates.
+
+    Args:
+        owner (str): The owner of the repository.
+        repo (str): The name of the repository.
+
+    Returns:
+        NeighbourScorer: The scorer, where only the new stargazers still have to be processed.
+    """
+    repository = f"{owner}/{repo}"
+    delta = await sync_stargazers(owner, repo, stargazer_store)
+    if delta.added:
+        minhash_index.update(repository, delta.added, count=len(delta.stargazers))
+
+    state = await asyncio.to_thread(stargazer_store.get_aggregates, repository)
+    if state is None:
+        return NeighbourScorer(repository, delta.stargazers)
+    scorer = NeighbourScorer.from_state(state)
+    # The aggregates are compared with the stargazers rather than the delta, in case a computation was interrupted
+    current = set(delta.stargazers)
+    removed = [login for login in scorer.logins if login not in current]
+    scorer.remove_stargazers(removed)
+    added = [login for login in delta.stargazers if not scorer.has_stargazer(login)]
+    scorer.add_stargazers(added)
+    logger.debug(f"Aggregates of {repository} updated: {len(added)} stargazers added, {len(removed)} removed")
+    return scorer
+
+
+async def _get_archived_stargazers(owner: str, repo: str) -> Optional[List[str]]:
+    """
+    Read the stargazers of a repository from the star graph, completed with those who starred it after the latest
+    star event ingested from GH Archive.
+
+    Archives have no unstar events, and the store may only know the stargazers of a repository from the starred
+    lists it holds, so the stargazers are only used if their number is the one GitHub reports.
 
     Args:
         owner (str): The owner of the repository.
         repo (str): The name of the repository.
 
     Returns:
-        List[Dict]: A list of repositories with shared stargazers.
+        Optional[List[str]]: The logins of the stargazers, None if the repository isn't in the star graph or the star
+        graph doesn't know all its stargazers.
+    """
+    stored = await asyncio.to_thread(star_graph.get_stargazers, f"{owner}/{repo}")
+    if not stored:
+        return None
+    stargazers_count = (await github_async.get_repository(owner, repo))["stargazers_count"]
+    newer = await github_async.get_stargazers_since(owner, repo, star_graph.archived_until, stargazers_count)
+    stargazers = list(dict.fromkeys(stored + [stargazer.login for stargazer in newer]))
+    if len(stargazers) != stargazers_count:
+        logger.info(f"The star graph knows {len(stargazers)} stargazers of {owner}/{repo} out of {stargazers_count}, "
+                    f"fetching them from GitHub")
+        return None
+    logger.debug(f"Stargazers of {owner}/{repo} read from the star graph: {len(newer)} newer than the archives")
+    minhash_index.update(f"{owner}/{repo}", stargazers)
+    return stargazers
+
+
+def _get_stored_starred_repos(stargazers: List[str]) -> List[Tuple[str, List[StarredRepo]]]:
+    # Only the lists fetched whole recently, the others are fetched again. The other workers may have stored some
+    star_graph.refresh()
+    return [(stargazer, star_graph.get_starred(stargazer)) for stargazer in stargazers
+            if star_graph.is_fresh(stargazer)]
+
+
+def _store_starred_repos(fetched: List[Tuple[str, List[StarredRepo]]]) -> None:
+    # The lists read from the star graph are already there
+    star_graph.ingest([(stargazer, starred_repos) for stargazer, starred_repos in fetched
+                       if not star_graph.is_fresh(stargazer)])
+
+
+async def iter_starred_repos(stargazers: List[str], max_items: Optional[int] = None,
+                             treatments: Optional[Dict[str, List[str]]] = None
+                             ) -> AsyncIterator[Tuple[str, List[StarredRepo]]]:
+    """
+    Fetch the repositories starred by each stargazer using the configured backend.
+
+    Starred lists are yielded as soon as they arrive, in no particular order. When the star graph store is enabled,
+    whole lists fetched less than STAR_GRAPH_TTL seconds ago are read from it rather than from GitHub.
+
+    Args:
+        stargazers (List[str]): The logins of the stargazers.
+        max_items (int): The maximum number of repositories read per stargazer, the most recently starred first.
+        treatments (Dict[str, List[str]]): Filled with the logins of the stargazers whose lists weren't read whole,
+            by treatment ("capped", "sampled" or "deferred").
+
+    Yields:
+        Tuple[str, List[StarredRepo]]: The login of a stargazer and the repositories they starred.
+    """
+    treatments = treatments if treatments is not None else {}
+    if star_graph is not None and max_items is None:
+        stored = await asyncio.to_thread(_get_stored_starred_repos, stargazers)
+        for stargazer, starred_repos in stored:
+            yield stargazer, starred_repos
+        if stored:
+            read = {stargazer for stargazer, _ in stored}
+            stargazers = [stargazer for stargazer in stargazers if stargazer not in read]
+    if GITHUB_BACKEND == "graphql":
+        async for stargazer, fetched in github_graphql.iter_starred_repos(stargazers, max_items):
+            if fetched.treatment != "full":
+                treatments.setdefault(fetched.treatment, []).append(stargazer)
+            yield stargazer, fetched.repos
+        return
+
+    async def fetch(stargazer: str) -> Tuple[str, StarredFetch]:
+        return stargazer, await github_async.fetch_starred_repos(stargazer, max_items=max_items)
+
+    tasks = [asyncio.create_task(fetch(stargazer)) for stargazer in stargazers]
+    try:
+        for next_starred in asyncio.as_completed(tasks):
+            stargazer, fetched = await next_starred
+            if fetched.treatment != "full":
+                treatments.setdefault(fetched.treatment, []).append(stargazer)
+            yield stargazer, fetched.repos
+    finally:
+        # The consumer stopped early or failed, the remaining fetches are useless
+        for task in tasks:
+            task.cancel()
+
+
+async def iter_repository_neighbours(owner: str, repo: str, limit: int = NEIGHBOURS_DEFAULT_LIMIT,
+                                     min_shared: int = 1, metric: Metric = "overlap",
+                                     progress_frames: int = 0,
+                                     sampling: Optional[Sampling] = None) -> AsyncIterator[Dict]:
+    """
+    Find the neighbouring repositories based on shared stargazers, yielding frames as the computation proceeds.
+
+    The frames are, in order:
+        - {"type": "stargazers", "total": ..., "stargazersCount": ..., "mode": ...} once the stargazers to process
+          are known.
+        - {"type": "progress", "processed": ..., "total": ..., "neighbours": [...]} up to `progress_frames` times,
+          with the ranking of the stargazers processed so far.
+        - {"type": "result", "processed": ..., "total": ..., "mode": ..., "starredLists": {...},
+          "neighbours": [...]} with the final ranking.
+
+    The mode is "approximate" when only a sample of the stargazers was processed, "archive" when the star graph was
+    loaded with GH Archive events (see `src.services.gharchive`) and knows every stargazer of the repository, "exact"
+    otherwise. In the archive mode, the stargazers are read from the star graph, along with the starred lists fetched
+    whole less than STAR_GRAPH_TTL seconds ago, and only the stars newer than the archives and the other lists are
+    fetched. When the star graph store is enabled, whole starred lists are appended to it and read from it while
+    they are fresh. The starred lists of heavy starrers may not be read whole (see HEAVY_STARRER_STRATEGY):
+    "starredLists" maps how they were treated to the logins of these stargazers.
+
+    When the stargazer store is enabled, exact computations refresh the stargazers incrementally and start from the
+    stored aggregates of the previous computation: only the starred lists of the new stargazers are fetched and the
+    stargazers who left are removed from the counts.
+
+    Args:
+        owner (str): The owner of the repository.
+        repo (str): The name of the repository.
+        limit (int): The maximum number of neighbours to return.
+        min_shared (int): The minimum number of shared stargazers of a neighbour.
+        metric (Metric): The score used to rank the neighbours, "overlap" or "jaccard".
+        progress_frames (int): The maximum number of progress frames.
+        sampling (Sampling): The options of the approximate mode, None to process every stargazer.
+
+    Yields:
+        Dict: The frames.
     """
     # Step 1: Get stargazers for the given repository
-    stargazers: PaginatedList[NamedUser] = get_stargazers(owner, repo)
+    started = time.perf_counter()
+    incremental = sampling is None and stargazer_store is not None and GITHUB_BACKEND == "rest"
+    archived = None
+    if sampling is None and not incremental and GITHUB_BACKEND == "rest" and star_graph is not None:
+        # The store is written by the leader, or by the GH Archive ingestion, the other processes read what it
+        # appended or compacted since
+        await asyncio.to_thread(star_graph.refresh)
+        if star_graph.archived_until is not None:
+            archived = await _get_archived_stargazers(owner, repo)
+    if sampling is not None:
+        stargazers, population = await sample_stargazers(owner, repo, sampling)
+        scorer = NeighbourScorer(f"{owner}/{repo}", stargazers, population=population)
+    elif archived is not None:
+        stargazers = archived
+        population = len(stargazers)
+        scorer = NeighbourScorer(f"{owner}/{repo}", stargazers, population=population)
+    elif incremental:
+        scorer = await _get_synced_scorer(owner, repo)
+        stargazers, population = scorer.logins, scorer.stargazers_count
+    else:
+        stargazers = await get_stargazers(owner, repo)
+        population = len(stargazers)
+        scorer = NeighbourScorer(f"{owner}/{repo}", stargazers, population=population)
+    mode = "archive" if archived is not None else "approximate" if scorer.approximate else "exact"
+    total = scorer.stargazers_count
+    NEIGHBOURS_PHASE_DURATION.observe(time.perf_counter() - started, phase="stargazers")
+    yield {"type": "stargazers", "total": total, "stargazersCount": population, "mode": mode}
     if not stargazers:
         logger.warning(f"No stargazers found for {repo} by {owner}")
-        return []
-
-    # Step 2: Build a map of repositories to users who starred them
-    repo_to_users: Dict[str, set[str]] = defaultdict(set)
-
-    for stargazer in stargazers:
-        starred_repos: PaginatedList[Repository] = get_starred_repos_for_user(stargazer)
-
-        # Step 3: Add the stargazer to each repository they have starred
-        for starred_repo in starred_repos:
-            repo_to_users[starred_repo.full_name].add(stargazer.login)
-
-    # Step 4: Identify neighbours (repos with shared stargazers)
-    neighbours: List[Dict] = []
-    for neighbour_repo, users in repo_to_users.items():
-        if neighbour_repo != f"{owner}/{repo}":  # Avoid the same repository
-            shared_stargazers: set[str] = users.intersection([s.login for s in stargazers])
-            if shared_stargazers:
-                neighbours.append({
-                    "repo": neighbour_repo,
-                    "stargazers": list(shared_stargazers)
-                })
-
-    return neighbours
+        yield {"type": "result", "processed": 0, "total": 0, "mode": mode, "starredLists": {}, "neighbours": []}
+        return
+
+    # Step 2: Index the starred repositories of every stargazer as they arrive
+    interval = max(total // progress_frames, 1) if progress_frames else 0
+    processed = len(scorer.processed)
+    remaining = [stargazer for stargazer in stargazers if not scorer.is_processed(stargazer)]
+    max_starred = sampling.max_starred_per_user if sampling is not None else None
+    fetched: List[Tuple[str, List[StarredRepo]]] = []
+    treatments: Dict[str, List[str]] = {}
+    # The time spent aggregating and in the consumer of the progress frames isn't time spent waiting for GitHub
+    started, aggregation = time.perf_counter(), 0.0
+    async for stargazer, starred_repos in iter_starred_repos(remaining, max_items=max_starred, treatments=treatments):
+        aggregation_started = time.perf_counter()
+        scorer.add_starred(stargazer, starred_repos)
+        # The leader worker writes to the star graph, the others only read it
+        if star_graph is not None and max_starred is None and is_leader():
+            fetched.append((stargazer, starred_repos))
+        processed += 1
+        if interval and processed % interval == 0 and processed < total:
+            progress = {"type": "progress", "processed": processed, "total": total,
+                        "neighbours": scorer.top_k(limit, min_shared=min_shared, metric=metric)}
+            aggregation += time.perf_counter() - aggregation_started
+            yield progress
+            aggregation_started = time.perf_counter()
+        aggregation += time.perf_counter() - aggregation_started
+    NEIGHBOURS_PHASE_DURATION.observe(time.perf_counter() - started - aggregation, phase="fanout")
+
+    started = time.perf_counter()
+    # Only whole lists go to the star graph
+    partial = {stargazer for stargazers in treatments.values() for stargazer in stargazers}
+    fetched = [(stargazer, starred_repos) for stargazer, starred_repos in fetched if stargazer not in partial]
+    if fetched:
+        await asyncio.to_thread(_store_starred_repos, fetched)
+    if incremental and remaining:
+        await asyncio.to_thread(stargazer_store.set_aggregates, scorer.repository, scorer.to_state(),
+                                None if len(remaining) < total else time.time())
+    if fetched or (incremental and remaining):
+        NEIGHBOURS_PHASE_DURATION.observe(time.perf_counter() - started, phase="storage")
+
+    # Step 3: Rank the neighbours (repos with shared stargazers)
+    started = time.perf_counter()
+    neighbours = scorer.top_k(limit, min_shared=min_shared, metric=metric)
+    NEIGHBOURS_PHASE_DURATION.observe(aggregation + time.perf_counter() - started, phase="aggregation")
+    yield {"type": "result", "processed": processed, "total": total, "mode": mode, "starredLists": treatments,
+           "neighbours": neighbours}
+
+
+async def get_repository_neighbours_result(owner: str, repo: str, limit: int = NEIGHBOURS_DEFAULT_LIMIT,
+                                           min_shared: int = 1, metric: Metric = "overlap",
+                                           sampling: Optional[Sampling] = None) -> Dict:
+    """
+    Find the neighbouring repositories based on shared stargazers, along with how they were computed.
+
+    See `get_repository_neighbours_entry`.
+
+    Returns:
+        Dict: The result frame of `iter_repository_neighbours`, with the number of stargazers of the repository.
+    """
+    entry = await get_repository_neighbours_entry(owner, repo, limit=limit, min_shared=min_shared, metric=metric,
+                                                  sampling=sampling)
+    return entry.value
+
+
+async def get_repository_neighbours_entry(owner: str, repo: str, limit: int = NEIGHBOURS_DEFAULT_LIMIT,
+                                          min_shared: int = 1, metric: Metric = "overlap",
+                                          sampling: Optional[Sampling] = None) -> CachedResult:
+    """
+    Find the neighbouring repositories based on shared stargazers, as a cache entry carrying the ETag of the result.
+
+    Results are cached for NEIGHBOURS_CACHE_TTL seconds, or NEIGHBOURS_NEGATIVE_CACHE_TTL seconds when there are no
+    neighbours. Once expired, a result is still returned for NEIGHBOURS_CACHE_MAX_STALE seconds while it is
+    recomputed in the background. Concurrent identical computations share the one started first, so a trending
+    repository is computed once, and with a shared cache the worker processes take a lock so only one of them
+    computes it.
+
+    Args:
+        owner (str): The owner of the repository.
+        repo (str): The name of the repository.
+        limit (int): The maximum number of neighbours to return.
+        min_shared (int): The minimum number of shared stargazers of a neighbour.
+        metric (Metric): The score used to rank the neighbours, "overlap" or "jaccard".
+        sampling (Sampling): The options of the approximate mode, None to process every stargazer.
+
+    Returns:
+        CachedResult: The entry, its value being the result frame of `iter_repository_neighbours` with the number of
+        stargazers of the repository.
+    """
+    key = _result_key(owner, repo, limit, min_shared, metric, sampling)
+    return await neighbours_flight.do(key, lambda: _get_cached_repository_neighbours(key, owner, repo, limit,
+                                                                                     min_shared, metric, sampling))
+
+
+def peek_repository_neighbours_entry(owner: str, repo: str, limit: int = NEIGHBOURS_DEFAULT_LIMIT,
+                                     min_shared: int = 1, metric: Metric = "overlap",
+                                     sampling: Optional[Sampling] = None) -> Optional[CachedResult]:
+    """
+    Return the cached result `get_repository_neighbours_entry` would serve, fresh or stale, without computing it.
+
+    Returns:
+        CachedResult | None: The entry, None if the neighbours would have to be computed.
+    """
+    return neighbours_cache.lookup(_result_key(owner, repo, limit, min_shared, metric, sampling))
+
+
+async def refresh_repository_neighbours(owner: str, repo: str, limit: int = NEIGHBOURS_DEFAULT_LIMIT,
+                                        min_shared: int = 1, metric: Metric = "overlap",
+                                        min_ttl: float = math.inf) -> CachedResult:
+    """
+    Compute the neighbouring repositories and cache them, even if a result is already cached. Used to warm the cache
+    up (see `src.services.warmup`).
+
+    Args:
+        owner (str): The owner of the repository.
+        repo (str): The name of the repository.
+        limit (int): The maximum number of neighbours to return.
+        min_shared (int): The minimum number of shared stargazers of a neighbour.
+        metric (Metric): The score used to rank the neighbours, "overlap" or "jaccard".
+        min_ttl (float): A cached result still fresh for longer than this number of seconds is returned as it is,
+            by default the neighbours are always computed.
+
+    Returns:
+        CachedResult: The entry, as returned by `get_repository_neighbours_entry`.
+    """
+    key = _result_key(owner, repo, limit, min_shared, metric, None)
+    entry = neighbours_cache.lookup(key)
+    if entry is not None and entry.expires_at - time.time() > min_ttl:
+        return entry
+    return await neighbours_flight.do(key, lambda: _refresh_repository_neighbours(key, owner, repo, limit, min_shared,
+                                                                                  metric, None, min_ttl=min_ttl))
+
+
+def _result_key(owner: str, repo: str, limit: int, min_shared: int, metric: Metric,
+                sampling: Optional[Sampling]) -> str:
+    return json.dumps([owner.lower(), repo.lower(), limit, min_shared, metric, sampling and asdict(sampling)])
+
+
+def _cache_result(key: str, result: Dict) -> CachedResult:
+    # Repositories without neighbours are cached shortly, they may get stargazers soon
+    return neighbours_cache.set(key, result, ttl=None if result["neighbours"] else NEIGHBOURS_NEGATIVE_CACHE_TTL)
+
+
+async def _get_cached_repository_neighbours(key: str, owner: str, repo: str, limit: int, min_shared: int,
+                                            metric: Metric, sampling: Optional[Sampling]) -> CachedResult:
+    entry = neighbours_cache.lookup(key)
+    CACHE_REQUESTS.inc(cache="neighbours", result="miss" if entry is None else "hit" if entry.fresh else "stale")
+    if entry is None:
+        return await _refresh_repository_neighbours(key, owner, repo, limit, min_shared, metric, sampling)
+    if not entry.fresh:
+        _revalidate_repository_neighbours(key, owner, repo, limit, min_shared, metric, sampling)
+    return entry
+
+
+async def _refresh_repository_neighbours(key: str, owner: str, repo: str, limit: int, min_shared: int,
+                                         metric: Metric, sampling: Optional[Sampling],
+                                         min_ttl: float = 0) -> CachedResult:
+    if not neighbours_cache.shared:
+        return _cache_result(key, await _compute_repository_neighbours(owner, repo, limit, min_shared, metric,
+                                                                       sampling))
+
+    async with stampede_lock(key):
+        # Another worker may have computed it while we were waiting for the lock
+        entry = neighbours_cache.lookup(key)
+        if entry is not None and entry.expires_at - time.time() > min_ttl:
+            return entry
+        return _cache_result(key, await _compute_repository_neighbours(owner, repo, limit, min_shared, metric,
+                                                                       sampling))
+
+
+# Recomputations of stale results running in the background, by result key
+_revalidating: Dict[str, asyncio.Task] = {}
+
+
+def _revalidate_repository_neighbours(key: str, owner: str, repo: str, limit: int, min_shared: int, metric: Metric,
+                                      sampling: Optional[Sampling]) -> None:
+    """
+    Recompute a stale result in the background, with the background priority, unless it is already being recomputed.
+    """
+    task = _revalidating.get(key)
+    # Tasks of a closed event loop never finish (this happens in tests)
+    if task is not None and not task.done() and task.get_loop() is asyncio.get_running_loop():
+        return
+
+    async def revalidate() -> None:
+        try:
+            with background_priority():
+                await _refresh_repository_neighbours(key, owner, repo, limit, min_shared, metric, sampling)
+        except GitHubAPIException as e:
+            logger.warning(f"Revalidation of the neighbours of {owner}/{repo} failed: {e}")
+        finally:
+            if _revalidating.get(key) is asyncio.current_task():
+                del _revalidating[key]
+
+    _revalidating[key] = asyncio.create_task(revalidate())
+
+
+async def _compute_repository_neighbours(owner: str, repo: str, limit: int, min_shared: int, metric: Metric,
+                                         sampling: Optional[Sampling]) -> Dict:
+    stargazers_count = 0
+    with span("neighbours.compute", repository=f"{owner}/{repo}", approximate=sampling is not None):
+        async for frame in iter_repository_neighbours(owner, repo, limit=limit, min_shared=min_shared,
+                                                      metric=metric, sampling=sampling):
+            if frame["type"] == "stargazers":
+                stargazers_count = frame["stargazersCount"]
+            elif frame["type"] == "result":
+                return {**frame, "stargazersCount": stargazers_count}
+
+
+async def get_repository_neighbours(owner: str, repo: str, limit: int = NEIGHBOURS_DEFAULT_LIMIT,
+                                    min_shared: int = 1, metric: Metric = "overlap",
+                                    sampling: Optional[Sampling] = None) -> List[Dict]:
+    """
+    Find the neighbouring repositories based on shared stargazers.
+
+    The starred repositories of the stargazers are fetched concurrently, the concurrency being bounded by the
+    asynchronous GitHub client, and added to the scorer as they arrive.
+
+    Args:
+        owner (str): The owner of the repository.
+        repo (str): The name of the repository.
+        limit (int): The maximum number of neighbours to return.
+        min_shared (int): The minimum number of shared stargazers of a neighbour.
+        metric (Metric): The score used to rank the neighbours, "overlap" or "jaccard".
+        sampling (Sampling): The options of the approximate mode, None to process every stargazer.
+
+    Returns:
+        List[Dict]: The repositories with shared stargazers, best first.
+    """
+    result = await get_repository_neighbours_result(owner, repo, limit=limit, min_shared=min_shared, metric=metric,
+                                                    sampling=sampling)
+    return result["neighbours"]
+
+
+async def iter_batch_neighbours(repositories: List[str], limit: int = NEIGHBOURS_DEFAULT_LIMIT, min_shared: int = 1,
+                                metric: Metric = "overlap") -> AsyncIterator[Dict]:
+    """
+    Find the neighbours of several repositories at once, yielding the result of each repository as soon as the
+    starred lists of all its stargazers were read.
+
+    The stargazers of the repositories are unioned, so the starred list of a user who starred several of them is
+    fetched once, and added to the scorers of all these repositories in a single pass. Results are cached like those
+    of `get_repository_neighbours_result`: cached repositories are returned first and aren't computed again.
+
+    The frames are, in the order the repositories complete:
+        - {"type": "result", "repository": ..., "processed": ..., "total": ..., "mode": "exact",
+          "starredLists": {...}, "stargazersCount": ..., "neighbours": [...]} like `get_repository_neighbours_result`.
+        - {"type": "error", "repository": ..., "status": ..., "detail": ...} when the stargazers of a repository
+          couldn't be fetched.
+
+    Args:
+        repositories (List[str]): The full names of the repositories, "owner/repo". Duplicates are ignored.
+        limit (int): The maximum number of neighbours to return per repository.
+        min_shared (int): The minimum number of shared stargazers of a neighbour.
+        metric (Metric): The score used to rank the neighbours, "overlap" or "jaccard".
+
+    Yields:
+        Dict: The frames.
+    """
+    keys: Dict[str, str] = {}
+    seen = set()
+    for repository in repositories:
+        if repository.lower() in seen:
+            continue
+        seen.add(repository.lower())
+        owner, repo = repository.split("/", 1)
+        key = _result_key(owner, repo, limit, min_shared, metric, None)
+        entry = neighbours_cache.lookup(key)
+        CACHE_REQUESTS.inc(cache="neighbours", result="miss" if entry is None or not entry.fresh else "hit")
+        if entry is not None and entry.fresh:
+            yield {**entry.value, "repository": repository}
+        else:
+            keys[repository] = key
+    if not keys:
+        return
+
+    with span("neighbours.batch", repositories=len(keys)):
+        started = time.perf_counter()
+        fetched_stargazers = await asyncio.gather(*(get_stargazers(*repository.split("/", 1)) for repository in keys),
+                                                  return_exceptions=True)
+        NEIGHBOURS_PHASE_DURATION.observe(time.perf_counter() - started, phase="stargazers")
+
+        scorers: List[NeighbourScorer] = []
+        for repository, stargazers in zip(keys, fetched_stargazers):
+            if isinstance(stargazers, GitHubAPIException):
+                yield {"type": "error", "repository": repository, "status": stargazers.code,
+                       "detail": stargazers.message}
+            elif isinstance(stargazers, BaseException):
+                raise stargazers
+            else:
+                scorers.append(NeighbourScorer(repository, stargazers))
+
+        # The scorers of the repositories each stargazer starred, and the number of lists each scorer still waits for
+        scorers_by_stargazer: Dict[str, List[NeighbourScorer]] = {}
+        for scorer in scorers:
+            for stargazer in scorer.logins:
+                scorers_by_stargazer.setdefault(stargazer, []).append(scorer)
+        pending = {scorer.repository: scorer.stargazers_count for scorer in scorers}
+        treatments: Dict[str, List[str]] = {}
+
+        def complete(scorer: NeighbourScorer) -> Dict:
+            starred_lists = {treatment: [stargazer for stargazer in stargazers if scorer.has_stargazer(stargazer)]
+                             for treatment, stargazers in treatments.items()}
+            result = {"type": "result", "processed": len(scorer.processed), "total": scorer.stargazers_count,
+                      "mode": "exact", "starredLists": {treatment: stargazers for treatment, stargazers
+                                                        in starred_lists.items() if stargazers},
+                      "neighbours": scorer.top_k(limit, min_shared=min_shared, metric=metric),
+                      "stargazersCount": scorer.stargazers_count}
+            _cache_result(keys[scorer.repository], result)
+            return {**result, "repository": scorer.repository}
+
+        for scorer in scorers:
+            if not pending[scorer.repository]:
+                yield complete(scorer)
+
+        fetched: List[Tuple[str, List[StarredRepo]]] = []
+        started, aggregation = time.perf_counter(), 0.0
+        async for stargazer, starred_repos in iter_starred_repos(list(scorers_by_stargazer), treatments=treatments):
+            aggregation_started = time.perf_counter()
+            if star_graph is not None and is_leader():
+                fetched.append((stargazer, starred_repos))
+            completed = []
+            for scorer in scorers_by_stargazer[stargazer]:
+                scorer.add_starred(stargazer, starred_repos)
+                pending[scorer.repository] -= 1
+                if not pending[scorer.repository]:
+                    completed.append(complete(scorer))
+            aggregation += time.perf_counter() - aggregation_started
+            for result in completed:
+                yield result
+        NEIGHBOURS_PHASE_DURATION.observe(time.perf_counter() - started - aggregation, phase="fanout")
+        NEIGHBOURS_PHASE_DURATION.observe(aggregation, phase="aggregation")
+
+        # Only whole lists go to the star graph
+        partial = {stargazer for stargazers in treatments.values() for stargazer in stargazers}
+        fetched = [(stargazer, starred_repos) for stargazer, starred_repos in fetched if stargazer not in partial]
+        if fetched:
+            with NEIGHBOURS_PHASE_DURATION.time(phase="storage"):
+                await asyncio.to_thread(_store_starred_repos, fetched)
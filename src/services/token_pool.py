@@ -0,0 +1,217 @@
+import itertools
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+from dotenv import load_dotenv
+from github import Auth, Github
+
+from src.services.ratelimit import RateLimitScheduler
+from src.utils.metrics import GaugeCollector
+
+load_dotenv()
+
+# Credentials of the pool, every token adds its own hourly budget
+GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
+GITHUB_TOKENS = os.getenv("GITHUB_TOKENS", "")  # comma separated
+# GitHub App installations, their tokens are refreshed automatically by PyGithub
+GITHUB_APP_ID = os.getenv("GITHUB_APP_ID")
+GITHUB_APP_PRIVATE_KEY_PATH = os.getenv("GITHUB_APP_PRIVATE_KEY_PATH")
+GITHUB_APP_INSTALLATION_IDS = os.getenv("GITHUB_APP_INSTALLATION_IDS", "")  # comma separated
+# 100 is the maximum allowed for the parameter per_page, see
+# https://docs.github.com/en/rest/using-the-rest-api/using-pagination-in-the-rest-api
+PER_PAGE = 100
+
+logger = logging.getLogger('uvicorn.error')
+
+
+class NoTokenAvailable(Exception):
+    """Exception raised when every token of the pool was removed from the rotation."""
+    pass
+
+
+@dataclass
+class TokenStats:
+    """Usage statistics of a token of the pool."""
+    requests: int = 0
+    errors: int = 0
+    rate_limited: int = 0
+
+
+@dataclass
+class PooledToken:
+    """
+    A credential of the pool, with its own PyGithub client and rate limit scheduler.
+
+    The token is obtained through `get_token` so installation tokens of GitHub Apps can be refreshed.
+    """
+    name: str
+    github: Github
+    get_token: Callable[[], Optional[str]]
+    refreshable: bool = False
+    scheduler: RateLimitScheduler = field(default_factory=RateLimitScheduler)
+    stats: TokenStats = field(default_factory=TokenStats)
+    disabled: bool = False
+
+    @property
+    def token(self) -> Optional[str]:
+        return self.get_token()
+
+    def is_available(self) -> bool:
+        """
+        Check if the token can be used right away: its budget isn't spent and it isn't paused by a secondary limit.
+        """
+        return self.scheduler.get_remaining_budget() != 0 and self.scheduler.blocked_until <= time.time()
+
+
+class TokenPool:
+    """
+    Pool of GitHub credentials spreading requests by remaining quota.
+
+    Every request should acquire a token, the token with the largest remaining budget is chosen, tokens whose budget
+    isn't known yet being considered full. Exhausted tokens are skipped until their window is reset, and tokens
+    rejected with 401 Unauthorized are removed from the rotation.
+    """
+
+    def __init__(self, tokens: List[PooledToken]):
+        if not tokens:
+            raise ValueError("A token pool needs at least one token.")
+        self.tokens = tokens
+        self._round_robin = itertools.count()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_tokens(cls, tokens: List[Optional[str]]) -> "TokenPool":
+        """
+        Create a pool from personal access tokens, a None token creating an unauthenticated client.
+        """
+        return cls([_personal_access_token(token) for token in tokens])
+
+    @classmethod
+    def from_environment(cls) -> "TokenPool":
+        """
+        Create a pool from GITHUB_TOKEN, GITHUB_TOKENS and the GitHub App installations.
+
+        Without any credential, the pool contains a single unauthenticated client.
+        """
+        tokens = [token.strip() for token in [GITHUB_TOKEN or "", *GITHUB_TOKENS.split(",")] if token.strip()]
+        pooled = [_personal_access_token(token) for token in dict.fromkeys(tokens)]
+
+        installation_ids = [installation_id.strip() for installation_id in GITHUB_APP_INSTALLATION_IDS.split(",")
+                            if installation_id.strip()]
+        if GITHUB_APP_ID and GITHUB_APP_PRIVATE_KEY_PATH and installation_ids:
+            with open(GITHUB_APP_PRIVATE_KEY_PATH) as private_key:
+                app_auth = Auth.AppAuth(GITHUB_APP_ID, private_key.read())
+            pooled.extend(_app_installation(app_auth, int(installation_id)) for installation_id in installation_ids)
+
+        if not pooled:
+            pooled.append(_personal_access_token(None))
+        return cls(pooled)
+
+    @property
+    def primary(self) -> PooledToken:
+        return self.tokens[0]
+
+    @property
+    def authenticated(self) -> bool:
+        return any(pooled.name != "anonymous" for pooled in self.tokens)
+
+    def acquire(self) -> PooledToken:
+        """
+        Choose the token to use for the next request.
+
+        Returns:
+            PooledToken: The available token with the largest remaining budget. If no token is available, the one
+            reset first, its scheduler will wait for the reset.
+
+        Raises:
+            NoTokenAvailable: If every token was removed from the rotation.
+        """
+        with self._lock:
+            enabled = [pooled for pooled in self.tokens if not pooled.disabled]
+            if not enabled:
+                raise NoTokenAvailable("No valid GitHub token available.")
+
+            available = [pooled for pooled in enabled if pooled.is_available()]
+            if available:
+                # Rotate the starting point so tokens with the same budget are used in turn
+                offset = next(self._round_robin) % len(available)
+                chosen = max(available[offset:] + available[:offset], key=self._budget)
+            else:
+                chosen = min(enabled, key=lambda pooled: max(pooled.scheduler.reset_at, pooled.scheduler.blocked_until))
+            chosen.stats.requests += 1
+            return chosen
+
+    def report(self, pooled: PooledToken, status: int) -> None:
+        """
+        Report the status of a response obtained with a token.
+
+        Args:
+            pooled (PooledToken): The token used for the request.
+            status (int): The status code of the response.
+        """
+        with self._lock:
+            if status >= 400:
+                pooled.stats.errors += 1
+            if status in (403, 429):
+                pooled.stats.rate_limited += 1
+            if status == 401 and not pooled.refreshable and not pooled.disabled:
+                pooled.disabled = True
+                logger.error(f"GitHub token {pooled.name} was rejected and removed from the pool")
+
+    def get_remaining_budget(self) -> Optional[int]:
+        """
+        Return the number of requests left across the tokens in rotation.
+
+        Returns:
+            int | None: The remaining number of requests, None if no token has seen a response yet.
+        """
+        budgets = [pooled.scheduler.get_remaining_budget() for pooled in self.tokens if not pooled.disabled]
+        known = [budget for budget in budgets if budget is not None]
+        return sum(known) if known else None
+
+    def get_stats(self) -> List[dict]:
+        """
+        Return the statistics of every token of the pool.
+        """
+        return [{
+            "token": pooled.name,
+            "disabled": pooled.disabled,
+            "remaining": pooled.scheduler.get_remaining_budget(),
+            "limit": pooled.scheduler.limit,
+            "resetAt": pooled.scheduler.reset_at or None,
+            "requests": pooled.stats.requests,
+            "errors": pooled.stats.errors,
+            "rateLimited": pooled.stats.rate_limited,
+        } for pooled in self.tokens]
+
+    @staticmethod
+    def _budget(pooled: PooledToken) -> int:
+        remaining = pooled.scheduler.get_remaining_budget()
+        if remaining is None:
+            return pooled.scheduler.limit or 5000
+        return remaining
+
+
+def _personal_access_token(token: Optional[str]) -> PooledToken:
+    if token is None:
+        return PooledToken(name="anonymous", github=Github(per_page=PER_PAGE), get_token=lambda: None)
+    # Only the end of the token is kept, so statistics can be exposed
+    return PooledToken(name=f"token-...{token[-4:]}", github=Github(auth=Auth.Token(token), per_page=PER_PAGE),
+                       get_token=lambda: token)
+
+
+def _app_installation(app_auth: Auth.AppAuth, installation_id: int) -> PooledToken:
+    installation_auth = app_auth.get_installation_auth(installation_id)
+    github = Github(auth=installation_auth, per_page=PER_PAGE)
+    return PooledToken(name=f"installation-{installation_id}", github=github,
+                       get_token=lambda: installation_auth.token, refreshable=True)
+
+
+token_pool = TokenPool.from_environment()
+GaugeCollector("github_rate_limit_remaining", "Requests left in the current rate limit window, per token",
+               lambda: [({"token": stats["token"]}, stats["remaining"]) for stats in token_pool.get_stats()],
+               ("token",))
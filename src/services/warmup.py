@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import os
+import time
+from typing import List, Optional
+
+from dotenv import load_dotenv
+
+from src.services.github import GitHubAPIException
+from src.services.github_async import prefetch_starred_repos
+from src.services.ratelimit import background_priority
+from src.services.resilience import RequestStats, track_request_stats
+from src.services.starneighbours import refresh_repository_neighbours
+from src.services.token_pool import TokenPool, token_pool
+from src.utils.metrics import Counter
+
+load_dotenv()
+
+# Comma separated repositories ("owner/repo") whose neighbours are kept in the cache, so their requests never wait
+# for a computation, even right after a deploy
+WARMUP_REPOSITORIES = os.getenv("WARMUP_REPOSITORIES", "")
+# Time between two warm-up rounds, results expiring after the next round are computed again
+WARMUP_INTERVAL = int(os.getenv("WARMUP_INTERVAL", 300))  # in seconds
+# Share of the hourly rate limit of the tokens the warm-up can use
+WARMUP_BUDGET_SHARE = float(os.getenv("WARMUP_BUDGET_SHARE", 0.1))
+
+# Duration of the rate limit windows of GitHub
+RATE_LIMIT_WINDOW = 3600  # in seconds
+
+logger = logging.getLogger('uvicorn.error')
+
+WARMUP_REQUESTS_TOTAL = Counter("warmup_github_requests_total", "GitHub API requests made to warm the cache up")
+
+
+class WarmupScheduler:
+    """
+    Keeps the neighbours of hot repositories in the cache, warming it up as soon as the application starts.
+
+    Every round computes the neighbours of the repositories whose result would expire before the next round, then
+    fetches the whole starred lists of their heavy starrers (see HEAVY_STARRER_STRATEGY) and computes the neighbours
+    again with them, so the cached result is exact. Requests have the background priority, and the warm-up stops
+    spending once it made `budget_share` of the hourly rate limit of the tokens in requests. The budget is checked
+    between repositories and starred lists, a round can overshoot it by one of them.
+    """
+
+    def __init__(self, repositories: List[str], interval: int = WARMUP_INTERVAL,
+                 budget_share: float = WARMUP_BUDGET_SHARE, pool: TokenPool = token_pool):
+        self.repositories = repositories
+        self.interval = interval
+        self.budget_share = budget_share
+        self.pool = pool
+        self._spent = 0
+        self._window_started = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """
+        Start warming the cache up in the background, if there are repositories to warm up.
+        """
+        if self.repositories and self.budget_share > 0 and self._task is None:
+            logger.info(f"Warming up the neighbours of {len(self.repositories)} repositories")
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def get_remaining_budget(self) -> int:
+        """
+        Return the number of requests the warm-up can still make in the current window.
+        """
+        now = time.time()
+        if now - self._window_started >= RATE_LIMIT_WINDOW:
+            self._spent, self._window_started = 0, now
+        limit = sum(pooled.scheduler.limit or 5000 for pooled in self.pool.tokens if not pooled.disabled)
+        return int(limit * self.budget_share) - self._spent
+
+    async def warm(self) -> int:
+        """
+        Run a warm-up round.
+
+        Returns:
+            int: The number of requests made.
+        """
+        spent = 0
+        with background_priority():
+            for repository in self.repositories:
+                if self.get_remaining_budget() <= 0:
+                    logger.info(f"Warm-up budget spent, {repository} and the following repositories are skipped")
+                    break
+                owner, repo = repository.split("/", 1)
+                with track_request_stats() as stats:
+                    try:
+                        await self._warm_repository(owner, repo, stats)
+                    except GitHubAPIException as e:
+                        logger.warning(f"Warm-up of the neighbours of {repository} failed: {e}")
+                    finally:
+                        self._spent += stats.requests
+                        spent += stats.requests
+                        WARMUP_REQUESTS_TOTAL.inc(stats.requests)
+        return spent
+
+    async def _warm_repository(self, owner: str, repo: str, stats: RequestStats) -> None:
+        entry = await refresh_repository_neighbours(owner, repo, min_ttl=self.interval)
+        # Once their whole lists are cached, heavy starrers are no longer listed in the results
+        heavy_starrers = [login for logins in entry.value.get("starredLists", {}).values() for login in logins]
+        for login in heavy_starrers:
+            if self.get_remaining_budget() - stats.requests <= 0:
+                return
+            await prefetch_starred_repos(login)
+        if heavy_starrers:
+            await refresh_repository_neighbours(owner, repo)
+
+    async def _run(self) -> None:
+        while True:
+            started = time.perf_counter()
+            spent = await self.warm()
+            logger.info(f"Warm-up round of {len(self.repositories)} repositories done in "
+                        f"{time.perf_counter() - started:.1f}s with {spent} GitHub requests")
+            await asyncio.sleep(self.interval)
+
+
+warmup_scheduler = WarmupScheduler([repository.strip() for repository in WARMUP_REPOSITORIES.split(",")
+                                    if repository.strip()])
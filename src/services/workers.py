@@ -0,0 +1,141 @@
+import asyncio
+import fcntl
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Dict, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Number of worker processes started by `python -m src.main`
+WORKERS = int(os.getenv("WORKERS", 1))
+# Directory of the lock files shared by the workers, it must be on a local filesystem
+LOCKS_DIR = os.getenv("LOCKS_DIR") or os.path.join(tempfile.gettempdir(), "stargazer-locks")
+# Number of lock files keys are spread over, so any number of keys can be locked with a bounded number of files
+LOCK_STRIPES = int(os.getenv("LOCK_STRIPES", 256))
+# Interval at which a busy lock is tried again, in seconds
+LOCK_POLL_INTERVAL = 0.05
+
+logger = logging.getLogger('uvicorn.error')
+
+
+class ProcessLock:
+    """
+    Lock shared by the worker processes of a host, backed by an advisory lock (flock) on a file.
+
+    The lock is released by the OS if its process dies, so a crashed worker can't hold it forever. Locks taken
+    through different instances exclude each other, even within the same process.
+    """
+
+    def __init__(self, name: str, locks_dir: str = LOCKS_DIR):
+        os.makedirs(locks_dir, exist_ok=True)
+        self.path = os.path.join(locks_dir, f"{name}.lock")
+        self._file: Optional[int] = None
+
+    @property
+    def locked(self) -> bool:
+        return self._file is not None
+
+    def try_acquire(self) -> bool:
+        """
+        Take the lock if it is free.
+
+        Returns:
+            bool: True if the lock was taken.
+        """
+        if self._file is not None:
+            return True
+        file = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(file)
+            return False
+        self._file = file
+        return True
+
+    def release(self) -> None:
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            os.close(self._file)
+            self._file = None
+
+    async def __aenter__(self) -> "ProcessLock":
+        # Polling keeps the event loop free, unlike a blocking flock
+        while not self.try_acquire():
+            await asyncio.sleep(LOCK_POLL_INTERVAL)
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.release()
+
+    def __enter__(self) -> "ProcessLock":
+        # Blocking, for the code running in a thread or outside of the event loop
+        while not self.try_acquire():
+            time.sleep(LOCK_POLL_INTERVAL)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+
+# Stripes locked by the current task, visible to the tasks it creates, so a stampede lock taken while computing a
+# value whose key shares the stripe doesn't wait forever for its own lock
+_held_stripes: ContextVar[Optional[Dict[int, ProcessLock]]] = ContextVar("held_stripes", default=None)
+
+
+@asynccontextmanager
+async def stampede_lock(key: str) -> AsyncIterator[None]:
+    """
+    Context manager guarding the computation of a cached value, so a single worker computes it while the others wait
+    and then read it from the shared cache.
+
+    Keys are spread over LOCK_STRIPES lock files, so two keys may share a lock. The lock is reentrant within a
+    computation: nested locks on a stripe already held by the current task, or the task that created it, are
+    granted right away, since the outer lock already excludes the other workers.
+
+    Args:
+        key (str): The key of the cached value.
+    """
+    stripe = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=4).digest(), "little") % LOCK_STRIPES
+    held = _held_stripes.get() or {}
+    if stripe in held and held[stripe].locked:
+        yield
+        return
+    lock = ProcessLock(f"stripe-{stripe}")
+    token = _held_stripes.set({**held, stripe: lock})
+    try:
+        async with lock:
+            yield
+    finally:
+        _held_stripes.reset(token)
+
+
+_leader_lock = ProcessLock("leader")
+
+
+def elect_leader() -> bool:
+    """
+    Try to become the leader, the worker running what must run once per host: startup checks, background jobs and
+    writes to the single-writer stores. The leader keeps the lock until it stops or dies.
+
+    Returns:
+        bool: True if this process is the leader.
+    """
+    if _leader_lock.try_acquire():
+        logger.info(f"Worker {os.getpid()} is the leader")
+    return _leader_lock.locked
+
+
+def is_leader() -> bool:
+    return _leader_lock.locked
+
+
+def resign_leader() -> None:
+    _leader_lock.release()
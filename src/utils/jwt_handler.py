@@ -1,8 +1,12 @@
+import hashlib
 import os
+import threading
+from collections import OrderedDict
 from time import time
-from typing import TypedDict, Dict
+from typing import TypedDict, Dict, Optional, Tuple
 
 import jwt
+from jwt.algorithms import HMACAlgorithm
 
 
 # Define a custom exception for invalid tokens
@@ -21,6 +25,44 @@ class AuthenticationTokens(TypedDict):
     refreshToken: str
 
 
+class VerifiedTokenCache:
+    """
+    Bounded LRU of the payloads of verified tokens, so a client polling with the same token has its signature checked
+    only once.
+
+    Tokens are keyed by a digest of the token and of the key that verified it, and are dropped once expired.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[bytes, Tuple[float, Dict]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest: bytes) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            if entry[0] <= time():
+                del self._entries[digest]
+                return None
+            self._entries.move_to_end(digest)
+            return entry[1]
+
+    def set(self, digest: bytes, expires_at: float, payload: Dict) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[digest] = (expires_at, payload)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
 class JWTHandler:
     # Missing secrets will lead to an error when starting the application, which is intended since secrets are mandatory
     access_secret: str = os.getenv("ACCESS_TOKEN_SECRET",
@@ -28,6 +70,24 @@ class JWTHandler:
     refresh_secret: str = os.getenv("REFRESH_TOKEN_SECRET", "")
     access_token_lifetime: int = int(os.getenv("ACCESS_TOKEN_LIFETIME", 300))  # in seconds
     refresh_token_lifetime: int = int(os.getenv("REFRESH_TOKEN_LIFETIME", 1800))  # in seconds
+    verified_tokens = VerifiedTokenCache(int(os.getenv("JWT_CACHE_MAX_ENTRIES", 10000)))
+    # HMAC keys prepared from the secrets, by secret
+    _keys: Dict[str, bytes] = {}
+
+    @staticmethod
+    def prepare_keys() -> None:
+        """
+        Prepare the HMAC keys of the access and refresh secrets, so they aren't prepared again for every token.
+        """
+        for secret in (JWTHandler.access_secret, JWTHandler.refresh_secret):
+            JWTHandler._get_key(secret)
+
+    @staticmethod
+    def _get_key(secret: str) -> bytes:
+        key = JWTHandler._keys.get(secret)
+        if key is None:
+            key = JWTHandler._keys[secret] = HMACAlgorithm(HMACAlgorithm.SHA256).prepare_key(secret)
+        return key
 
     @staticmethod
     def generate_authentication_tokens(user_info: UserInformationJWT) -> AuthenticationTokens:
@@ -78,12 +138,39 @@ class JWTHandler:
         Raises:
             AuthenticationError: If the token is expired or invalid.
         """
+        JWTHandler.authenticate(token, secret)
+
+    @staticmethod
+    def authenticate(token: str, secret: str) -> Dict:
+        """
+        Verify a JWT and return its payload.
+
+        Verified tokens are cached until they expire, tokens without expiration are verified every time.
+
+        Args:
+            token (str): The token to verify.
+            secret (str): The secret key that was used to sign the token.
+
+        Returns:
+            Dict: The payload of the token.
+
+        Raises:
+            AuthenticationError: If the token is expired or invalid.
+        """
+        key = JWTHandler._get_key(secret)
+        digest = hashlib.sha256(key + b"." + token.encode()).digest()
+        payload = JWTHandler.verified_tokens.get(digest)
+        if payload is not None:
+            return payload
         try:
-            jwt.decode(token, secret, algorithms=["HS256"])
+            payload = jwt.decode(token, key, algorithms=["HS256"])
         except jwt.ExpiredSignatureError:
             raise AuthenticationError("Token has expired.")
         except jwt.InvalidTokenError:
             raise AuthenticationError("Invalid token.")
+        if isinstance(payload.get("exp"), (int, float)):
+            JWTHandler.verified_tokens.set(digest, payload["exp"], payload)
+        return payload
 
     @staticmethod
     def refresh_tokens(refresh_token: str) -> AuthenticationTokens:
@@ -99,7 +186,6 @@ class JWTHandler:
         Raises:
             AuthenticationError: If the refresh token is invalid or expired.
         """
-        JWTHandler.verify_token(refresh_token, JWTHandler.refresh_secret)
         decoded = JWTHandler.decode_token(refresh_token, JWTHandler.refresh_secret)
         return JWTHandler.generate_authentication_tokens(decoded)
 
@@ -118,7 +204,7 @@ class JWTHandler:
         Raises:
             AuthenticationError: If the token is invalid or decoding fails.
         """
-        decoded = jwt.decode(token, secret, algorithms="HS256")
+        decoded = JWTHandler.authenticate(token, secret)
         return UserInformationJWT(
             userName=decoded["userName"],
         )
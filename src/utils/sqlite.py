@@ -0,0 +1,23 @@
+import sqlite3
+
+# Time a connection waits for another process to release the database before failing, in seconds
+SQLITE_BUSY_TIMEOUT = 30
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    """
+    Open a SQLite database that can be shared by several worker processes.
+
+    The write-ahead log lets readers work while another process writes, and writers wait for each other instead of
+    failing with "database is locked".
+
+    Args:
+        db_path (str): The path of the database.
+
+    Returns:
+        sqlite3.Connection: The connection, usable from any thread as long as callers serialize their calls.
+    """
+    db = sqlite3.connect(db_path, check_same_thread=False, timeout=SQLITE_BUSY_TIMEOUT)
+    if db_path != ":memory:":
+        db.execute("PRAGMA journal_mode=WAL")
+    return db
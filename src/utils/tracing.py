@@ -0,0 +1,33 @@
+import os
+from contextlib import contextmanager
+from typing import Iterator
+
+from dotenv import load_dotenv
+
+try:
+    from opentelemetry import trace
+except ImportError:  # OpenTelemetry is optional, spans are then not recorded
+    trace = None
+
+load_dotenv()
+
+# Record OpenTelemetry spans, requires the opentelemetry-api package and an SDK configured by the deployment
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+
+_tracer = trace.get_tracer("stargazer") if trace is not None and TRACING_ENABLED else None
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[None]:
+    """
+    Record the block as an OpenTelemetry span, nested in the current span. Does nothing when tracing is disabled.
+
+    Args:
+        name (str): The name of the span.
+        **attributes: The attributes of the span, for example the login whose starred list is fetched.
+    """
+    if _tracer is None:
+        yield
+        return
+    with _tracer.start_as_current_span(name, attributes=attributes):
+        yield
@@ -0,0 +1,85 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from src.api.admission import AdmissionController, AdmissionRejected, admit_computation
+
+
+class TestAdmissionController(unittest.IsolatedAsyncioTestCase):
+
+    async def test_client_concurrency(self):
+        controller = AdmissionController(client_concurrency=1)
+
+        async with controller.admit("userA", 10):
+            with self.assertRaises(AdmissionRejected):
+                async with controller.admit("userA", 10):
+                    pass
+            # Other clients aren't affected
+            async with controller.admit("userB", 10):
+                pass
+        async with controller.admit("userA", 10):
+            pass
+
+    async def test_client_budget(self):
+        controller = AdmissionController(client_budget=1000)
+
+        async with controller.admit("userA", 800):
+            pass
+        with self.assertRaises(AdmissionRejected) as rejected:
+            async with controller.admit("userA", 800):
+                pass
+
+        # 600 stargazers are missing, the budget refills 1000 stargazers per hour
+        self.assertAlmostEqual(rejected.exception.retry_after, 2160, delta=5)
+        self.assertAlmostEqual(controller.get_remaining_budget("userA"), 200, delta=1)
+        # A computation costing more than the budget is admitted when the budget is full
+        async with controller.admit("userB", 5000):
+            pass
+
+    async def test_queue(self):
+        controller = AdmissionController(max_computations=1, max_queued=1, queue_timeout=0.05)
+        running = asyncio.Event()
+        release = asyncio.Event()
+
+        async def compute(client):
+            async with controller.admit(client, 1):
+                running.set()
+                await release.wait()
+
+        first = asyncio.create_task(compute("userA"))
+        await running.wait()
+        # The second computation waits for the slot, the third one is shed
+        second = asyncio.create_task(compute("userB"))
+        await asyncio.sleep(0)
+        with self.assertRaises(AdmissionRejected):
+            async with controller.admit("userC", 1):
+                pass
+        with self.assertRaises(AdmissionRejected):
+            await second
+        self.assertEqual(controller.get_remaining_budget("userB"), controller.client_budget)
+
+        release.set()
+        await first
+        self.assertEqual(controller.queued, 0)
+
+    @patch('src.api.admission.peek_repository_neighbours_entry')
+    @patch('src.api.admission.get_repository', new_callable=AsyncMock)
+    async def test_admit_computation(self, mock_get_repository, mock_peek_repository_neighbours_entry):
+        mock_get_repository.return_value = {"stargazers_count": 300}
+        controller = AdmissionController(client_budget=1000)
+
+        with patch('src.api.admission.admission_controller', controller):
+            # Cached results are served without being admitted
+            async with admit_computation("userA", "owner", "repo", 10, 1, "overlap"):
+                pass
+            mock_get_repository.assert_not_awaited()
+
+            mock_peek_repository_neighbours_entry.return_value = None
+            async with admit_computation("userA", "owner", "repo", 10, 1, "overlap"):
+                pass
+
+        self.assertAlmostEqual(controller.get_remaining_budget("userA"), 700, delta=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
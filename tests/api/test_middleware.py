@@ -0,0 +1,75 @@
+import unittest
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from starlette.responses import PlainTextResponse
+
+from src.api.middleware import JWTValidationMiddleware, CompressionMiddleware
+from src.utils.jwt_handler import JWTHandler
+
+
+class TestJWTValidationMiddleware(unittest.TestCase):
+
+    def setUp(self):
+        app = FastAPI()
+        app.add_middleware(JWTValidationMiddleware, prefix="/v1")
+
+        @app.get("/v1/user")
+        def get_user(request: Request):
+            return request.state.user
+
+        @app.get("/")
+        def read_root():
+            return {}
+
+        self.client = TestClient(app)
+        self.token = JWTHandler._generate_token({"userName": "Test"}, secret=JWTHandler.access_secret, lifetime=300)
+
+    def test_valid_token(self):
+        response = self.client.get("/v1/user", headers={"Authorization": f"Bearer {self.token}"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["userName"], "Test")
+
+    def test_missing_token(self):
+        response = self.client.get("/v1/user")
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json(), {"error": "Missing token"})
+
+    def test_malformed_header(self):
+        for authorization in ("Bearer", "Bearer ", self.token, f"Basic {self.token}"):
+            response = self.client.get("/v1/user", headers={"Authorization": authorization})
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(response.json(), {"error": "Invalid token."})
+
+    def test_unprotected_path(self):
+        self.assertEqual(self.client.get("/").status_code, 200)
+
+
+class TestCompressionMiddleware(unittest.TestCase):
+
+    def setUp(self):
+        app = FastAPI()
+        app.add_middleware(CompressionMiddleware, minimum_size=100)
+
+        @app.get("/text")
+        def get_text(size: int):
+            return PlainTextResponse("a" * size)
+
+        self.client = TestClient(app)
+
+    def test_gzip(self):
+        response = self.client.get("/text", params={"size": 1000}, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(response.headers["Vary"], "Accept-Encoding")
+        self.assertEqual(response.text, "a" * 1000)
+        self.assertLess(int(response.headers["Content-Length"]), 1000)
+
+    def test_not_compressed(self):
+        small = self.client.get("/text", params={"size": 10}, headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", small.headers)
+        refused = self.client.get("/text", params={"size": 1000}, headers={"Accept-Encoding": "gzip;q=0"})
+        self.assertNotIn("Content-Encoding", refused.headers)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+
+from fastapi import HTTPException
+
+from src.api.results import ResultView, encode_cursor, decode_cursor
+
+NEIGHBOURS = [{"repo": f"owner/repo{index}", "stargazers": [f"user{user}" for user in range(20)], "shared": 20,
+               "score": 20} for index in range(5)]
+
+
+class TestResultView(unittest.TestCase):
+
+    def test_paginate(self):
+        self.assertEqual(ResultView().paginate(NEIGHBOURS), (NEIGHBOURS, None))
+        self.assertEqual(ResultView(page=2, per_page=2).paginate(NEIGHBOURS), (NEIGHBOURS[2:4], 4))
+        self.assertEqual(ResultView(per_page=2, cursor=encode_cursor(4)).paginate(NEIGHBOURS), (NEIGHBOURS[4:], None))
+
+    def test_shape(self):
+        neighbour = NEIGHBOURS[0]
+        self.assertEqual(ResultView(include_stargazers="false").shape(neighbour),
+                         {"repo": "owner/repo0", "shared": 20, "score": 20})
+        self.assertEqual(ResultView(include_stargazers="count").shape(neighbour)["stargazersCount"], 20)
+        self.assertEqual(len(ResultView(include_stargazers="sample").shape(neighbour)["stargazers"]), 10)
+        self.assertEqual(ResultView(fields="repo, score").shape(neighbour), {"repo": "owner/repo0", "score": 20})
+        # Cached results are left untouched
+        self.assertEqual(len(neighbour["stargazers"]), 20)
+
+    def test_decode_cursor(self):
+        self.assertEqual(decode_cursor(encode_cursor(42)), 42)
+        for cursor in ("invalid", encode_cursor(-1), "e30"):
+            with self.assertRaises(HTTPException):
+                decode_cursor(cursor)
+
+
+if __name__ == "__main__":
+    unittest.main()
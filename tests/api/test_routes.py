@@ -1,29 +1,39 @@
+import asyncio
+import json
+import time
 import unittest
-from unittest.mock import patch
+from unittest.mock import AsyncMock, patch
 
+import requests
 from fastapi.testclient import TestClient
 
-from src.config.urls import ROUTE_STARNEIGHBOURS, API_VERSION
-from src.main import app
+from src.api.admission import AdmissionController
+from src.config.urls import ROUTE_STARNEIGHBOURS, ROUTE_STARNEIGHBOURS_BATCH, ROUTE_STARNEIGHBOURS_JOBS, API_VERSION
+from src.main import app, check_github_readiness
+from src.services.cache import CachedResult
 from src.utils.jwt_handler import JWTHandler
 
 
 class TestStarNeighboursEndpoint(unittest.TestCase):
 
-    @patch('src.api.routes.get_repository_neighbours')
+    @patch('src.api.admission.get_repository', AsyncMock(return_value={"stargazers_count": 2}))
+    @patch('src.api.routes.get_repository_neighbours_entry')
     def test_get_star_neighbours(self, mock_get_repository_neighbours):
         # Mock data for the expected response
         mock_neighbours = [
-            {"repo": "owner/repo1", "stargazers": ["userA", "userB"]},
-            {"repo": "owner/repo2", "stargazers": ["userA", "userB"]}
+            {"repo": "owner/repo1", "stargazers": ["userA", "userB"], "shared": 2, "score": 2},
+            {"repo": "owner/repo2", "stargazers": ["userA", "userB"], "shared": 2, "score": 2}
         ]
-        mock_get_repository_neighbours.return_value = mock_neighbours
+        mock_get_repository_neighbours.return_value = CachedResult({"mode": "exact", "total": 2, "stargazersCount": 2,
+                                                                    "starredLists": {"capped": ["userB"]},
+                                                                    "neighbours": mock_neighbours},
+                                                                   etag="etag", expires_at=time.time() + 60)
 
         # Create the TestClient instance
         client = TestClient(app)
 
         # Generate a valid JWT token
-        valid_token = JWTHandler._generate_token({"username": "valid_user"}, secret=JWTHandler.access_secret,
+        valid_token = JWTHandler._generate_token({"userName": "valid_user"}, secret=JWTHandler.access_secret,
                                                  lifetime=JWTHandler.access_token_lifetime)
 
         # Simulate a GET request to /starneighbours
@@ -32,9 +42,223 @@ class TestStarNeighboursEndpoint(unittest.TestCase):
         response = client.get(url, headers=headers)
 
         # Assertions
-        mock_get_repository_neighbours.assert_called_once_with("owner", "repo")
+        mock_get_repository_neighbours.assert_called_once_with("owner", "repo", limit=100, min_shared=1,
+                                                               metric="overlap", sampling=None)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json(), mock_neighbours)
+        self.assertEqual(response.headers["X-Neighbours-Mode"], "exact")
+        self.assertEqual(response.headers["X-Starred-Lists"], "capped=1")
+        self.assertTrue(response.headers["Cache-Control"].startswith("public, max-age=5"))
+
+        # A client revalidating the response gets a 304 without body
+        revalidated = client.get(url, headers={**headers, "If-None-Match": response.headers["ETag"]})
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated.content, b"")
+        self.assertEqual(revalidated.headers["ETag"], response.headers["ETag"])
+        other_page = client.get(url, params={"per_page": 1},
+                                headers={**headers, "If-None-Match": response.headers["ETag"]})
+        self.assertEqual(other_page.status_code, 200)
+
+    @patch('src.api.admission.get_repository', AsyncMock(return_value={"stargazers_count": 2}))
+    @patch('src.api.routes.iter_repository_neighbours')
+    def test_get_star_neighbours_stream(self, mock_iter_repository_neighbours):
+        neighbours = [{"repo": "owner/repo1", "stargazers": ["userA"], "shared": 1, "score": 1}]
+        frames = [
+            {"type": "stargazers", "total": 2},
+            {"type": "progress", "processed": 1, "total": 2, "neighbours": neighbours},
+            {"type": "result", "processed": 2, "total": 2, "neighbours": neighbours},
+        ]
+
+        async def iter_frames(*args, **kwargs):
+            for frame in frames:
+                yield frame
+
+        mock_iter_repository_neighbours.side_effect = iter_frames
+
+        client = TestClient(app)
+        valid_token = JWTHandler._generate_token({"userName": "valid_user"}, secret=JWTHandler.access_secret,
+                                                 lifetime=JWTHandler.access_token_lifetime)
+        url = API_VERSION + ROUTE_STARNEIGHBOURS.format(user="owner", repo="repo")
+        headers = {"Authorization": f"Bearer {valid_token}", "Accept": "application/x-ndjson"}
+        response = client.get(url, headers=headers)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["content-type"], "application/x-ndjson")
+        self.assertEqual([json.loads(line) for line in response.text.splitlines()], frames)
+
+    @patch('src.api.routes.minhash_index')
+    def test_get_star_neighbours_lookup(self, mock_minhash_index):
+        neighbours = [{"repo": "owner/repo1", "score": 0.5, "estimatedShared": 12.0}]
+        mock_minhash_index.neighbours.return_value = neighbours
+
+        client = TestClient(app)
+        valid_token = JWTHandler._generate_token({"userName": "valid_user"}, secret=JWTHandler.access_secret,
+                                                 lifetime=JWTHandler.access_token_lifetime)
+        url = API_VERSION + ROUTE_STARNEIGHBOURS.format(user="owner", repo="repo")
+        headers = {"Authorization": f"Bearer {valid_token}"}
+        response = client.get(url, params={"mode": "lookup"}, headers=headers)
+
+        mock_minhash_index.neighbours.assert_called_once_with("owner/repo", 100, min_shared=1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["X-Neighbours-Mode"], "lookup")
+        self.assertEqual(response.json(), neighbours)
+
+        mock_minhash_index.neighbours.return_value = None
+        self.assertEqual(client.get(url, params={"mode": "lookup"}, headers=headers).status_code, 404)
+
+    @patch('src.api.admission.get_repository', AsyncMock(return_value={"stargazers_count": 2}))
+    @patch('src.api.routes.get_repository_neighbours_entry')
+    def test_get_star_neighbours_page(self, mock_get_repository_neighbours):
+        neighbours = [{"repo": f"owner/repo{index}", "stargazers": ["userA", "userB"], "shared": 2, "score": 2}
+                      for index in range(3)]
+        mock_get_repository_neighbours.return_value = CachedResult({"mode": "exact", "total": 2, "stargazersCount": 2,
+                                                                    "neighbours": neighbours},
+                                                                   etag="etag", expires_at=time.time() + 60)
+
+        client = TestClient(app)
+        valid_token = JWTHandler._generate_token({"userName": "valid_user"}, secret=JWTHandler.access_secret,
+                                                 lifetime=JWTHandler.access_token_lifetime)
+        url = API_VERSION + ROUTE_STARNEIGHBOURS.format(user="owner", repo="repo")
+        headers = {"Authorization": f"Bearer {valid_token}"}
+        params = {"per_page": 2, "include_stargazers": "count", "fields": "repo,stargazersCount"}
+        response = client.get(url, params=params, headers=headers)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [{"repo": "owner/repo0", "stargazersCount": 2},
+                                           {"repo": "owner/repo1", "stargazersCount": 2}])
+        self.assertEqual(response.headers["X-Total-Count"], "3")
+
+        next_page = client.get(response.links["next"]["url"], headers=headers)
+        self.assertEqual(next_page.json(), [{"repo": "owner/repo2", "stargazersCount": 2}])
+        self.assertNotIn("Link", next_page.headers)
+
+    @patch('src.api.admission.get_repository', AsyncMock(return_value={"stargazers_count": 1}))
+    @patch('src.api.routes.iter_batch_neighbours')
+    def test_get_batch_star_neighbours(self, mock_iter_batch_neighbours):
+        neighbours = [{"repo": "owner/repo1", "stargazers": ["userA"], "shared": 1, "score": 1}]
+        frames = [
+            {"type": "error", "repository": "owner/missing", "status": 404, "detail": "Not Found"},
+            {"type": "result", "repository": "owner/repo", "processed": 1, "total": 1, "neighbours": neighbours},
+        ]
+
+        async def iter_frames(*args, **kwargs):
+            for frame in frames:
+                yield dict(frame)
+
+        mock_iter_batch_neighbours.side_effect = iter_frames
+
+        client = TestClient(app)
+        valid_token = JWTHandler._generate_token({"userName": "valid_user"}, secret=JWTHandler.access_secret,
+                                                 lifetime=JWTHandler.access_token_lifetime)
+        url = API_VERSION + ROUTE_STARNEIGHBOURS_BATCH
+        headers = {"Authorization": f"Bearer {valid_token}"}
+        body = {"repositories": ["owner/repo", "owner/missing"], "limit": 10}
+        response = client.post(url, json=body, headers=headers)
+
+        self.assertEqual(response.status_code, 200)
+        mock_iter_batch_neighbours.assert_called_once_with(["owner/repo", "owner/missing"], limit=10, min_shared=1,
+                                                           metric="overlap")
+        # The results follow the order of the request
+        self.assertEqual(list(response.json()["results"]), ["owner/repo", "owner/missing"])
+        self.assertEqual(response.json()["results"]["owner/repo"]["neighbours"], neighbours)
+
+        streamed = client.post(url, params={"stream": True}, json=body, headers=headers)
+        self.assertEqual([json.loads(line) for line in streamed.text.splitlines()], frames)
+
+        self.assertEqual(client.post(url, json={"repositories": ["not a repository"]}, headers=headers).status_code,
+                         422)
+
+    def test_get_metrics(self):
+        client = TestClient(app)
+        response = client.get("/metrics")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("# TYPE github_requests_total counter", response.text)
+        self.assertIn("# TYPE neighbours_phase_duration_seconds histogram", response.text)
+
+    @patch('src.api.routes.get_repository_neighbours_entry')
+    @patch('src.api.admission.get_repository', AsyncMock(return_value={"stargazers_count": 300000}))
+    def test_get_star_neighbours_rejected(self, mock_get_repository_neighbours):
+        client = TestClient(app)
+        valid_token = JWTHandler._generate_token({"userName": "heavy_user"}, secret=JWTHandler.access_secret,
+                                                 lifetime=JWTHandler.access_token_lifetime)
+        url = API_VERSION + ROUTE_STARNEIGHBOURS.format(user="owner", repo="huge")
+        headers = {"Authorization": f"Bearer {valid_token}"}
+
+        with patch('src.api.admission.admission_controller', AdmissionController(client_budget=100000)):
+            # The first computation spends the whole budget of the client
+            mock_get_repository_neighbours.return_value = CachedResult({"neighbours": []}, "etag", time.time() + 60)
+            self.assertEqual(client.get(url, headers=headers).status_code, 404)
+            response = client.get(url, headers=headers)
+
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response.headers["Retry-After"]), 3000)
+        mock_get_repository_neighbours.assert_called_once()
+
+    @patch('src.api.routes.job_manager')
+    @patch('src.api.routes.iter_batch_neighbours')
+    @patch('src.api.admission.get_repository', AsyncMock(return_value={"stargazers_count": 600}))
+    def test_batches_and_jobs_are_charged(self, mock_iter_batch_neighbours, mock_job_manager):
+        async def iter_frames(*args, **kwargs):
+            yield {"type": "result", "repository": "owner/repo1", "neighbours": []}
+
+        mock_iter_batch_neighbours.side_effect = iter_frames
+        mock_job_manager.find_active.return_value = None
+        mock_job_manager.submit.return_value = {"id": "job"}
+
+        client = TestClient(app)
+        valid_token = JWTHandler._generate_token({"userName": "batch_user"}, secret=JWTHandler.access_secret,
+                                                 lifetime=JWTHandler.access_token_lifetime)
+        headers = {"Authorization": f"Bearer {valid_token}"}
+        jobs_url = API_VERSION + ROUTE_STARNEIGHBOURS_JOBS.format(user="owner", repo="repo3")
+        controller = AdmissionController(client_budget=1000)
+
+        with patch('src.api.admission.admission_controller', controller), \
+                patch('src.api.routes.admission_controller', controller):
+            response = client.post(API_VERSION + ROUTE_STARNEIGHBOURS_BATCH, headers=headers,
+                                   json={"repositories": ["owner/repo1", "owner/repo2"]})
+            self.assertEqual(response.status_code, 200)
+            # The batch spent the whole budget of the client
+            self.assertLess(controller.get_remaining_budget("batch_user"), 1)
+            self.assertEqual(client.post(jobs_url, headers=headers).status_code, 429)
+            mock_job_manager.submit.assert_not_called()
+
+            # Jobs already queued or running aren't charged again
+            mock_job_manager.find_active.return_value = "job"
+            self.assertEqual(client.post(jobs_url, headers=headers).status_code, 202)
+
+    @patch('src.main.READINESS_RETRY_INTERVAL', 0)
+    @patch('src.main.check_github_connection')
+    def test_readiness_check_survives_transport_errors(self, mock_check_github_connection):
+        mock_check_github_connection.side_effect = [requests.exceptions.ConnectionError("unreachable"), None]
+
+        asyncio.run(check_github_readiness())
+
+        self.assertEqual(mock_check_github_connection.call_count, 2)
+        self.assertEqual(app.state.github, "ready")
+        app.state.github = "pending"
+
+    def test_token_without_user_name_is_rejected(self):
+        client = TestClient(app)
+        token = JWTHandler._generate_token({"username": "valid_user"}, secret=JWTHandler.access_secret,
+                                           lifetime=JWTHandler.access_token_lifetime)
+        url = API_VERSION + ROUTE_STARNEIGHBOURS.format(user="owner", repo="repo")
+
+        response = client.get(url, headers={"Authorization": f"Bearer {token}"})
+
+        self.assertEqual(response.status_code, 401)
+
+    def test_get_readiness(self):
+        client = TestClient(app)
+
+        app.state.github = "pending"
+        response = client.get("/ready")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json(), {"ready": False, "github": "pending"})
+
+        app.state.github = "ready"
+        self.assertEqual(client.get("/ready").status_code, 200)
+        app.state.github = "pending"
 
 
 if __name__ == '__main__':
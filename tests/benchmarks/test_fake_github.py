@@ -0,0 +1,49 @@
+import unittest
+
+from starlette.testclient import TestClient
+
+from benchmarks.fake_github import Scenario, StarGraph, create_app, STAR_MEDIA_TYPE
+
+
+class TestFakeGitHub(unittest.TestCase):
+
+    def setUp(self):
+        self.graph = StarGraph(Scenario("test", stargazers=150, repos=50, min_starred=2, max_starred=20))
+        self.client = TestClient(create_app(self.graph, rate_limit=10))
+
+    def test_graph_is_deterministic(self):
+        other = StarGraph(Scenario("test", stargazers=150, repos=50, min_starred=2, max_starred=20))
+        self.assertEqual([starred.tolist() for starred in other.starred],
+                         [starred.tolist() for starred in self.graph.starred])
+
+    def test_stargazers_are_paginated(self):
+        response = self.client.get("/repos/bench/test/stargazers", params={"per_page": 100, "page": 1},
+                                   headers={"Accept": STAR_MEDIA_TYPE})
+        self.assertEqual(len(response.json()), 100)
+        self.assertEqual(response.json()[0]["user"]["login"], "user0")
+        self.assertIn("page=2", response.links["last"]["url"])
+        self.assertEqual(response.headers["X-RateLimit-Remaining"], "9")
+
+        not_modified = self.client.get("/repos/bench/test/stargazers", params={"per_page": 100, "page": 1},
+                                       headers={"Accept": STAR_MEDIA_TYPE, "If-None-Match": response.headers["ETag"]})
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_starred_ends_with_the_benchmarked_repository(self):
+        response = self.client.get("/users/user0/starred", params={"per_page": 100},
+                                   headers={"Accept": STAR_MEDIA_TYPE})
+        starred = response.json()
+        self.assertEqual(starred[-1]["repo"]["full_name"], "bench/test")
+        dates = [starred_repo["starred_at"] for starred_repo in starred]
+        self.assertEqual(dates, sorted(dates, reverse=True))
+
+    def test_rate_limit_and_stats(self):
+        for _ in range(10):
+            self.client.get("/repos/bench/test")
+        self.assertEqual(self.client.get("/repos/bench/test").status_code, 403)
+        self.assertEqual(self.client.get("/_stats").json()["requests"], 11)
+        self.client.post("/_stats")
+        self.assertEqual(self.client.get("/_stats").json()["requests"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import tempfile
+import time
+import unittest
+
+from src.services.cache import PagedResponseCache, CacheEntry, CachedPage, ResultCache
+
+
+class TestPagedResponseCache(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        cache = PagedResponseCache(max_entries=2, ttl=60)
+        cache.set("userA", CacheEntry(pages=[CachedPage('"a"', ["owner/repo1"])]))
+        cache.set("userB", CacheEntry(pages=[CachedPage('"b"', ["owner/repo2"])]))
+        # Accessing userA makes userB the least recently used entry
+        cache.get("userA")
+        cache.set("userC", CacheEntry(pages=[CachedPage('"c"', ["owner/repo3"])]))
+
+        self.assertIsNotNone(cache.get("userA"))
+        self.assertIsNone(cache.get("userB"))
+        self.assertEqual(cache.get("userC").items, ["owner/repo3"])
+
+    def test_is_fresh(self):
+        cache = PagedResponseCache(max_entries=2, ttl=60)
+        self.assertTrue(cache.is_fresh(CacheEntry(pages=[])))
+        self.assertFalse(cache.is_fresh(CacheEntry(pages=[], fetched_at=time.time() - 120)))
+
+    def test_disk_tier_survives_restart(self):
+        with tempfile.TemporaryDirectory() as directory:
+            db_path = os.path.join(directory, "cache.db")
+            cache = PagedResponseCache(max_entries=2, ttl=60, db_path=db_path)
+            cache.set("userA", CacheEntry(pages=[CachedPage('"a"', ["owner/repo1", "owner/repo2"])]))
+
+            restarted_cache = PagedResponseCache(max_entries=2, ttl=60, db_path=db_path)
+            entry = restarted_cache.get("userA")
+
+            self.assertEqual(entry.pages[0].etag, '"a"')
+            self.assertEqual(entry.items, ["owner/repo1", "owner/repo2"])
+
+    def test_stale_entry_refreshed_by_another_process(self):
+        with tempfile.TemporaryDirectory() as directory:
+            db_path = os.path.join(directory, "cache.db")
+            worker, other_worker = (PagedResponseCache(max_entries=2, ttl=60, db_path=db_path) for _ in range(2))
+            worker.set("userA", CacheEntry(pages=[CachedPage('"a"', ["owner/repo1"])], fetched_at=0))
+            other_worker.set("userA", CacheEntry(pages=[CachedPage('"b"', ["owner/repo2"])]))
+
+            self.assertEqual(worker.get("userA").items, ["owner/repo2"])
+
+
+class TestResultCache(unittest.TestCase):
+
+    def test_shared_results_expire(self):
+        with tempfile.TemporaryDirectory() as directory:
+            db_path = os.path.join(directory, "results.db")
+            worker, other_worker = (ResultCache(max_entries=2, ttl=60, db_path=db_path) for _ in range(2))
+            worker.set("key", {"neighbours": []})
+
+            self.assertEqual(other_worker.get("key"), {"neighbours": []})
+            self.assertIsNone(ResultCache(max_entries=2, ttl=-1).get("key"))
+
+            expired = ResultCache(max_entries=2, ttl=0.01)
+            expired.set("key", 1)
+            time.sleep(0.02)
+            self.assertIsNone(expired.get("key"))
+
+    def test_stale_results(self):
+        with tempfile.TemporaryDirectory() as directory:
+            db_path = os.path.join(directory, "results.db")
+            worker, other_worker = (ResultCache(max_entries=2, ttl=60, db_path=db_path, max_stale=60)
+                                    for _ in range(2))
+            entry = worker.set("key", {"neighbours": []}, ttl=0.01)
+            time.sleep(0.02)
+
+            self.assertIsNone(worker.get("key"))
+            stale = other_worker.lookup("key")
+            self.assertFalse(stale.fresh)
+            # The ETag is the same for every worker
+            self.assertEqual((stale.value, stale.etag), ({"neighbours": []}, entry.etag))
+            self.assertIsNone(ResultCache(max_entries=2, ttl=60, db_path=db_path).lookup("key"))
+
+            # A stale result of the memory is replaced by the one another worker refreshed
+            other_worker.set("key", {"neighbours": [1]})
+            refreshed = worker.lookup("key")
+            self.assertTrue(refreshed.fresh)
+            self.assertEqual(refreshed.value, {"neighbours": [1]})
+
+
+if __name__ == '__main__':
+    unittest.main()
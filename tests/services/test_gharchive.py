@@ -0,0 +1,60 @@
+import gzip
+import json
+import os
+import tempfile
+import unittest
+
+from src.services.gharchive import ingest_archives, parse_archive
+from src.services.stargraph import StarGraph
+
+
+def _write_archive(path: str, events: list, extra_lines: tuple = ()) -> None:
+    with gzip.open(path, "wt") as archive:
+        for event in events:
+            archive.write(json.dumps(event) + "\n")
+        for line in extra_lines:
+            archive.write(line + "\n")
+
+
+class TestGHArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.archive = os.path.join(self.directory.name, "2024-01-01-0.json.gz")
+        _write_archive(self.archive, [
+            {"type": "WatchEvent", "actor": {"login": "userA"}, "repo": {"name": "owner/repo"},
+             "created_at": "2024-01-01T00:10:00Z"},
+            {"type": "PushEvent", "actor": {"login": "userA"}, "repo": {"name": "owner/other"},
+             "created_at": "2024-01-01T00:20:00Z"},
+            {"type": "WatchEvent", "actor": {"login": "userB"}, "repo": {"name": "owner/repo"},
+             "created_at": "2024-01-01T00:30:00Z"},
+            # Events before 2015 have another schema
+            {"type": "WatchEvent", "actor": "userB", "repository": {"owner": "owner", "name": "old"},
+             "created_at": "2014-01-01T00:00:00Z"},
+        ], extra_lines=('{"type": "WatchEvent", truncated',))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_parse_archive(self):
+        events, archived_until = parse_archive(self.archive)
+
+        self.assertEqual(events, [("userA", "owner/repo"), ("userB", "owner/repo"), ("userB", "owner/old")])
+        self.assertEqual(archived_until, "2024-01-01T00:30:00Z")
+
+    def test_ingest_archives(self):
+        corrupted = os.path.join(self.directory.name, "corrupted.json.gz")
+        with open(corrupted, "wb") as archive:
+            archive.write(b"not gzip")
+        graph = StarGraph(os.path.join(self.directory.name, "stargraph"))
+
+        appended = ingest_archives(graph, [self.archive, corrupted], workers=1)
+
+        self.assertEqual(appended, 3)
+        self.assertEqual(graph.compacted_edges, 3)
+        self.assertEqual(graph.archived_until, "2024-01-01T00:30:00Z")
+        self.assertEqual(graph.get_stargazers("owner/repo"), ["userA", "userB"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,11 @@
 import unittest
 from unittest.mock import patch, MagicMock
 
+import requests
 from github import Repository
 from github.NamedUser import NamedUser
 
-from src.services.github import get_stargazers, get_starred_repos_for_user
+from src.services.github import GitHubAPIException, get_stargazers, get_starred_repos_for_user, _safe_github_call
 
 
 class TestGitHubService(unittest.TestCase):
@@ -32,7 +33,7 @@ class TestGitHubService(unittest.TestCase):
         self.assertEqual(stargazers[0]["login"], "userA")
         self.assertEqual(stargazers[1]["id"], 2)
 
-    @patch('src.services.starneighbours.NamedUser.get_starred')
+    @patch('github.NamedUser.NamedUser.get_starred')
     def test_get_starred_repos_for_user(self, mock_get_starred):
         # Mock data for starred repositories
         mock_repo_1 = MagicMock(spec=Repository, full_name="owner/repo1")
@@ -53,6 +54,21 @@ class TestGitHubService(unittest.TestCase):
         mock_get_starred.assert_called_once()
         self.assertEqual(starred_repos, mock_starred_repos)
 
+    @patch('src.services.github.time.sleep')
+    def test_safe_github_call_wraps_transport_errors(self, mock_sleep):
+        func = MagicMock(__name__="get_rate_limit", side_effect=requests.exceptions.ConnectionError("unreachable"))
+
+        with patch('src.services.github.GITHUB_RETRIES', 2), \
+                patch('src.services.github.circuit_breaker') as mock_circuit_breaker:
+            with self.assertRaises(GitHubAPIException) as raised:
+                _safe_github_call(func)
+
+        self.assertEqual(raised.exception.code, 502)
+        # Calls without a response are retried like upstream errors
+        self.assertEqual(func.call_count, 3)
+        self.assertEqual(mock_sleep.call_count, 2)
+        self.assertEqual(mock_circuit_breaker.record_failure.call_count, 3)
+
 
 if __name__ == '__main__':
     unittest.main()
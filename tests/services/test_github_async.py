@@ -0,0 +1,260 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+
+import httpx
+
+from src.services.cache import CacheEntry, CachedPage, PagedResponseCache
+from src.services.github import GitHubAPIException, GITHUB_REQUESTS
+from src.services.github_async import (AsyncGitHubClient, Stargazer, StarredRepo, fetch_starred_repos,
+                                       get_starred_repos, get_stargazers_since, starred_cache_key)
+from src.services.resilience import CircuitBreaker, LatencyTracker, track_request_stats, LATENCY_MIN_SAMPLES
+from src.services.token_pool import TokenPool
+
+BASE_URL = "https://api.github.test"
+
+
+def _paginated_handler(pages: dict, requested: list):
+    """
+    Build a transport handler serving the given pages with GitHub-like Link headers.
+    """
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        page = int(request.url.params.get("page", 1))
+        requested.append(page)
+        path = request.url.path
+        if path not in pages:
+            return httpx.Response(404, json={"message": "Not Found"})
+        last = len(pages[path])
+        headers = {}
+        if last > 1:
+            headers["Link"] = (f'<{BASE_URL}{path}?per_page=100&page={min(page + 1, last)}>; rel="next", '
+                               f'<{BASE_URL}{path}?per_page=100&page={last}>; rel="last"')
+        return httpx.Response(200, json=pages[path][page - 1], headers=headers)
+
+    return handler
+
+
+class TestAsyncGitHubClient(unittest.IsolatedAsyncioTestCase):
+
+    async def test_get_all_pages(self):
+        requested = []
+        pages = {"/users/userA/starred": [
+            [{"full_name": "owner/repo1"}, {"full_name": "owner/repo2"}],
+            [{"full_name": "owner/repo3"}],
+            [{"full_name": "owner/repo4"}],
+        ]}
+        client = AsyncGitHubClient(pool=TokenPool.from_tokens(["token"]), base_url=BASE_URL,
+                                   transport=httpx.MockTransport(_paginated_handler(pages, requested)))
+        labels = {"client": "httpx", "endpoint": "/users/{login}/starred", "status": 200}
+        requests_before = GITHUB_REQUESTS.get(**labels)
+
+        items = await client.get_all_pages("/users/userA/starred")
+
+        self.assertEqual([item["full_name"] for item in items],
+                         ["owner/repo1", "owner/repo2", "owner/repo3", "owner/repo4"])
+        self.assertCountEqual(requested, [1, 2, 3])
+        self.assertEqual(GITHUB_REQUESTS.get(**labels) - requests_before, 3)
+        await client.aclose()
+
+    async def test_get_pages_revalidation(self):
+        requested = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            page = int(request.url.params.get("page", 1))
+            requested.append((page, request.headers.get("If-None-Match")))
+            links = {"Link": f'<{BASE_URL}/users/userA/starred?page=2>; rel="last"'}
+            if page == 1:
+                return httpx.Response(304, headers=links)
+            return httpx.Response(200, json=[{"full_name": "owner/repo3"}], headers={"ETag": '"new"'})
+
+        client = AsyncGitHubClient(pool=TokenPool.from_tokens(["token"]), base_url=BASE_URL,
+                                   transport=httpx.MockTransport(handler))
+        cached = CacheEntry(pages=[CachedPage('"p1"', ["owner/repo1"]), CachedPage('"p2"', ["owner/repo2"])])
+
+        entry = await client.get_pages("/users/userA/starred", project=lambda repo: repo["full_name"], cached=cached)
+
+        self.assertCountEqual(requested, [(1, '"p1"'), (2, '"p2"')])
+        self.assertEqual(entry.items, ["owner/repo1", "owner/repo3"])
+        self.assertEqual(entry.pages[1].etag, '"new"')
+        await client.aclose()
+
+    async def test_get_retries_after_secondary_rate_limit(self):
+        calls = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            calls.append(request)
+            if len(calls) == 1:
+                return httpx.Response(403, headers={"Retry-After": "0"}, json={"message": "secondary rate limit"})
+            return httpx.Response(200, json=[], headers={"X-RateLimit-Remaining": "4999",
+                                                         "X-RateLimit-Limit": "5000", "X-RateLimit-Reset": "1"})
+
+        pool = TokenPool.from_tokens(["token"])
+        client = AsyncGitHubClient(pool=pool, base_url=BASE_URL, transport=httpx.MockTransport(handler))
+
+        response = await client.get("/repos/owner/repo/stargazers")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(pool.primary.scheduler.remaining, 4999)
+        await client.aclose()
+
+    async def test_get_not_found(self):
+        client = AsyncGitHubClient(pool=TokenPool.from_tokens(["token"]), base_url=BASE_URL,
+                                   transport=httpx.MockTransport(_paginated_handler({}, [])))
+
+        with self.assertRaises(GitHubAPIException) as context:
+            await client.get_all_pages("/repos/owner/missing/stargazers")
+
+        self.assertEqual(context.exception.code, 404)
+        await client.aclose()
+
+    async def test_get_starred_repos_syncs_new_stars(self):
+        requested = []
+        starred = [{"starred_at": f"2024-01-01T{day // 60:02d}:{day % 60:02d}:00Z",
+                    "repo": {"full_name": f"owner/repo{day}", "stargazers_count": day}} for day in range(150, 0, -1)]
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            page = int(request.url.params.get("page", 1))
+            requested.append((page, request.headers["Accept"]))
+            links = {"Link": f'<{BASE_URL}/users/userA/starred?page=2>; rel="last"'}
+            return httpx.Response(200, json=starred[(page - 1) * 100:page * 100], headers=links)
+
+        client = AsyncGitHubClient(pool=TokenPool.from_tokens(["token"]), base_url=BASE_URL,
+                                   transport=httpx.MockTransport(handler))
+        cache = PagedResponseCache(max_entries=10, ttl=60)
+        # The cache knows the stars up to the 148th, stale
+        known = [[item["repo"]["full_name"], item["repo"]["stargazers_count"], item["starred_at"]]
+                 for item in starred[2:]]
+        cache.set(starred_cache_key("userA"), CacheEntry(pages=[CachedPage(None, known)], fetched_at=0,
+                                                         watermark=known[0][2]))
+
+        with patch('src.services.github_async.async_github', client), \
+                patch('src.services.github_async.starred_repos_cache', cache):
+            repos = await get_starred_repos("userA")
+
+        # Only the first page is fetched, and the new stars come first
+        self.assertEqual(requested, [(1, "application/vnd.github.star+json")])
+        self.assertEqual(len(repos), 150)
+        self.assertEqual(repos[:3], [StarredRepo("owner/repo150", 150), StarredRepo("owner/repo149", 149),
+                                     StarredRepo("owner/repo148", 148)])
+        self.assertEqual(cache.get(starred_cache_key("userA")).watermark, "2024-01-01T02:30:00Z")
+        await client.aclose()
+
+    async def test_fetch_starred_repos_caps_heavy_starrers(self):
+        requested = []
+        pages = {"/users/userA/starred": [
+            [{"starred_at": "2024-01-01T00:00:00Z", "repo": {"full_name": f"owner/repo{page}-{index}",
+                                                             "stargazers_count": 1}} for index in range(100)]
+            for page in range(1, 6)
+        ]}
+        client = AsyncGitHubClient(pool=TokenPool.from_tokens(["token"]), base_url=BASE_URL,
+                                   transport=httpx.MockTransport(_paginated_handler(pages, requested)))
+        cache = PagedResponseCache(max_entries=10, ttl=60)
+
+        with patch('src.services.github_async.async_github', client), \
+                patch('src.services.github_async.starred_repos_cache', cache), \
+                patch('src.services.github_async.HEAVY_STARRER_THRESHOLD', 200), \
+                patch('src.services.github_async.HEAVY_STARRER_STRATEGY', "cap"):
+            fetched = await fetch_starred_repos("userA")
+
+        # The length of the list is known from the first page, only the most recent stars are fetched
+        self.assertEqual(fetched.treatment, "capped")
+        self.assertEqual(sorted(requested), [1, 2])
+        self.assertEqual(len(fetched.repos), 200)
+        self.assertEqual(fetched.repos[0], StarredRepo("owner/repo1-0", 1))
+        # A partial list isn't cached
+        self.assertIsNone(cache.get(starred_cache_key("userA")))
+        await client.aclose()
+
+    async def test_get_retries_upstream_errors(self):
+        statuses = [502, 503]
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            if statuses:
+                return httpx.Response(statuses.pop(0), json={"message": "Bad Gateway"})
+            return httpx.Response(200, json={"full_name": "owner/repo"})
+
+        breaker = CircuitBreaker(failures=3, cooldown=60)
+        client = AsyncGitHubClient(pool=TokenPool.from_tokens(["token"]), base_url=BASE_URL,
+                                   transport=httpx.MockTransport(handler), breaker=breaker)
+
+        with patch('src.services.github_async.backoff_delay', return_value=0), track_request_stats() as stats:
+            response = await client.get("/repos/owner/repo")
+
+            self.assertEqual(response.json(), {"full_name": "owner/repo"})
+            self.assertEqual((stats.requests, stats.retries), (3, 2))
+
+            # Sustained errors open the circuit, requests then fail without reaching GitHub
+            statuses.extend([502] * 10)
+            with self.assertRaises(GitHubAPIException) as context:
+                await client.get("/repos/owner/repo")
+            self.assertEqual(context.exception.code, 503)
+            self.assertEqual(len(statuses), 7)
+        await client.aclose()
+
+    async def test_get_stargazers_since_skips_undated_stars(self):
+        def handler(request: httpx.Request) -> httpx.Response:
+            return httpx.Response(200, json=[{"login": "userA"},
+                                             {"user": {"login": "userB"}, "starred_at": "2024-01-02T00:00:00Z"}])
+
+        client = AsyncGitHubClient(pool=TokenPool.from_tokens(["token"]), base_url=BASE_URL,
+                                   transport=httpx.MockTransport(handler))
+        with patch('src.services.github_async.async_github', client):
+            newer = await get_stargazers_since("owner", "repo", "2024-01-01T00:00:00Z", 2)
+
+        self.assertEqual(newer, [Stargazer("userB", "2024-01-02T00:00:00Z")])
+        await client.aclose()
+
+    async def test_half_open_probe_is_released(self):
+        async def handler(request: httpx.Request) -> httpx.Response:
+            await asyncio.sleep(1)
+            return httpx.Response(200, json={"full_name": "owner/repo"})
+
+        breaker = CircuitBreaker(failures=1, cooldown=0)
+        breaker.record_failure()
+        client = AsyncGitHubClient(pool=TokenPool.from_tokens(["token"]), base_url=BASE_URL,
+                                   transport=httpx.MockTransport(handler), breaker=breaker)
+
+        probe = asyncio.create_task(client.get("/repos/owner/repo"))
+        await asyncio.sleep(0.05)
+        probe.cancel()
+        await asyncio.gather(probe, return_exceptions=True)
+        # The cancelled probe lets another request probe GitHub
+        self.assertEqual(breaker.state, "half-open")
+        self.assertTrue(breaker.check())
+        breaker.release_probe()
+
+        client.pool.tokens[0].disabled = True
+        with self.assertRaises(GitHubAPIException) as context:
+            await client.get("/repos/owner/repo")
+        self.assertEqual(context.exception.code, 503)
+        self.assertTrue(breaker.check())
+        await client.aclose()
+
+    async def test_get_hedges_slow_requests(self):
+        calls = []
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            calls.append(request)
+            if len(calls) == 1:
+                await asyncio.sleep(1)
+            return httpx.Response(200, json={"call": len(calls)})
+
+        latencies = LatencyTracker(percentile=0.5, budget=1)
+        for _ in range(LATENCY_MIN_SAMPLES):
+            latencies.observe("/repos/{owner}/{repo}", 0.01)
+        client = AsyncGitHubClient(pool=TokenPool.from_tokens(["token"]), base_url=BASE_URL,
+                                   transport=httpx.MockTransport(handler), latencies=latencies)
+
+        with track_request_stats() as stats:
+            response = await client.get("/repos/owner/repo")
+
+        # The duplicate answered first, the slow request was cancelled
+        self.assertEqual(response.json(), {"call": 2})
+        self.assertEqual(stats.hedges, 1)
+        await client.aclose()
+
+
+if __name__ == '__main__':
+    unittest.main()
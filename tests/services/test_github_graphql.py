@@ -0,0 +1,143 @@
+import asyncio
+import json
+import unittest
+from unittest.mock import patch
+
+import httpx
+
+from src.services.cache import PagedResponseCache
+from src.services.github import GitHubAPIException
+from src.services.github_async import AsyncGitHubClient, StarredFetch, StarredRepo, fetch_starred_repos
+from src.services.token_pool import TokenPool
+from src.services.github_graphql import iter_starred_repos, get_stargazer_logins
+
+BASE_URL = "https://api.github.test"
+
+
+class GraphQLStub:
+    """
+    Local stub of the GitHub GraphQL endpoint, serving starred repositories two by two. The REST endpoint of the
+    starred repositories serves them in a single page.
+    """
+
+    def __init__(self, starred: dict, stargazers: dict = None):
+        self.starred = starred
+        self.stargazers = stargazers or {}
+        self.queries = 0
+        self.rest_requests = 0
+
+    def _page(self, items: list, cursor: str, node):
+        start = int(cursor or 0)
+        return {
+            "totalCount": len(items),
+            "pageInfo": {"hasNextPage": start + 2 < len(items), "endCursor": str(start + 2)},
+            "nodes": [node(item) for item in items[start:start + 2]],
+        }
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        if request.method == "GET":
+            # The REST endpoint of the starred repositories, in a single page
+            self.rest_requests += 1
+            login = request.url.path.split("/")[2]
+            return httpx.Response(200, json=[{"full_name": repo, "stargazers_count": 42}
+                                             for repo in self.starred.get(login, [])])
+        self.queries += 1
+        body = json.loads(request.content)
+        variables = body["variables"]
+        if "repository(" in body["query"]:
+            name = f"{variables['owner']}/{variables['name']}"
+            if name not in self.stargazers:
+                return httpx.Response(200, json={"data": {"repository": None},
+                                                 "errors": [{"type": "NOT_FOUND", "message": "Not found"}]})
+            page = self._page(self.stargazers[name], variables["cursor"], lambda login: {"login": login})
+            return httpx.Response(200, json={"data": {"repository": {"stargazers": page}}})
+
+        data = {}
+        index = 0
+        while f"l{index}" in variables:
+            login = variables[f"l{index}"]
+            if login in self.starred:
+                page = self._page(self.starred[login], variables[f"c{index}"],
+                                  lambda repo: {"nameWithOwner": repo, "stargazerCount": 42})
+                data[f"u{index}"] = {"starredRepositories": page}
+            else:
+                data[f"u{index}"] = None
+            index += 1
+        return httpx.Response(200, json={"data": data})
+
+
+class TestGitHubGraphQL(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.stub = GraphQLStub(
+            starred={
+                "userA": ["owner/repo1", "owner/repo2", "owner/repo3"],
+                "userB": ["owner/repo1"],
+            },
+            stargazers={"owner/repo": ["userA", "userB", "userC"]},
+        )
+        client = AsyncGitHubClient(pool=TokenPool.from_tokens(["token"]), base_url=BASE_URL,
+                                   transport=httpx.MockTransport(self.stub.handler))
+        cache = PagedResponseCache(max_entries=10, ttl=60)
+        self.patchers = [
+            patch('src.services.github_graphql.async_github', client),
+            patch('src.services.github_async.async_github', client),
+            patch('src.services.github_graphql.starred_repos_cache', cache),
+            patch('src.services.github_async.starred_repos_cache', cache),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    async def test_iter_starred_repos(self):
+        starred = [login async for login, _ in iter_starred_repos(["userA", "userB", "ghost"])]
+        # Lists are yielded as soon as they are complete, userA needs a second page
+        self.assertEqual(starred[-1], "userA")
+
+        starred = {login: fetched async for login, fetched in iter_starred_repos(["userA", "userB", "ghost"])}
+        self.assertEqual([repo.full_name for repo in starred["userA"].repos],
+                         ["owner/repo1", "owner/repo2", "owner/repo3"])
+        self.assertEqual(starred["userB"], StarredFetch([StarredRepo("owner/repo1", 42)], "full"))
+        self.assertEqual(starred["ghost"], StarredFetch([], "full"))
+        # One query for the three users, then one for the second page of userA only, the lists are then cached
+        self.assertEqual(self.stub.queries, 2)
+
+    async def test_iter_starred_repos_caps_lists(self):
+        starred = {login: fetched async for login, fetched in iter_starred_repos(["userA", "userB"], max_items=2)}
+
+        self.assertEqual(starred["userA"],
+                         StarredFetch([StarredRepo("owner/repo1", 42), StarredRepo("owner/repo2", 42)], "capped"))
+        self.assertEqual(self.stub.queries, 1)
+
+        with patch('src.services.github_graphql.HEAVY_STARRER_THRESHOLD', 2):
+            starred = {login: fetched async for login, fetched in iter_starred_repos(["userA"])}
+        self.assertEqual(starred["userA"].treatment, "capped")
+        self.assertEqual(len(starred["userA"].repos), 2)
+        self.assertEqual(self.stub.queries, 2)
+
+    async def test_iter_starred_repos_joins_flights(self):
+        rest = asyncio.create_task(fetch_starred_repos("userB"))
+        await asyncio.sleep(0)
+        starred = {login: fetched async for login, fetched in iter_starred_repos(["userA", "userB"])}
+
+        self.assertEqual(starred["userB"], await rest)
+        # userB was fetched by the REST call in flight, only userA was queried
+        self.assertEqual((self.stub.queries, self.stub.rest_requests), (2, 1))
+
+    async def test_get_stargazer_logins(self):
+        logins = await get_stargazer_logins("owner", "repo")
+
+        self.assertEqual(logins, ["userA", "userB", "userC"])
+
+    async def test_get_stargazer_logins_not_found(self):
+        with self.assertRaises(GitHubAPIException) as context:
+            await get_stargazer_logins("owner", "missing")
+
+        self.assertEqual(context.exception.code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
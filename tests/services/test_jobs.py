@@ -0,0 +1,89 @@
+import unittest
+from unittest.mock import patch
+
+from src.services.github import GitHubAPIException
+from src.services.github_async import StarredRepo
+from src.services.jobs import JobManager, JobStore, DONE, FAILED
+from src.services.scoring import NeighbourScorer
+
+OPTIONS = {"limit": 10, "min_shared": 1, "metric": "overlap"}
+STARRED_REPOS = {
+    "userA": [StarredRepo("owner/repo1", 10), StarredRepo("owner/repo2", 5)],
+    "userB": [StarredRepo("owner/repo1", 10)],
+}
+
+
+async def _iter_starred_repos(stargazers):
+    for stargazer in stargazers:
+        yield stargazer, STARRED_REPOS[stargazer]
+
+
+class TestJobManager(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.store = JobStore(":memory:")
+        self.manager = JobManager(self.store, max_workers=1, checkpoint_interval=1)
+
+    @patch('src.services.jobs.iter_starred_repos', side_effect=_iter_starred_repos)
+    @patch('src.services.jobs.get_stargazers')
+    async def test_submit(self, mock_get_stargazers, mock_iter_starred_repos):
+        mock_get_stargazers.return_value = ["userA", "userB"]
+
+        job = self.manager.submit("owner", "repo", OPTIONS)
+        # Submitting the same computation again returns the same job
+        self.assertEqual(self.manager.submit("owner", "repo", OPTIONS)["id"], job["id"])
+        await self.manager.wait(job["id"])
+
+        job = self.manager.get(job["id"])
+        self.assertEqual(job["status"], DONE)
+        self.assertEqual(job["progress"], {"processed": 2, "total": 2})
+        self.assertEqual([neighbour["repo"] for neighbour in job["result"]], ["owner/repo1", "owner/repo2"])
+        self.assertIsNone(self.store.get_checkpoint(job["id"]))
+
+    @patch('src.services.jobs.iter_starred_repos', side_effect=_iter_starred_repos)
+    @patch('src.services.jobs.get_stargazers')
+    async def test_resume_from_checkpoint(self, mock_get_stargazers, mock_iter_starred_repos):
+        job_id = self.store.create("owner", "repo", OPTIONS)["id"]
+        scorer = NeighbourScorer("owner/repo", ["userA", "userB"])
+        scorer.add_starred("userA", STARRED_REPOS["userA"])
+        self.store.update(job_id, checkpoint=scorer.to_state())
+
+        await self.manager.start()
+        await self.manager.wait(job_id)
+
+        # Only the stargazer that wasn't processed is fetched
+        mock_get_stargazers.assert_not_called()
+        mock_iter_starred_repos.assert_called_once_with(["userB"])
+        job = self.manager.get(job_id)
+        self.assertEqual(job["status"], DONE)
+        self.assertEqual(job["result"][0], {"repo": "owner/repo1", "stargazers": ["userA", "userB"], "shared": 2,
+                                            "score": 2})
+
+    @patch('src.services.jobs.get_stargazers')
+    async def test_failed_job(self, mock_get_stargazers):
+        mock_get_stargazers.side_effect = GitHubAPIException("Not Found", code=404)
+
+        job = self.manager.submit("owner", "missing", OPTIONS)
+        await self.manager.wait(job["id"])
+
+        job = self.manager.get(job["id"])
+        self.assertEqual(job["status"], FAILED)
+        self.assertEqual(job["error"], "Not Found")
+
+    @patch('src.services.jobs.iter_starred_repos')
+    @patch('src.services.jobs.get_stargazers')
+    async def test_job_failing_unexpectedly(self, mock_get_stargazers, mock_iter_starred_repos):
+        mock_get_stargazers.return_value = ["userA"]
+        mock_iter_starred_repos.side_effect = RuntimeError("Unexpected")
+
+        job = self.manager.submit("owner", "repo", OPTIONS)
+        await self.manager.wait(job["id"])
+
+        # The job doesn't stay running forever
+        job = self.manager.get(job["id"])
+        self.assertEqual(job["status"], FAILED)
+        self.assertEqual(job["error"], "Internal error.")
+
+
+if __name__ == '__main__':
+    unittest.main()
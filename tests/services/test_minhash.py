@@ -0,0 +1,92 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from src.services.minhash import MinHashIndex, save_index
+
+
+class TestMinHashIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = MinHashIndex(num_perm=128, bands=64)
+        self.index.update("owner/repo", [f"user{i}" for i in range(100)])
+        self.index.update("owner/close", [f"user{i}" for i in range(20, 120)])
+        self.index.update("owner/far", [f"other{i}" for i in range(100)])
+
+    def test_neighbours_estimate_jaccard(self):
+        neighbours = self.index.neighbours("owner/repo", limit=10)
+
+        # 80 shared stargazers out of 120
+        self.assertEqual([neighbour["repo"] for neighbour in neighbours], ["owner/close"])
+        self.assertAlmostEqual(neighbours[0]["score"], 80 / 120, delta=0.15)
+        self.assertAlmostEqual(neighbours[0]["estimatedShared"], 80, delta=15)
+
+    def test_neighbours_of_unknown_repository(self):
+        self.assertIsNone(self.index.neighbours("owner/unknown", limit=10))
+
+    def test_update_merges_stargazers(self):
+        self.index.update("owner/far", [f"user{i}" for i in range(100)])
+
+        # 100 shared stargazers out of 200
+        neighbours = {neighbour["repo"]: neighbour for neighbour in self.index.neighbours("owner/repo", limit=10)}
+        self.assertAlmostEqual(neighbours["owner/far"]["score"], 0.5, delta=0.15)
+
+    def test_update_with_new_stargazers_only(self):
+        self.index.update("owner/repo", [f"user{i}" for i in range(100, 120)], count=120)
+
+        # 100 shared stargazers out of 120
+        neighbours = {neighbour["repo"]: neighbour for neighbour in self.index.neighbours("owner/repo", limit=10)}
+        self.assertAlmostEqual(neighbours["owner/close"]["estimatedShared"], 100, delta=15)
+        self.assertEqual(int(self.index._counts[0]), 120)
+
+    def test_arrays_grow_geometrically(self):
+        for i in range(100):
+            self.index.update(f"owner/repo{i}", [f"user{i}"])
+
+        self.assertEqual(len(self.index), 103)
+        self.assertEqual(len(self.index._counts), 128)
+
+    def test_signature_is_the_minimum_of_subsets(self):
+        logins = [f"user{i}" for i in range(50)]
+        union = np.minimum(self.index.signature(logins[:25]), self.index.signature(logins[25:]))
+
+        np.testing.assert_array_equal(self.index.signature(logins), union)
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "minhash.idx")
+            self.index.save(path)
+
+            loaded = MinHashIndex.load(path)
+            self.assertEqual(len(loaded), 3)
+            self.assertEqual(loaded.neighbours("owner/repo", limit=10), self.index.neighbours("owner/repo", limit=10))
+
+            # The memory-mapped index can still be updated
+            loaded.update("owner/repo", ["newUser"])
+            self.assertIn("owner/repo", loaded)
+            del loaded
+
+    def test_save_merges_the_workers_indexes(self):
+        other = MinHashIndex(num_perm=128, bands=64)
+        other.update("owner/other", [f"user{i}" for i in range(100)])
+        other.update("owner/repo", [f"user{i}" for i in range(100, 150)], count=150)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "minhash.idx")
+            with patch('src.services.minhash.minhash_index', self.index):
+                save_index(path)
+            with patch('src.services.minhash.minhash_index', other):
+                save_index(path)
+
+            loaded = MinHashIndex.load(path)
+            self.assertEqual(len(loaded), 4)
+            self.assertEqual(int(loaded._counts[loaded._ids["owner/repo"]]), 150)
+            self.assertEqual(os.listdir(directory), ["minhash.idx"])
+            del loaded
+
+
+if __name__ == '__main__':
+    unittest.main()
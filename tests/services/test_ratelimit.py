@@ -0,0 +1,57 @@
+import time
+import unittest
+
+from src.services.ratelimit import RateLimitScheduler, RateLimitExceeded, INTERACTIVE, BACKGROUND, \
+    background_priority, request_priority
+
+
+class TestRateLimitScheduler(unittest.TestCase):
+
+    def test_token_bucket_paces_requests(self):
+        scheduler = RateLimitScheduler(rate=10, burst=2)
+        self.assertEqual(scheduler.reserve(), 0)
+        self.assertEqual(scheduler.reserve(), 0)
+        # The bucket is empty, the third request waits for a token
+        self.assertGreater(scheduler.reserve(), 0)
+
+    def test_background_keeps_reserve_for_interactive(self):
+        scheduler = RateLimitScheduler(rate=1000, burst=1000, background_reserve=0.2, max_wait=60)
+        scheduler.update({"X-RateLimit-Remaining": "10", "X-RateLimit-Limit": "100",
+                          "X-RateLimit-Reset": str(int(time.time()) + 30)})
+
+        self.assertEqual(scheduler.reserve(INTERACTIVE), 0)
+        self.assertGreater(scheduler.reserve(BACKGROUND), 0)
+
+    def test_interactive_fails_fast_when_budget_spent(self):
+        scheduler = RateLimitScheduler(max_wait=60)
+        scheduler.update({"X-RateLimit-Remaining": "0", "X-RateLimit-Limit": "5000",
+                          "X-RateLimit-Reset": str(int(time.time()) + 600)})
+
+        with self.assertRaises(RateLimitExceeded):
+            scheduler.reserve(INTERACTIVE)
+        self.assertGreater(scheduler.reserve(BACKGROUND), 500)
+
+    def test_backoff_on_secondary_rate_limit(self):
+        scheduler = RateLimitScheduler(max_wait=60)
+
+        self.assertIsNone(scheduler.backoff(404, {}))
+        self.assertIsNone(scheduler.backoff(403, {"X-RateLimit-Remaining": "12"}))
+        self.assertEqual(scheduler.backoff(403, {"retry-after": "5"}), 5)
+        self.assertGreater(scheduler.reserve(), 4)
+
+    def test_out_of_order_responses_keep_lowest_remaining(self):
+        scheduler = RateLimitScheduler()
+        reset = str(int(time.time()) + 600)
+        scheduler.update({"X-RateLimit-Remaining": "40", "X-RateLimit-Limit": "5000", "X-RateLimit-Reset": reset})
+        scheduler.update({"X-RateLimit-Remaining": "42", "X-RateLimit-Limit": "5000", "X-RateLimit-Reset": reset})
+
+        self.assertEqual(scheduler.get_remaining_budget(), 40)
+
+    def test_background_priority(self):
+        with background_priority():
+            self.assertEqual(request_priority.get(), BACKGROUND)
+        self.assertEqual(request_priority.get(), INTERACTIVE)
+
+
+if __name__ == '__main__':
+    unittest.main()
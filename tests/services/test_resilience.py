@@ -0,0 +1,64 @@
+import time
+import unittest
+
+from src.services.resilience import (CircuitBreaker, CircuitOpen, LatencyTracker, backoff_delay, track_request_stats,
+                                     record, LATENCY_MIN_SAMPLES)
+
+
+class TestResilience(unittest.TestCase):
+
+    def test_backoff_delay(self):
+        delays = [backoff_delay(attempt, base=0.5, cap=2) for attempt in range(5) for _ in range(20)]
+
+        self.assertTrue(all(0 <= delay <= 2 for delay in delays))
+        self.assertTrue(all(delay <= 0.5 for delay in delays[:20]))
+
+    def test_circuit_breaker(self):
+        breaker = CircuitBreaker(failures=2, cooldown=0.05)
+        breaker.record_failure()
+        breaker.check()
+        breaker.record_failure()
+
+        self.assertEqual(breaker.state, "open")
+        with self.assertRaises(CircuitOpen):
+            breaker.check()
+
+        time.sleep(0.06)
+        # A single request probes GitHub once the cooldown is over
+        breaker.check()
+        with self.assertRaises(CircuitOpen):
+            breaker.check()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+
+        time.sleep(0.06)
+        self.assertTrue(breaker.check())
+        # A probe released without an answer lets another request probe
+        breaker.release_probe()
+        self.assertTrue(breaker.check())
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+        self.assertFalse(breaker.check())
+
+    def test_latency_tracker(self):
+        tracker = LatencyTracker(percentile=0.9, budget=0.5)
+        self.assertIsNone(tracker.hedge_delay("/users/{login}/starred"))
+        for index in range(LATENCY_MIN_SAMPLES * 2):
+            tracker.observe("/users/{login}/starred", index / 100)
+
+        self.assertEqual(tracker.hedge_delay("/users/{login}/starred"), 0.9)
+        # Two requests so far, so a single hedge fits in the budget
+        self.assertTrue(tracker.acquire_hedge())
+        self.assertFalse(tracker.acquire_hedge())
+
+    def test_track_request_stats(self):
+        record(requests=1)
+        with track_request_stats() as stats:
+            record(requests=2, retries=1)
+            record(hedges=1)
+
+        self.assertEqual((stats.requests, stats.retries, stats.hedges), (2, 1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
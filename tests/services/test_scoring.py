@@ -0,0 +1,69 @@
+import unittest
+
+from src.services.github_async import StarredRepo
+from src.services.scoring import NeighbourScorer
+
+
+class TestNeighbourScorer(unittest.TestCase):
+
+    def setUp(self):
+        self.scorer = NeighbourScorer("owner/repo", ["userA", "userB", "userC"])
+        self.scorer.add_starred("userA", [StarredRepo("owner/repo", 3), StarredRepo("owner/popular", 1000),
+                                          StarredRepo("owner/niche", 2)])
+        self.scorer.add_starred("userB", [StarredRepo("owner/popular", 1000), StarredRepo("owner/niche", 2)])
+        self.scorer.add_starred("userC", [StarredRepo("owner/popular", 1000)])
+
+    def test_top_k_by_overlap(self):
+        neighbours = self.scorer.top_k(limit=10)
+
+        self.assertEqual([neighbour["repo"] for neighbour in neighbours], ["owner/popular", "owner/niche"])
+        self.assertEqual(neighbours[0]["shared"], 3)
+        self.assertCountEqual(neighbours[1]["stargazers"], ["userA", "userB"])
+
+    def test_top_k_by_jaccard(self):
+        neighbours = self.scorer.top_k(limit=10, metric="jaccard")
+
+        # niche: 2 / (3 + 2 - 2), popular: 3 / (3 + 1000 - 3)
+        self.assertEqual([neighbour["repo"] for neighbour in neighbours], ["owner/niche", "owner/popular"])
+        self.assertAlmostEqual(neighbours[0]["score"], 2 / 3)
+
+    def test_top_k_limit_and_min_shared(self):
+        self.assertEqual(len(self.scorer.top_k(limit=1)), 1)
+        self.assertEqual([neighbour["repo"] for neighbour in self.scorer.top_k(limit=10, min_shared=3)],
+                         ["owner/popular"])
+
+    def test_add_starred_twice_is_ignored(self):
+        self.scorer.add_starred("userC", [StarredRepo("owner/popular", 1000)])
+
+        self.assertEqual(self.scorer.top_k(limit=1)[0]["shared"], 3)
+
+    def test_approximate_scores_are_scaled(self):
+        scorer = NeighbourScorer("owner/repo", ["userA", "userB"], population=100)
+        scorer.add_starred("userA", [StarredRepo("owner/popular", 1000)])
+
+        neighbour = scorer.top_k(limit=1)[0]
+
+        self.assertTrue(scorer.approximate)
+        self.assertEqual((neighbour["shared"], neighbour["score"], neighbour["estimatedShared"]), (1, 50, 50))
+        low, high = neighbour["confidenceInterval"]
+        self.assertTrue(1 <= low < 50 < high <= 99)
+
+    def test_estimate_is_exact_without_sampling(self):
+        self.assertFalse(self.scorer.approximate)
+        self.assertEqual(self.scorer.estimate(2), (2, (2, 2)))
+        self.assertNotIn("estimatedShared", self.scorer.top_k(limit=1)[0])
+
+    def test_remove_and_add_stargazers(self):
+        self.scorer.remove_stargazers(["userA"])
+        self.scorer.add_stargazers(["userD"])
+        self.scorer.add_starred("userD", [StarredRepo("owner/niche", 2)])
+
+        neighbours = {neighbour["repo"]: neighbour for neighbour in self.scorer.top_k(limit=10)}
+        self.assertEqual(self.scorer.logins, ["userB", "userC", "userD"])
+        self.assertCountEqual(neighbours["owner/popular"]["stargazers"], ["userB", "userC"])
+        self.assertCountEqual(neighbours["owner/niche"]["stargazers"], ["userB", "userD"])
+        self.assertFalse(self.scorer.approximate)
+
+
+if __name__ == '__main__':
+    unittest.main()
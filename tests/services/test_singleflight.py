@@ -0,0 +1,73 @@
+import asyncio
+import unittest
+
+from src.services.singleflight import SingleFlight
+
+
+class TestSingleFlight(unittest.IsolatedAsyncioTestCase):
+
+    async def test_concurrent_calls_are_coalesced(self):
+        flight = SingleFlight("test")
+        calls = []
+
+        async def fetch(value: str) -> str:
+            calls.append(value)
+            await asyncio.sleep(0.01)
+            return value.upper()
+
+        results = await asyncio.gather(flight.do("a", lambda: fetch("a")), flight.do("a", lambda: fetch("a")),
+                                       flight.do("b", lambda: fetch("b")))
+
+        self.assertEqual(results, ["A", "A", "B"])
+        self.assertEqual(calls, ["a", "b"])
+        self.assertEqual(flight.get_stats(), {"name": "test", "calls": 3, "coalesced": 1, "inFlight": 0})
+
+        # Once done, the call isn't reused
+        self.assertEqual(await flight.do("a", lambda: fetch("a")), "A")
+        self.assertEqual(calls, ["a", "b", "a"])
+
+    async def test_exceptions_are_shared(self):
+        flight = SingleFlight("test")
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("failed")
+
+        results = await asyncio.gather(flight.do("a", fail), flight.do("a", fail), return_exceptions=True)
+
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+        self.assertEqual(flight.coalesced, 1)
+
+    async def test_cancelled_caller_doesnt_cancel_the_call(self):
+        flight = SingleFlight("test")
+
+        async def fetch():
+            await asyncio.sleep(0.01)
+            return "done"
+
+        first = asyncio.ensure_future(flight.do("a", fetch))
+        second = asyncio.ensure_future(flight.do("a", fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+
+        self.assertEqual(await second, "done")
+
+    async def test_join_tells_the_leader(self):
+        flight = SingleFlight("test")
+        led = []
+
+        def lead(value: str):
+            async def fetch():
+                led.append(value)
+                return value.upper()
+            return fetch
+
+        first, second = flight.join("a", lead("first")), flight.join("a", lead("second"))
+
+        self.assertIs(first, second)
+        self.assertEqual((await first, led), ("FIRST", ["first"]))
+        self.assertEqual(flight.coalesced, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
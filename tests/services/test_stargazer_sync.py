@@ -0,0 +1,59 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from src.services.github_async import Stargazer
+from src.services.stargazer_sync import StargazerStore, sync_stargazers
+
+
+class TestStargazerSync(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = StargazerStore(os.path.join(self.directory.name, "stargazers.db"))
+        self.store.set_stargazers("owner/repo", ["userA", "userB"], "2024-01-02T00:00:00Z")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    @patch('src.services.stargazer_sync.github_async.get_stargazers')
+    @patch('src.services.stargazer_sync.github_async.get_stargazers_since')
+    @patch('src.services.stargazer_sync.github_async.get_repository')
+    async def test_sync_fetches_new_stars_only(self, mock_get_repository, mock_get_stargazers_since,
+                                               mock_get_stargazers):
+        mock_get_repository.return_value = {"stargazers_count": 3}
+        mock_get_stargazers_since.return_value = [Stargazer("userC", "2024-01-03T00:00:00Z")]
+
+        delta = await sync_stargazers("owner", "repo", self.store)
+
+        mock_get_stargazers_since.assert_awaited_once_with("owner", "repo", "2024-01-02T00:00:00Z", 3)
+        mock_get_stargazers.assert_not_awaited()
+        self.assertEqual((delta.stargazers, delta.added, delta.removed, delta.incremental),
+                         (["userA", "userB", "userC"], ["userC"], [], True))
+        self.assertEqual(self.store.get_stargazers("owner/repo"),
+                         (["userA", "userB", "userC"], "2024-01-03T00:00:00Z"))
+
+    @patch('src.services.stargazer_sync.github_async.get_stargazers')
+    @patch('src.services.stargazer_sync.github_async.get_stargazers_since')
+    @patch('src.services.stargazer_sync.github_async.get_repository')
+    async def test_sync_detects_unstars(self, mock_get_repository, mock_get_stargazers_since, mock_get_stargazers):
+        mock_get_repository.return_value = {"stargazers_count": 2}
+        mock_get_stargazers_since.return_value = [Stargazer("userC", "2024-01-03T00:00:00Z")]
+        mock_get_stargazers.return_value = [Stargazer("userB", "2024-01-02T00:00:00Z"),
+                                            Stargazer("userC", "2024-01-03T00:00:00Z")]
+
+        delta = await sync_stargazers("owner", "repo", self.store)
+
+        self.assertEqual((delta.stargazers, delta.added, delta.removed, delta.incremental),
+                         (["userB", "userC"], ["userC"], ["userA"], False))
+
+    def test_aggregates_expire(self):
+        self.store.set_aggregates("owner/repo", {"repository": "owner/repo"}, computed_at=0)
+
+        self.assertIsNone(self.store.get_aggregates("owner/repo"))
+        self.assertEqual(self.store.get_aggregates("owner/repo", max_age=float("inf")), {"repository": "owner/repo"})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import tempfile
+import unittest
+
+from src.services.github_async import StarredRepo
+from src.services.stargraph import StarGraph
+
+
+class TestStarGraph(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.graph = StarGraph(self.directory.name)
+        starred = [StarredRepo("owner/repo", 3), StarredRepo("owner/popular", 1000), StarredRepo("owner/niche", 2)]
+        self.graph.ingest([("userA", starred), ("userB", starred), ("userC", starred[:2])])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_ingest_skips_known_edges(self):
+        appended = self.graph.ingest([("userC", [StarredRepo("owner/popular", 1001), StarredRepo("owner/niche", 2)])])
+
+        self.assertEqual(appended, 1)
+        self.assertEqual(self.graph.edges_count, 9)
+        self.assertEqual(self.graph.get_starred("userC"), [StarredRepo("owner/repo", 3),
+                                                           StarredRepo("owner/popular", 1001),
+                                                           StarredRepo("owner/niche", 2)])
+
+    def test_compact_and_reopen(self):
+        self.graph.compact()
+        self.graph.ingest([("userD", [StarredRepo("owner/niche", 2)])])
+
+        reopened = StarGraph(self.directory.name)
+        self.assertEqual((reopened.users_count, reopened.repos_count, reopened.edges_count), (4, 3, 9))
+        self.assertEqual(reopened.compacted_edges, 8)
+        self.assertEqual(reopened.get_stargazers("owner/niche"), ["userA", "userB", "userD"])
+        self.assertEqual(reopened.get_starred("userA"), self.graph.get_starred("userA"))
+
+    def test_refresh(self):
+        reader = StarGraph(self.directory.name)
+        self.graph.ingest([("userD", [StarredRepo("owner/new", 1)])])
+        self.graph.compact()
+        self.graph.ingest([("userE", [StarredRepo("owner/new", 2)])])
+
+        self.assertEqual(reader.get_stargazers("owner/new"), [])
+        reader.refresh()
+        self.assertEqual((reader.users_count, reader.repos_count, reader.edges_count), (5, 4, 10))
+        self.assertEqual(reader.compacted_edges, 9)
+        self.assertEqual(reader.get_stargazers("owner/new"), ["userD", "userE"])
+        self.assertEqual(reader.get_starred("userE"), [StarredRepo("owner/new", 2)])
+        reader.refresh()
+        self.assertEqual(reader.edges_count, 10)
+
+    def test_writers_share_ids(self):
+        other = StarGraph(self.directory.name)
+        self.graph.ingest([("userD", [StarredRepo("owner/new", 1)])])
+        # The second writer catches up before appending, so it doesn't give userD's ID to userE
+        other.ingest([("userE", [StarredRepo("owner/other", 1), StarredRepo("owner/new", 1)])])
+        other.compact()
+
+        reopened = StarGraph(self.directory.name)
+        self.assertEqual(reopened.users_count, 5)
+        self.assertEqual(reopened.get_starred("userD"), [StarredRepo("owner/new", 1)])
+        self.assertEqual(reopened.get_stargazers("owner/new"), ["userD", "userE"])
+        self.assertTrue(self.graph._writer_lock.try_acquire())
+        self.assertFalse(other._writer_lock.try_acquire())
+        self.graph._writer_lock.release()
+
+    def test_ingest_events(self):
+        appended = self.graph.ingest_events([("userA", "owner/repo"), ("userD", "owner/repo"), ("userD", "owner/new")],
+                                            archived_until="2024-01-01T00:00:00Z")
+
+        self.assertEqual(appended, 2)
+        # The number of stargazers of a repository isn't known from the events
+        self.assertEqual(self.graph.get_starred("userD"), [StarredRepo("owner/repo", 3), StarredRepo("owner/new", 0)])
+        self.graph.ingest_events([], archived_until="2023-01-01T00:00:00Z")
+
+        reopened = StarGraph(self.directory.name)
+        self.assertEqual(reopened.archived_until, "2024-01-01T00:00:00Z")
+        self.assertEqual(reopened.fetched_at[3], 0.0)
+        self.assertEqual(reopened.get_stargazers("owner/new"), ["userD"])
+
+
+if __name__ == '__main__':
+    unittest.main()
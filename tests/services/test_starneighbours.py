@@ -1,45 +1,278 @@
+import asyncio
+import os
+import tempfile
+import time
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch
 
-from src.services.starneighbours import get_repository_neighbours
+from src.services.github_async import Stargazer, StarredFetch, StarredRepo
+from src.services.stargazer_sync import StargazerDelta, StargazerStore
+from src.services.stargraph import StarGraph
+from src.services.cache import ResultCache
+from src.services.github import GitHubAPIException
+from src.services.starneighbours import (get_repository_neighbours, get_repository_neighbours_entry,
+                                         get_repository_neighbours_result, iter_batch_neighbours,
+                                         iter_repository_neighbours, neighbours_cache, refresh_repository_neighbours,
+                                         Sampling,
+                                         NEIGHBOURS_NEGATIVE_CACHE_TTL, _revalidating)
 
 
-class TestGitHubService(unittest.TestCase):
+class TestGitHubService(unittest.IsolatedAsyncioTestCase):
 
-    @patch('src.services.starneighbours.get_stargazers')
-    @patch('src.services.starneighbours.get_starred_repos_for_user')
-    def test_get_repository_neighbours(self, mock_get_starred_repos_for_user, mock_get_stargazers):
-        mock_stargazers = [
-            MagicMock(login="userA"),
-            MagicMock(login="userB")
-        ]
-        mock_repo_1 = MagicMock(full_name="owner/repo1")
-        mock_repo_2 = MagicMock(full_name="owner/repo2")
-        mock_starred_repos = [mock_repo_1, mock_repo_2]
+    def setUp(self):
+        neighbours_cache.clear()
 
-        mock_get_stargazers.return_value = mock_stargazers
-        mock_get_starred_repos_for_user.return_value = mock_starred_repos
+    @patch('src.services.starneighbours.github_async.get_stargazer_logins')
+    @patch('src.services.starneighbours.github_async.fetch_starred_repos')
+    async def test_get_repository_neighbours(self, mock_fetch_starred_repos, mock_get_stargazer_logins):
+        mock_stargazers = ["userA", "userB"]
+        mock_starred_repos = {
+            "userA": [StarredRepo("owner/repo", 2), StarredRepo("owner/repo1", 10), StarredRepo("owner/repo2", 2)],
+            "userB": [StarredRepo("owner/repo", 2), StarredRepo("owner/repo2", 2)],
+        }
+
+        mock_get_stargazer_logins.return_value = mock_stargazers
+        mock_fetch_starred_repos.side_effect = lambda login, max_items=None: StarredFetch(mock_starred_repos[login])
 
         owner = "owner"
         repo = "repo"
-        neighbours = get_repository_neighbours(owner, repo)
+        neighbours = await get_repository_neighbours(owner, repo)
+
+        mock_get_stargazer_logins.assert_awaited_once_with(owner, repo)
+        mock_fetch_starred_repos.assert_any_await("userA", max_items=None)
+        mock_fetch_starred_repos.assert_any_await("userB", max_items=None)
+
+        # The repository itself isn't a neighbour, and neighbours are ranked by shared stargazers
+        self.assertEqual([neighbour["repo"] for neighbour in neighbours], ["owner/repo2", "owner/repo1"])
+        self.assertCountEqual(neighbours[0]["stargazers"], ["userA", "userB"])
+        self.assertEqual(neighbours[1]["stargazers"], ["userA"])
+
+        neighbours = await get_repository_neighbours(owner, repo, min_shared=2)
+        self.assertEqual([neighbour["repo"] for neighbour in neighbours], ["owner/repo2"])
+
+    @patch('src.services.starneighbours.github_async.get_stargazer_logins')
+    @patch('src.services.starneighbours.github_async.fetch_starred_repos')
+    async def test_iter_repository_neighbours(self, mock_fetch_starred_repos, mock_get_stargazer_logins):
+        mock_get_stargazer_logins.return_value = ["userA", "userB"]
+        mock_fetch_starred_repos.return_value = StarredFetch([StarredRepo("owner/repo1", 10)])
+
+        frames = [frame async for frame in iter_repository_neighbours("owner", "repo", progress_frames=2)]
+
+        self.assertEqual([frame["type"] for frame in frames], ["stargazers", "progress", "result"])
+        self.assertEqual(frames[1]["processed"], 1)
+        self.assertEqual(frames[1]["neighbours"][0]["shared"], 1)
+        self.assertEqual(frames[2]["neighbours"][0]["shared"], 2)
+
+    @patch('src.services.starneighbours.is_leader', return_value=True)
+    @patch('src.services.starneighbours.github_async.get_stargazer_logins')
+    @patch('src.services.starneighbours.github_async.fetch_starred_repos')
+    async def test_get_repository_neighbours_reads_the_star_graph(self, mock_fetch_starred_repos,
+                                                                  mock_get_stargazer_logins, _):
+        mock_get_stargazer_logins.return_value = ["userA", "userB", "userC"]
+        mock_fetch_starred_repos.return_value = StarredFetch([StarredRepo("owner/repo1", 10)])
+
+        with tempfile.TemporaryDirectory() as directory:
+            graph = StarGraph(directory)
+            graph.ingest([("userA", [StarredRepo("owner/repo1", 10)])])
+            graph.ingest([("userB", [StarredRepo("owner/repo2", 10)])], fetched_at=time.time() - 2 * 86400)
+            users_size = os.path.getsize(os.path.join(directory, "users.tsv"))
+            with patch('src.services.starneighbours.star_graph', graph):
+                neighbours = await get_repository_neighbours("owner", "repo")
+
+            # The fresh list of userA is read from the star graph, the stale one of userB is fetched again
+            self.assertEqual(sorted(call.args[0] for call in mock_fetch_starred_repos.await_args_list),
+                             ["userB", "userC"])
+            self.assertEqual(neighbours[0]["stargazers"], ["userA", "userB", "userC"])
+            # Only the fetched lists are stored
+            with open(os.path.join(directory, "users.tsv")) as users:
+                users.seek(users_size)
+                self.assertEqual([line.split("\t")[0] for line in users], ["userB", "userC"])
+
+    @patch('src.services.starneighbours.github_async.get_stargazer_logins')
+    async def test_get_repository_neighbours_no_stargazers(self, mock_get_stargazer_logins):
+        mock_get_stargazer_logins.return_value = []
+
+        neighbours = await get_repository_neighbours("owner", "repo")
+
+        self.assertEqual(neighbours, [])
+
+    @patch('src.services.starneighbours.github_async.get_repository')
+    @patch('src.services.starneighbours.github_async.get_stargazer_logins_page')
+    @patch('src.services.starneighbours.github_async.fetch_starred_repos')
+    async def test_get_repository_neighbours_approximate(self, mock_fetch_starred_repos,
+                                                         mock_get_stargazer_logins_page, mock_get_repository):
+        mock_get_repository.return_value = {"stargazers_count": 1000}
+        mock_get_stargazer_logins_page.side_effect = lambda owner, repo, page: [f"user{page}-{i}" for i in range(100)]
+        mock_fetch_starred_repos.return_value = StarredFetch([StarredRepo("owner/repo1", 10)])
+
+        result = await get_repository_neighbours_result("owner", "repo",
+                                                        sampling=Sampling(size=150, strategy="recent",
+                                                                          max_starred_per_user=10))
+
+        # Only the last two pages are fetched, and the latest stargazers are kept
+        self.assertEqual(sorted(call.args[2] for call in mock_get_stargazer_logins_page.await_args_list), [9, 10])
+        mock_fetch_starred_repos.assert_any_await("user10-99", max_items=10)
+        self.assertEqual(mock_fetch_starred_repos.await_count, 150)
+        self.assertEqual(result["mode"], "approximate")
+        self.assertEqual((result["total"], result["stargazersCount"]), (150, 1000))
+        neighbour = result["neighbours"][0]
+        self.assertEqual((neighbour["shared"], neighbour["score"], neighbour["estimatedShared"]), (150, 1000, 1000))
+
+    @patch('src.services.starneighbours.github_async.get_repository')
+    @patch('src.services.starneighbours.github_async.get_stargazer_logins')
+    @patch('src.services.starneighbours.github_async.fetch_starred_repos')
+    async def test_get_repository_neighbours_small_repository_is_exact(self, mock_fetch_starred_repos,
+                                                                       mock_get_stargazer_logins,
+                                                                       mock_get_repository):
+        mock_get_repository.return_value = {"stargazers_count": 2}
+        mock_get_stargazer_logins.return_value = ["userA", "userB"]
+        mock_fetch_starred_repos.return_value = StarredFetch([StarredRepo("owner/repo1", 10)])
+
+        result = await get_repository_neighbours_result("owner", "repo", sampling=Sampling(size=100))
+
+        self.assertEqual(result["mode"], "exact")
+        self.assertNotIn("estimatedShared", result["neighbours"][0])
+
+    @patch('src.services.starneighbours.sync_stargazers')
+    @patch('src.services.starneighbours.github_async.fetch_starred_repos')
+    async def test_get_repository_neighbours_applies_stargazer_delta(self, mock_fetch_starred_repos,
+                                                                     mock_sync_stargazers):
+        mock_fetch_starred_repos.return_value = StarredFetch([StarredRepo("owner/repo1", 10)])
+        with tempfile.TemporaryDirectory() as directory, \
+                patch('src.services.starneighbours.stargazer_store',
+                      StargazerStore(os.path.join(directory, "stargazers.db"))):
+            mock_sync_stargazers.return_value = StargazerDelta(["userA", "userB"], added=["userA", "userB"])
+            await get_repository_neighbours("owner", "repo")
+
+            mock_fetch_starred_repos.reset_mock()
+            neighbours_cache.clear()
+            mock_sync_stargazers.return_value = StargazerDelta(["userB", "userC"], added=["userC"],
+                                                               removed=["userA"])
+            neighbours = await get_repository_neighbours("owner", "repo")
+
+        # Only the starred repositories of the new stargazer are fetched
+        mock_fetch_starred_repos.assert_awaited_once_with("userC", max_items=None)
+        self.assertEqual(neighbours[0]["stargazers"], ["userB", "userC"])
+
+    @patch('src.services.starneighbours.github_async.get_stargazer_logins')
+    @patch('src.services.starneighbours.github_async.fetch_starred_repos')
+    async def test_get_repository_neighbours_is_cached(self, mock_fetch_starred_repos, mock_get_stargazer_logins):
+        mock_get_stargazer_logins.return_value = ["userA"]
+        mock_fetch_starred_repos.return_value = StarredFetch([StarredRepo("owner/repo1", 10)])
+
+        first = await get_repository_neighbours("Owner", "repo")
+        second = await get_repository_neighbours("owner", "repo")
+
+        self.assertEqual(first, second)
+        mock_get_stargazer_logins.assert_awaited_once()
+
+    @patch('src.services.starneighbours.github_async.get_stargazer_logins')
+    @patch('src.services.starneighbours.github_async.fetch_starred_repos')
+    async def test_stale_result_is_served_while_revalidated(self, mock_fetch_starred_repos, mock_get_stargazer_logins):
+        mock_get_stargazer_logins.return_value = ["userA"]
+        mock_fetch_starred_repos.return_value = StarredFetch([StarredRepo("owner/repo1", 10)])
+        cache = ResultCache(max_entries=10, ttl=3600, max_stale=60)
+
+        with patch('src.services.starneighbours.neighbours_cache', cache):
+            first = await get_repository_neighbours_entry("owner", "repo")
+            first.expires_at = time.time() - 1
+            mock_fetch_starred_repos.return_value = StarredFetch([StarredRepo("owner/repo2", 10)])
+
+            stale = await get_repository_neighbours_entry("owner", "repo")
+            self.assertIs(stale, first)
+            await asyncio.gather(*_revalidating.values())
+            fresh = await get_repository_neighbours_entry("owner", "repo")
+
+            # Repositories without neighbours are cached shortly
+            mock_get_stargazer_logins.return_value = []
+            negative = await get_repository_neighbours_entry("owner", "empty")
+
+        self.assertEqual(mock_get_stargazer_logins.await_count, 3)
+        self.assertTrue(fresh.fresh)
+        self.assertNotEqual(fresh.etag, first.etag)
+        self.assertEqual(fresh.value["neighbours"][0]["repo"], "owner/repo2")
+        self.assertLessEqual(negative.max_age, NEIGHBOURS_NEGATIVE_CACHE_TTL)
+
+    @patch('src.services.starneighbours.github_async.get_stargazer_logins')
+    @patch('src.services.starneighbours.github_async.fetch_starred_repos')
+    async def test_refresh_repository_neighbours(self, mock_fetch_starred_repos, mock_get_stargazer_logins):
+        mock_get_stargazer_logins.return_value = ["userA"]
+        mock_fetch_starred_repos.return_value = StarredFetch([StarredRepo("owner/repo1", 10)])
+        cache = ResultCache(max_entries=10, ttl=300)
+
+        with patch('src.services.starneighbours.neighbours_cache', cache):
+            first = await refresh_repository_neighbours("owner", "repo")
+            # A result fresh long enough is kept, otherwise it is computed again
+            self.assertIs(await refresh_repository_neighbours("owner", "repo", min_ttl=60), first)
+            refreshed = await refresh_repository_neighbours("owner", "repo", min_ttl=600)
+            cached = await get_repository_neighbours_entry("owner", "repo")
+
+        self.assertEqual(mock_get_stargazer_logins.await_count, 2)
+        self.assertIsNot(refreshed, first)
+        self.assertIs(cached, refreshed)
+
+    @patch('src.services.starneighbours.github_async.get_stargazer_logins')
+    @patch('src.services.starneighbours.github_async.fetch_starred_repos')
+    async def test_iter_batch_neighbours(self, mock_fetch_starred_repos, mock_get_stargazer_logins):
+        stargazers = {("owner", "repoA"): ["userA", "userB"], ("owner", "repoB"): ["userB", "userC"]}
+
+        async def get_stargazer_logins(owner, repo):
+            if (owner, repo) not in stargazers:
+                raise GitHubAPIException("Not Found", code=404)
+            return stargazers[(owner, repo)]
+
+        mock_get_stargazer_logins.side_effect = get_stargazer_logins
+        mock_fetch_starred_repos.return_value = StarredFetch([StarredRepo("owner/hub", 5)])
+        repositories = ["owner/repoA", "owner/repoB", "owner/missing", "Owner/repoA"]
+
+        frames = {frame["repository"]: frame async for frame in iter_batch_neighbours(repositories, limit=10)}
+
+        self.assertEqual(set(frames), {"owner/repoA", "owner/repoB", "owner/missing"})
+        self.assertEqual(frames["owner/missing"], {"type": "error", "repository": "owner/missing", "status": 404,
+                                                   "detail": "Not Found"})
+        self.assertEqual(frames["owner/repoA"]["neighbours"][0]["shared"], 2)
+        self.assertEqual(frames["owner/repoB"]["neighbours"][0]["shared"], 2)
+        # userB starred both repositories, their list is fetched once
+        self.assertEqual(sorted(call.args[0] for call in mock_fetch_starred_repos.await_args_list),
+                         ["userA", "userB", "userC"])
+
+        # The results are shared with the single repository computations
+        self.assertEqual(await get_repository_neighbours("owner", "repoB", limit=10),
+                         frames["owner/repoB"]["neighbours"])
+        self.assertEqual(mock_fetch_starred_repos.await_count, 3)
 
-        mock_get_stargazers.assert_called_once_with(owner, repo)
+    @patch('src.services.starneighbours.github_async.get_stargazers_since')
+    @patch('src.services.starneighbours.github_async.get_repository')
+    @patch('src.services.starneighbours.github_async.fetch_starred_repos')
+    async def test_get_repository_neighbours_from_archives(self, mock_fetch_starred_repos, mock_get_repository,
+                                                           mock_get_stargazers_since):
+        mock_get_repository.return_value = {"stargazers_count": 3}
+        mock_get_stargazers_since.return_value = [Stargazer("userC", "2024-01-02T00:00:00Z")]
+        mock_fetch_starred_repos.return_value = StarredFetch([StarredRepo("owner/repo", 3),
+                                                              StarredRepo("owner/repo1", 10)])
 
-        mock_get_starred_repos_for_user.assert_any_call(
-            mock_stargazers[0])
+        with tempfile.TemporaryDirectory() as directory:
+            graph = StarGraph(directory)
+            graph.ingest_events([("userA", "owner/repo"), ("userA", "owner/repo1"), ("userB", "owner/repo")],
+                                archived_until="2024-01-01T00:00:00Z")
+            graph.ingest([("userA", [StarredRepo("owner/repo", 3), StarredRepo("owner/repo1", 10)])])
+            with patch('src.services.starneighbours.star_graph', graph):
+                result = await get_repository_neighbours_result("owner", "repo")
 
-        expected_neighbours = [
-            {"repo": "owner/repo1", "stargazers": sorted(["userA", "userB"])},
-            {"repo": "owner/repo2", "stargazers": sorted(["userA", "userB"])}
-        ]
+                mock_get_repository.return_value = {"stargazers_count": 4}
+                with patch('src.services.starneighbours.github_async.get_stargazer_logins',
+                           return_value=["userA", "userB", "userC", "userD"]):
+                    exact = await get_repository_neighbours_result("owner", "repo", limit=10)
 
-        for neighbour in neighbours:
-            stargazers = neighbour["stargazers"]
-            if neighbour["repo"] == "owner/repo1":
-                self.assertCountEqual(stargazers, ["userA", "userB"])
-            elif neighbour["repo"] == "owner/repo2":
-                self.assertCountEqual(stargazers, ["userA", "userB"])
+        mock_get_stargazers_since.assert_any_await("owner", "repo", "2024-01-01T00:00:00Z", 3)
+        # The list of userA was fetched whole, the list of userB is only known from the archives
+        self.assertEqual(sorted(call.args[0] for call in mock_fetch_starred_repos.await_args_list[:2]),
+                         ["userB", "userC"])
+        self.assertEqual(result["mode"], "archive")
+        self.assertEqual(result["neighbours"][0]["repo"], "owner/repo1")
+        self.assertEqual(result["neighbours"][0]["stargazers"], ["userA", "userB", "userC"])
+        # The star graph doesn't know every stargazer, they are fetched from GitHub
+        self.assertEqual(exact["mode"], "exact")
 
 
 if __name__ == '__main__':
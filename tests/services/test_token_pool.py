@@ -0,0 +1,59 @@
+import time
+import unittest
+
+from src.services.token_pool import TokenPool, NoTokenAvailable
+
+
+def _rate_limit_headers(remaining: int) -> dict:
+    return {"X-RateLimit-Remaining": str(remaining), "X-RateLimit-Limit": "5000",
+            "X-RateLimit-Reset": str(int(time.time()) + 600)}
+
+
+class TestTokenPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = TokenPool.from_tokens(["token_a", "token_b"])
+        self.token_a, self.token_b = self.pool.tokens
+
+    def test_acquire_spreads_by_remaining_quota(self):
+        self.token_a.scheduler.update(_rate_limit_headers(100))
+        self.token_b.scheduler.update(_rate_limit_headers(4000))
+
+        self.assertIs(self.pool.acquire(), self.token_b)
+        self.assertEqual(self.pool.get_remaining_budget(), 4100)
+
+    def test_acquire_alternates_between_unknown_budgets(self):
+        chosen = {self.pool.acquire().name for _ in range(4)}
+
+        self.assertEqual(chosen, {self.token_a.name, self.token_b.name})
+
+    def test_exhausted_token_is_skipped(self):
+        self.token_a.scheduler.update(_rate_limit_headers(0))
+        self.token_b.scheduler.update(_rate_limit_headers(1))
+
+        self.assertIs(self.pool.acquire(), self.token_b)
+
+    def test_unauthorized_token_is_removed(self):
+        self.pool.report(self.token_a, 401)
+
+        self.assertTrue(self.token_a.disabled)
+        for _ in range(3):
+            self.assertIs(self.pool.acquire(), self.token_b)
+
+        self.pool.report(self.token_b, 401)
+        with self.assertRaises(NoTokenAvailable):
+            self.pool.acquire()
+
+    def test_get_stats(self):
+        self.pool.acquire()
+        self.pool.report(self.token_a, 403)
+
+        stats = {stat["token"]: stat for stat in self.pool.get_stats()}
+
+        self.assertEqual(stats["token-...en_a"]["rateLimited"], 1)
+        self.assertEqual(sum(stat["requests"] for stat in stats.values()), 1)
+        self.assertNotIn("token_a", str(stats))
+
+
+if __name__ == '__main__':
+    unittest.main()
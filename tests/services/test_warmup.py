@@ -0,0 +1,57 @@
+import time
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from src.services.cache import CachedResult
+from src.services.resilience import record
+from src.services.token_pool import TokenPool
+from src.services.warmup import WarmupScheduler
+
+
+def _entry(starred_lists):
+    return CachedResult({"neighbours": [], "starredLists": starred_lists}, "etag", time.time() + 300)
+
+
+class TestWarmupScheduler(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.pool = TokenPool.from_tokens(["token"])
+        self.pool.tokens[0].scheduler.limit = 1000
+
+    @patch('src.services.warmup.prefetch_starred_repos', new_callable=AsyncMock)
+    @patch('src.services.warmup.refresh_repository_neighbours')
+    async def test_warm(self, mock_refresh, mock_prefetch):
+        async def refresh(owner, repo, min_ttl=None):
+            record(requests=10)
+            return _entry({"capped": ["heavy"]} if min_ttl is not None else {})
+
+        mock_refresh.side_effect = refresh
+        scheduler = WarmupScheduler(["owner/repo"], interval=60, budget_share=0.1, pool=self.pool)
+
+        self.assertEqual(await scheduler.warm(), 20)
+        # The whole list of the heavy starrer is fetched, then the neighbours are computed again with it
+        mock_prefetch.assert_awaited_once_with("heavy")
+        self.assertEqual(mock_refresh.call_count, 2)
+        mock_refresh.assert_any_call("owner", "repo", min_ttl=60)
+        self.assertEqual(scheduler.get_remaining_budget(), 80)
+
+    @patch('src.services.warmup.prefetch_starred_repos', new_callable=AsyncMock)
+    @patch('src.services.warmup.refresh_repository_neighbours')
+    async def test_warm_within_budget(self, mock_refresh, mock_prefetch):
+        async def refresh(owner, repo, min_ttl=None):
+            record(requests=60)
+            return _entry({})
+
+        mock_refresh.side_effect = refresh
+        scheduler = WarmupScheduler(["owner/repo1", "owner/repo2", "owner/repo3"], interval=60, budget_share=0.1,
+                                    pool=self.pool)
+
+        # 100 requests can be made: the second repository overshoots the budget, the third one is skipped
+        self.assertEqual(await scheduler.warm(), 120)
+        self.assertEqual([call.args for call in mock_refresh.call_args_list], [("owner", "repo1"), ("owner", "repo2")])
+        mock_prefetch.assert_not_awaited()
+        self.assertEqual(await scheduler.warm(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
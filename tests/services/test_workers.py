@@ -0,0 +1,54 @@
+import asyncio
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from src.services.workers import ProcessLock, stampede_lock
+
+
+class TestProcessLock(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_locks_exclude_each_other(self):
+        first, second = ProcessLock("key", self.directory.name), ProcessLock("key", self.directory.name)
+
+        self.assertTrue(first.try_acquire())
+        self.assertFalse(second.try_acquire())
+        self.assertTrue(ProcessLock("other", self.directory.name).try_acquire())
+
+        first.release()
+        self.assertTrue(second.try_acquire())
+        second.release()
+
+    async def test_async_context_manager_waits(self):
+        holder = ProcessLock("key", self.directory.name)
+        holder.try_acquire()
+        asyncio.get_running_loop().call_later(0.1, holder.release)
+
+        waiter = ProcessLock("key", self.directory.name)
+        async with waiter:
+            self.assertTrue(waiter.locked)
+            self.assertFalse(holder.locked)
+        self.assertFalse(waiter.locked)
+
+    async def test_stampede_lock_is_reentrant(self):
+        with patch('src.services.workers.LOCK_STRIPES', 1), \
+                patch('src.services.workers.ProcessLock', lambda name: ProcessLock(name, self.directory.name)):
+            async def nested():
+                async with stampede_lock("starred:userA"):
+                    return True
+
+            # The keys share the single stripe, the nested lock is taken by a task the holder created
+            async with stampede_lock("neighbours:owner/repo"):
+                self.assertTrue(await asyncio.wait_for(asyncio.create_task(nested()), 1))
+                self.assertFalse(ProcessLock("stripe-0", self.directory.name).try_acquire())
+            self.assertTrue(await asyncio.wait_for(nested(), 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,9 @@
 import unittest
+from unittest.mock import patch
 
-from src.utils.jwt_handler import JWTHandler, AuthenticationError
+import jwt
+
+from src.utils.jwt_handler import JWTHandler, AuthenticationError, VerifiedTokenCache
 
 
 class TestJWTHandler(unittest.TestCase):
@@ -12,6 +15,7 @@ class TestJWTHandler(unittest.TestCase):
         JWTHandler.access_token_lifetime = 300
         JWTHandler.refresh_token_lifetime = 1800
         self.user_info = {"userName": "Test"}
+        JWTHandler.verified_tokens.clear()
 
     def test_generate_authentication_tokens(self):
         tokens = JWTHandler.generate_authentication_tokens(self.user_info)
@@ -40,6 +44,30 @@ class TestJWTHandler(unittest.TestCase):
         decoded = JWTHandler.decode_token(tokens["accessToken"], JWTHandler.access_secret)
         self.assertEqual(decoded["userName"], self.user_info["userName"])
 
+    def test_authenticate_caches_verified_tokens(self):
+        token = JWTHandler.generate_authentication_tokens(self.user_info)["accessToken"]
+        with patch("src.utils.jwt_handler.jwt.decode", wraps=jwt.decode) as mock_decode:
+            JWTHandler.authenticate(token, JWTHandler.access_secret)
+            payload = JWTHandler.authenticate(token, JWTHandler.access_secret)
+        self.assertEqual(payload["userName"], "Test")
+        self.assertEqual(mock_decode.call_count, 1)
+
+    def test_authenticate_cache_is_keyed_by_secret(self):
+        token = JWTHandler.generate_authentication_tokens(self.user_info)["accessToken"]
+        JWTHandler.authenticate(token, JWTHandler.access_secret)
+        with self.assertRaises(AuthenticationError):
+            JWTHandler.authenticate(token, JWTHandler.refresh_secret)
+
+    def test_verified_token_cache_expires_and_is_bounded(self):
+        cache = VerifiedTokenCache(max_entries=1)
+        cache.set(b"expired", 0, {"userName": "A"})
+        self.assertIsNone(cache.get(b"expired"))
+
+        cache.set(b"first", float("inf"), {"userName": "A"})
+        cache.set(b"second", float("inf"), {"userName": "B"})
+        self.assertIsNone(cache.get(b"first"))
+        self.assertEqual(cache.get(b"second"), {"userName": "B"})
+
     def test_check_secrets_invalid(self):
         JWTHandler.access_secret = "same_secret"
         JWTHandler.refresh_secret = "same_secret"
@@ -0,0 +1,49 @@
+import unittest
+
+from src.utils.metrics import Counter, Histogram, GaugeCollector, MetricsRegistry
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_counter(self):
+        counter = Counter("requests_total", "Requests", ("endpoint",), registry=self.registry)
+        counter.inc(endpoint="/users/{login}/starred")
+        counter.inc(2, endpoint="/users/{login}/starred")
+
+        self.assertEqual(counter.get(endpoint="/users/{login}/starred"), 3)
+        self.assertIn('requests_total{endpoint="/users/{login}/starred"} 3', self.registry.render())
+        with self.assertRaises(ValueError):
+            counter.inc(status=200)
+
+    def test_histogram(self):
+        histogram = Histogram("duration_seconds", "Duration", ("phase",), buckets=(0.1, 1), registry=self.registry)
+        histogram.observe(0.05, phase="fanout")
+        histogram.observe(0.5, phase="fanout")
+        histogram.observe(5, phase="fanout")
+
+        rendered = self.registry.render()
+        self.assertIn("# TYPE duration_seconds histogram", rendered)
+        self.assertIn('duration_seconds_bucket{phase="fanout",le="0.1"} 1', rendered)
+        self.assertIn('duration_seconds_bucket{phase="fanout",le="1"} 2', rendered)
+        self.assertIn('duration_seconds_bucket{phase="fanout",le="+Inf"} 3', rendered)
+        self.assertIn('duration_seconds_sum{phase="fanout"} 5.55', rendered)
+        self.assertIn('duration_seconds_count{phase="fanout"} 3', rendered)
+
+    def test_gauge_collector(self):
+        GaugeCollector("remaining", "Remaining requests", lambda: [({"token": 'a"b'}, 10), ({"token": "c"}, None)],
+                       ("token",), registry=self.registry)
+        rendered = self.registry.render()
+        self.assertIn('remaining{token="a\\"b"} 10', rendered)
+        self.assertNotIn('token="c"', rendered)
+
+    def test_duplicate_name(self):
+        Counter("requests_total", "Requests", registry=self.registry)
+        with self.assertRaises(ValueError):
+            Counter("requests_total", "Requests", registry=self.registry)
+
+
+if __name__ == "__main__":
+    unittest.main()